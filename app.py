@@ -1,5 +1,4 @@
-from flask import Flask, render_template, request, jsonify, session, url_for, redirect, flash
-from joblib import load
+from flask import Flask, render_template, request, jsonify, session, url_for, redirect, flash, g, has_app_context, Response
 import mysql.connector
 import numpy as np
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -7,14 +6,56 @@ from datetime import timedelta, datetime
 import os
 from werkzeug.utils import secure_filename
 import pickle
+import csv
+import io
+import logging
+import random
+import threading
+import time
+import click
 from sklearn.preprocessing import LabelEncoder
+from feature_encoder import EncodingError, feature_mapping, record_signature
+from model_registry import ModelRegistry
+from inference import Cascade
+from scoring_pool import ScoringPool
+from micro_batcher import MicroBatcher
+from prediction_cache import PredictionCache, score_records
+from db_pool import ConnectionPool
+from profile_cache import ProfileCache
+from detection_writer import DetectionWriter
+import detection_stats
+import detection_rollups
+import detection_archive
+import user_directory
+import metrics
+from event_stream import EventBroker, sse_stream
+from traffic_features import TrafficFeatureExtractor
+from session_store import ServerSideSessionInterface, SqliteStore, TieredStore, MemoryStore
 
 from flask import Flask, render_template, request, redirect, url_for
 import os
 
 app = Flask(__name__, template_folder='templates')
 
-app.secret_key = os.urandom(24)
+# Only needed for anything still signed with it; sessions themselves are server-side.
+# Set IDS_SECRET_KEY so every worker process uses the same key.
+app.secret_key = os.environ.get('IDS_SECRET_KEY') or os.urandom(24)
+
+# ======================
+# Server-side sessions
+# ======================
+# The cookie holds an opaque session ID. 'sqlite' shares sessions between worker
+# processes (and restarts) through a local file with an in-process LRU in front;
+# 'memory' keeps them in this process only.
+app.config['SESSION_STORE'] = os.environ.get('IDS_SESSION_STORE', 'sqlite')
+app.config['SESSION_DB'] = os.environ.get('IDS_SESSION_DB', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'instance', 'sessions.sqlite3'))
+app.config['SESSION_TTL'] = int(os.environ.get('IDS_SESSION_TTL', 7 * 86400))
+if app.config['SESSION_STORE'] == 'memory':
+    session_store = MemoryStore()
+else:
+    session_store = TieredStore(SqliteStore(app.config['SESSION_DB']))
+app.session_interface = ServerSideSessionInterface(session_store, ttl=app.config['SESSION_TTL'])
 
 UPLOAD_FOLDER = os.path.join(os.path.dirname(
     os.path.abspath(__file__)), 'static', 'uploads')
@@ -48,30 +89,318 @@ flag_types = [
 ]
 
 # ======================
-# Fit encoders in memory
+# Metrics and sampled debug logging
 # ======================
-model = load('models/xgboost_best_model.pkl')
-scaler = load('models/scaler.pkl')
-service_encoder = load('models/service_encoder.pkl')
-label_encoder = load('models/label_encoder.pkl')
-flag_encoder = load('models/flag_encoder.pkl')
-protocol_type_encoder = load('models/protocol_type_encoder.pkl')
-
-feature_columns = [
-'protocol_type','service','flag','src_bytes','dst_bytes','logged_in','count',
-'srv_count','serror_rate','rerror_rate','srv_rerror_rate','same_srv_rate','diff_srv_rate',
-'dst_host_srv_count','dst_host_serror_rate'
-]
-feature_mapping = {name: idx for idx, name in enumerate(feature_columns)}
+STAGE_SECONDS = metrics.Histogram('ids_stage_seconds', 'Time spent in each prediction stage', ['stage'])
+PREDICTIONS = metrics.Counter('ids_predictions_total', 'Predictions served, by label and source', ['label', 'source'])
+ERRORS = metrics.Counter('ids_errors_total', 'Prediction errors, by type', ['type'])
+DB_ACQUIRE_SECONDS = metrics.Histogram('ids_db_acquire_seconds', 'Time to get a pooled database connection')
+
+# Input/output dumps are only logged for a sample of requests, and only at DEBUG level
+predict_log = logging.getLogger('ids.predict')
+app.config['DEBUG_SAMPLE_RATE'] = float(os.environ.get('IDS_DEBUG_SAMPLE_RATE', 0.01))
+
+
+def sample_debug():
+    return predict_log.isEnabledFor(logging.DEBUG) and random.random() < app.config['DEBUG_SAMPLE_RATE']
+
+
+# ======================
+# Model artifacts
+# ======================
+# Loaded from models/ on first use and hot-swapped when the files change
+app.config['MODEL_FILE'] = os.environ.get('IDS_MODEL_FILE', 'xgboost_best_model.pkl')
+app.config['MODEL_CHECK_INTERVAL'] = float(os.environ.get('IDS_MODEL_CHECK_INTERVAL', 2))
+model_registry = ModelRegistry(model_file=app.config['MODEL_FILE'],
+                               check_interval=app.config['MODEL_CHECK_INTERVAL'])
+
+# Optional multi-process scoring for batches (IDS_SCORING_WORKERS=0 keeps it in-process)
+app.config['SCORING_WORKERS'] = int(os.environ.get('IDS_SCORING_WORKERS', 0))
+scoring_pool = ScoringPool(
+    workers=app.config['SCORING_WORKERS'], model_file=app.config['MODEL_FILE']
+) if app.config['SCORING_WORKERS'] > 0 else None
+if scoring_pool is not None:
+    model_registry.subscribe(lambda version: scoring_pool.restart(version.model_file))
+
+
+# Cascade mode (IDS_INFERENCE_MODE=cascade): the decision-tree pre-filter from
+# train_prefilter.py answers the records it is at least IDS_CASCADE_THRESHOLD sure
+# about and only the rest reach the full model. Needs models/prefilter_tree.npz;
+# without it every record takes the full path.
+app.config['INFERENCE_MODE'] = os.environ.get('IDS_INFERENCE_MODE', 'full')
+app.config['CASCADE_THRESHOLD'] = float(os.environ.get('IDS_CASCADE_THRESHOLD', 0.99))
+INFERENCE_MODES = ('full', 'cascade')
+cascade = Cascade(threshold=app.config['CASCADE_THRESHOLD'])
+
+
+def score_features(features):
+    """Score an (n, 15) raw feature matrix, through the cascade if that mode is on."""
+    prefilter = model_registry.current().prefilter
+    if app.config['INFERENCE_MODE'] == 'cascade' and prefilter is not None:
+        return cascade.predict_batch(features, prefilter, full_score_features)
+    return full_score_features(features)
+
+
+def full_score_features(features):
+    """Score an (n, 15) raw feature matrix on the worker pool if enabled, else in-process."""
+    if scoring_pool is not None:
+        # Workers scale and score in their own process, so both count as 'infer' here
+        with STAGE_SECONDS.time(stage='infer'):
+            return scoring_pool.score(features)
+    engine = model_registry.current().engine
+    with STAGE_SECONDS.time(stage='scale'):
+        scaled = engine.scale(features)
+    with STAGE_SECONDS.time(stage='infer'):
+        return engine.predict_scaled(scaled)
+
+
+# Concurrent single-record /predict calls are coalesced into one model call.
+# IDS_MICROBATCH_MAX_SIZE=1 turns coalescing off.
+app.config['MICROBATCH_MAX_SIZE'] = int(os.environ.get('IDS_MICROBATCH_MAX_SIZE', 64))
+app.config['MICROBATCH_MAX_WAIT_MS'] = float(os.environ.get('IDS_MICROBATCH_MAX_WAIT_MS', 2))
+# Batches scored concurrently; defaults to one per scoring worker process so all of them stay busy
+app.config['MICROBATCH_IN_FLIGHT'] = int(os.environ.get('IDS_MICROBATCH_IN_FLIGHT', max(app.config['SCORING_WORKERS'], 1)))
+micro_batcher = MicroBatcher(
+    score_features,
+    max_batch_size=app.config['MICROBATCH_MAX_SIZE'],
+    max_wait=app.config['MICROBATCH_MAX_WAIT_MS'] / 1000.0,
+    max_in_flight=app.config['MICROBATCH_IN_FLIGHT']
+) if app.config['MICROBATCH_MAX_SIZE'] > 1 else None
+
+
+def predict_one(features):
+    """Returns (label, confidence) for one raw feature vector."""
+    if micro_batcher is not None:
+        return micro_batcher.predict(features)
+    labels, confidences = score_features(np.asarray(features, dtype=float).reshape(1, -1))
+    return str(labels[0]), float(confidences[0])
+
+
+# Results for repeated connection signatures, dropped whenever the model version changes.
+# IDS_PREDICTION_CACHE_SIZE=0 turns it off.
+app.config['PREDICTION_CACHE_SIZE'] = int(os.environ.get('IDS_PREDICTION_CACHE_SIZE', 100000))
+app.config['PREDICTION_CACHE_TTL'] = float(os.environ.get('IDS_PREDICTION_CACHE_TTL', 300))
+prediction_cache = PredictionCache(
+    capacity=app.config['PREDICTION_CACHE_SIZE'], ttl=app.config['PREDICTION_CACHE_TTL']
+) if app.config['PREDICTION_CACHE_SIZE'] > 0 else None
+
+
+# ======================
+# Database connection pool
+# ======================
+DB_CONFIG = {
+    'host': 'localhost',
+    'user': 'root',
+    'password': '',
+    'database': 'intrusion_detection_system'
+}
+app.config['DB_POOL_SIZE'] = int(os.environ.get('IDS_DB_POOL_SIZE', 10))
+app.config['DB_POOL_MAX_IDLE'] = int(os.environ.get('IDS_DB_POOL_MAX_IDLE', 300))
+app.config['DB_POOL_HEALTH_CHECK_AFTER'] = int(os.environ.get('IDS_DB_POOL_HEALTH_CHECK_AFTER', 30))
+
+db_pool = ConnectionPool(
+    lambda: mysql.connector.connect(**DB_CONFIG),
+    size=app.config['DB_POOL_SIZE'],
+    max_idle=app.config['DB_POOL_MAX_IDLE'],
+    health_check_after=app.config['DB_POOL_HEALTH_CHECK_AFTER']
+)
+
+
+def acquire_db_connection():
+    with DB_ACQUIRE_SECONDS.time():
+        return db_pool.acquire()
 
 
 def get_db_connection():
-    return mysql.connector.connect(
-        host='localhost',
-        user='root',
-        password='',
-        database='intrusion_detection_system'
-    )
+    # Borrowed from the pool; conn.close() hands it back. Anything a route forgets to
+    # close is returned at the end of the request by release_db_connections().
+    conn = acquire_db_connection()
+    if has_app_context():
+        g.setdefault('db_connections', []).append(conn)
+    return conn
+
+
+@app.teardown_appcontext
+def release_db_connections(exception=None):
+    for conn in g.pop('db_connections', []):
+        conn.close()
+
+
+# ======================
+# Write-behind detection records
+# ======================
+app.config['DETECTION_QUEUE_SIZE'] = int(os.environ.get('IDS_DETECTION_QUEUE_SIZE', 10000))
+app.config['DETECTION_BATCH_SIZE'] = int(os.environ.get('IDS_DETECTION_BATCH_SIZE', 500))
+app.config['DETECTION_FLUSH_INTERVAL'] = float(os.environ.get('IDS_DETECTION_FLUSH_INTERVAL', 1.0))
+
+
+def prepare_detection_writes(cursor):
+    """
+    Run before the writer's first flush. Only cheap statements: the counter and rollup
+    tables are new and small, so creating them never locks detections. Changes to
+    the detections table itself are left to `flask migrate-db`.
+    """
+    detection_stats.ensure_tables(cursor)
+    detection_rollups.ensure_tables(cursor)
+    if not detection_archive.has_features_column(cursor):
+        detection_writer.store_features = False
+        print("detections.features is missing; run `flask migrate-db` (and restart) to keep encoded inputs")
+
+
+detection_writer = DetectionWriter(
+    acquire_db_connection,
+    max_queue=app.config['DETECTION_QUEUE_SIZE'],
+    batch_size=app.config['DETECTION_BATCH_SIZE'],
+    flush_interval=app.config['DETECTION_FLUSH_INTERVAL'],
+    hooks=[detection_stats.apply_batch, detection_rollups.apply_batch],
+    setup=prepare_detection_writes
+)
+
+
+@app.cli.command('migrate-db')
+def migrate_db_command():
+    """Apply the schema changes the app needs (columns, indexes and derived tables), if missing."""
+    conn = db_pool.acquire()
+    cursor = conn.cursor()
+    try:
+        # Adding detections.features and its index rebuilds that table: run this off-peak
+        detection_archive.ensure_schema(cursor)
+        detection_stats.ensure_tables(cursor)
+        detection_rollups.ensure_tables(cursor)
+        user_directory.ensure_indexes(cursor)
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+    print("Database schema is up to date")
+
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recompute the detection_counts and detection_rollups tables from detections."""
+    conn = db_pool.acquire()
+    try:
+        rows, total = detection_stats.rebuild(conn)
+        detection_rollups.rebuild(conn)
+        # Archived detections are no longer in MySQL; add them back from the archive
+        detection_archive.replay_into_stats(conn, archive, detection_writer.hooks)
+    finally:
+        conn.close()
+    print(f"Rebuilt detection_counts: {rows} rows covering {total} detections")
+    print(f"Rebuilt detection_rollups, plus {archive.summary()['rows']} archived detections")
+
+
+# ======================
+# Detection archive
+# ======================
+# Detections older than IDS_ARCHIVE_AFTER_DAYS are moved (with their encoded input
+# features) into day-partitioned column files under IDS_ARCHIVE_DIR. Run
+# `flask archive-detections` from cron, e.g. nightly (after a one-off `flask migrate-db`). The counters and hour rollups
+# keep including archived rows, so the statistics pages are unaffected.
+app.config['ARCHIVE_DIR'] = os.environ.get('IDS_ARCHIVE_DIR', os.path.join(app.instance_path, 'archive'))
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('IDS_ARCHIVE_AFTER_DAYS', 90))
+archive = detection_archive.DetectionArchive(app.config['ARCHIVE_DIR'])
+
+
+def purge_archive():
+    try:
+        removed = archive.purge_deleted()
+        if removed:
+            print(f"Purged {removed} archived detections of deleted users")
+    except Exception as e:
+        print(f"Error purging archived detections: {e}")
+
+
+def forget_archived_user(user_id):
+    """
+    Hide a deleted user's archived detections (a tombstone in the archive index) and
+    rewrite the day files in the background; the next archive run retries a failed purge.
+    """
+    try:
+        archive.delete_user(user_id)
+    except Exception as e:
+        print(f"Error removing archived detections of user {user_id}: {e}")
+        return
+    threading.Thread(target=purge_archive, name='archive-purge', daemon=True).start()
+
+
+@app.cli.command('archive-detections')
+@click.option('--older-than-days', type=int, default=None, help="Defaults to IDS_ARCHIVE_AFTER_DAYS")
+@click.option('--batch-size', type=int, default=10000)
+def archive_detections_command(older_than_days, batch_size):
+    """Move aged detections from MySQL into the columnar archive."""
+    days = app.config['ARCHIVE_AFTER_DAYS'] if older_than_days is None else older_than_days
+    purge_archive()
+    conn = db_pool.acquire()
+    try:
+        moved = detection_archive.archive_aged(conn, archive, timedelta(days=days), batch_size=batch_size)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    finally:
+        conn.close()
+    summary = archive.summary()
+    print(f"Archived {moved} detections older than {days} days; archive holds {summary['rows']} rows "
+          f"over {summary['days']} days ({summary['bytes'] / 1e6:.1f} MB)")
+
+
+# ======================
+# Live detection events (Server-Sent Events)
+# ======================
+# Every new detection is fanned out in-process to connected dashboards; clients that
+# fall IDS_STREAM_BUFFER events behind are dropped and reconnect.
+app.config['STREAM_MAX_CLIENTS'] = int(os.environ.get('IDS_STREAM_MAX_CLIENTS', 100))
+app.config['STREAM_BUFFER'] = int(os.environ.get('IDS_STREAM_BUFFER', 100))
+detection_events = EventBroker(max_subscribers=app.config['STREAM_MAX_CLIENTS'],
+                               max_buffer=app.config['STREAM_BUFFER'])
+
+
+def publish_detections(detections):
+    """Publish (prediction, confidence, user_id, ...) rows from the current request."""
+    username = session.get('username')
+    detected_at = datetime.now().isoformat(timespec='seconds')
+    detection_events.publish_many([
+        {'prediction': detection[0], 'confidence': detection[1], 'user_id': detection[2],
+         'username': username, 'detected_at': detected_at}
+        for detection in detections
+    ])
+
+
+# ======================
+# Cached user profiles (username, email, role, profile_image)
+# ======================
+def load_user_profile(user_id):
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("SELECT username, email, role, profile_image FROM users WHERE id = %s", (user_id,))
+    user = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    return user
+
+
+app.config['PROFILE_CACHE_TTL'] = int(os.environ.get('IDS_PROFILE_CACHE_TTL', 60))
+profile_cache = ProfileCache(load_user_profile, ttl=app.config['PROFILE_CACHE_TTL'])
+
+
+def current_user_is_admin():
+    """
+    Role check for the JSON APIs against the users row (through the profile cache),
+    not session['role'], which is only re-synced when a page renders; a demoted or
+    deleted admin loses access as soon as their cached profile is invalidated.
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        return False
+    user = profile_cache.get(user_id)
+    return bool(user) and user['role'] == 'admin'
+
+
+def sync_session_profile(user):
+    # Only touch keys whose value actually changed, so the session cookie is
+    # reissued only when something is different.
+    for key in ('username', 'role', 'profile_image'):
+        if session.get(key) != user.get(key):
+            session[key] = user.get(key)
 
 
 @app.route('/')
@@ -90,88 +419,52 @@ def predict():
     # service_options = service_encoder.classes_ # Removed encoder options
     # flag_options = flag_encoder.classes_ # Removed encoder options
 
-    conn = None
-    cursor = None
     try:
-        # Get database connection
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
         if request.method == 'POST':
+            started = time.perf_counter()
             # Get the input values from the form
             form_data = request.form.to_dict()
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage='parse')
 
-            print("\n=== Processing New Prediction ===")
-            print(f"Input data: {form_data}")
+            # Separate stage: the first call (or a hot reload) loads the model artifacts
+            with STAGE_SECONDS.time(stage='model_lookup'):
+                version = model_registry.current()
 
-            # Initialize a zero array for 15 features (matching the reduced set)
-            features = np.zeros(15)
-
-            # Use LabelEncoders and scaler for categorical and numerical features
-            try:
-                protocol = form_data['protocol_type'].strip().lower()
-                features[feature_mapping['protocol_type']] = protocol_type_encoder.transform([protocol])[0]
-            except Exception as e:
-                return render_template("predict.html", error=f"Invalid protocol_type: {form_data.get('protocol_type')}", feature_mapping=feature_mapping)
-
-            try:
-                service = form_data['service'].strip().lower()
-                features[feature_mapping['service']] = service_encoder.transform([service])[0]
-            except Exception as e:
-                return render_template("predict.html", error=f"Invalid service: {form_data.get('service')}", feature_mapping=feature_mapping)
-
-            try:
-                flag = form_data['flag'].strip().upper()
-                features[feature_mapping['flag']] = flag_encoder.transform([flag])[0]
-            except Exception as e:
-                return render_template("predict.html", error=f"Invalid flag: {form_data.get('flag')}", feature_mapping=feature_mapping)
-
-            # Robustly handle logged_in field
-            if 'logged_in' in form_data:
-                logged_in_val = form_data['logged_in']
-                if str(logged_in_val).lower() in ['no', '0', 'false']:
-                    features[feature_mapping['logged_in']] = 0
-                else:
-                    features[feature_mapping['logged_in']] = 1
-
-            # Process numerical features
-            for field, index in feature_mapping.items():
-                if field not in ['protocol_type', 'service', 'flag', 'logged_in']:
-                    value = form_data.get(field, '0')
-                    try:
-                        features[index] = float(value)
-                    except ValueError:
-                        return render_template("predict.html",
-                                               error=f"Invalid value for {field}. Please enter a valid number.",
-                                               feature_mapping=feature_mapping)
-
-            # Scale features
-            features_scaled = scaler.transform([features])[0]
-            print("Features (scaled):", features_scaled)
-
-            # Debug: Print features and model output
-            print("Features sent to model:", features_scaled)
+            # Encode categorical and numerical features via the precompiled lookup tables.
+            # Always done (even for cache hits): the encoded vector is stored with the detection.
             try:
-                prediction = model.predict([features_scaled])[0]
-                probabilities = model.predict_proba([features_scaled])[0]
-                print("Model raw prediction:", prediction)
-                print("Model probabilities:", probabilities)
-            except Exception as e:
-                print("Model prediction error:", e)
-                return render_template("predict.html", error="Model prediction error: {}".format(e), feature_mapping=feature_mapping)
+                with STAGE_SECONDS.time(stage='encode'):
+                    features = version.encoder.encode_row(form_data)
+            except EncodingError as e:
+                ERRORS.inc(type='encoding')
+                return render_predict_page(error=str(e))
 
-            confidence = float(max(probabilities))
-            prediction_str = label_encoder.inverse_transform([prediction])[0] if hasattr(label_encoder, 'inverse_transform') else ('normal' if prediction == 0 else 'anomaly')
+            # Repeated connection signatures are answered from the prediction cache
+            signature = record_signature(form_data)
+            cached = prediction_cache.get(signature, version.version) if prediction_cache is not None else None
+            if cached is not None:
+                prediction_str, confidence = cached
+            else:
+                # Scale and score in a single pass (coalesced with concurrent requests)
+                try:
+                    prediction_str, confidence = predict_one(features)
+                except Exception as e:
+                    ERRORS.inc(type='model')
+                    predict_log.error("Model prediction error: %s", e)
+                    return render_predict_page(error="Model prediction error: {}".format(e))
+                if prediction_cache is not None:
+                    prediction_cache.put(signature, (prediction_str, confidence), version.version)
 
-            print(f"\nPrediction: {prediction_str}")
-            print(f"Confidence: {confidence}")
+            PREDICTIONS.inc(label=prediction_str, source='form')
+            if sample_debug():
+                predict_log.debug("Prediction %s (%.4f, cached=%s) for %s", prediction_str, confidence,
+                                  cached is not None, form_data)
 
-            # Save to database
-            cursor.execute(
-                "INSERT INTO detections (prediction, confidence, user_id) VALUES (%s, %s, %s)",
-                (prediction_str, confidence, session['user_id'])
-            )
-            conn.commit()
+            # Queue for the write-behind detection writer (batched insert off the request path)
+            with STAGE_SECONDS.time(stage='db_write'):
+                if not detection_writer.record(prediction_str, confidence, session['user_id'], features):
+                    ERRORS.inc(type='detection_dropped')
+            publish_detections([(prediction_str, confidence, session['user_id'])])
 
             # Store prediction results in session for the result page
             session['last_prediction'] = {
@@ -179,24 +472,277 @@ def predict():
                 'confidence': f"{confidence:.2%}"
             }
 
-            return redirect(url_for('result'))
+            # The result page itself is rendered (and timed) by result()
+            response = redirect(url_for('result'))
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage='total')
+            return response
 
-        return render_template(
-            "predict.html",
+        return render_predict_page(
             # protocol_type_options=protocol_type_options, # Removed encoder options
             # service_options=service_options, # Removed encoder options
             # flag_options=flag_options, # Removed encoder options
-            feature_mapping=feature_mapping
         )
     except Exception as e:
-        print(f"Database error in predict: {str(e)}")
-        return render_template("predict.html", error="An error occurred while processing your request.",
-                               feature_mapping=feature_mapping)
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+        ERRORS.inc(type='internal')
+        predict_log.exception("Error in predict: %s", e)
+        return render_predict_page(error="An error occurred while processing your request.")
+
+
+def render_predict_page(**context):
+    """Render predict.html, timed as the 'render' stage."""
+    with STAGE_SECONDS.time(stage='render'):
+        return render_template("predict.html", feature_mapping=feature_mapping, **context)
+
+
+def score_and_record(records, source):
+    """
+    Score a list of raw record dicts and queue/publish the detections for the
+    logged-in user. Returns (results, saved): one {'prediction', 'confidence'} or
+    {'error'} dict per record, and how many detections the writer accepted.
+    Model errors propagate to the caller.
+    """
+    version = model_registry.current()
+    # Encoded once for the whole batch: scoring uses the cache misses, storage every row
+    with STAGE_SECONDS.time(stage='encode'):
+        encoded = version.encoder.encode_batch(records)
+    with STAGE_SECONDS.time(stage='batch'):
+        scored = score_records(records, version.encoder, score_features, prediction_cache, version.version,
+                               encoded=encoded)
+
+    results = []
+    detections = []
+    for i, (label, confidence, error) in enumerate(scored):
+        if error is not None:
+            results.append({'error': error})
+        else:
+            results.append({'prediction': label, 'confidence': confidence})
+            detections.append((label, confidence, session['user_id'], encoded[0][i]))
+    for label in ('normal', 'anomaly'):
+        count = sum(1 for detection in detections if detection[0] == label)
+        if count:
+            PREDICTIONS.inc(count, label=label, source=source)
+    if len(detections) < len(records):
+        ERRORS.inc(len(records) - len(detections), type='encoding')
+
+    with STAGE_SECONDS.time(stage='db_write'):
+        accepted = detection_writer.record_many(detections)
+    if accepted < len(detections):
+        ERRORS.inc(len(detections) - accepted, type='detection_dropped')
+    publish_detections(detections)
+    return results, accepted
+
+
+@app.route('/api/predict/batch', methods=['POST'])
+def predict_batch():
+    if not session.get('user_id'):
+        return jsonify({'success': False, 'message': 'Login required'}), 401
+
+    # Accept either an uploaded CSV file or a JSON array shaped like static/sample_data.json
+    if 'file' in request.files:
+        upload = request.files['file']
+        text = io.TextIOWrapper(upload.stream, encoding='utf-8-sig')
+        records = list(csv.DictReader(text))
+    else:
+        records = request.get_json(silent=True)
+        if isinstance(records, dict):
+            records = records.get('records')
+    if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+        return jsonify({'success': False, 'message': 'Expected a JSON array of records or a CSV file'}), 400
+    if not records:
+        return jsonify({'success': True, 'count': 0, 'results': []})
+
+    try:
+        results, accepted = score_and_record(records, 'batch')
+    except Exception as e:
+        ERRORS.inc(type='model')
+        predict_log.error("Model prediction error: %s", e)
+        return jsonify({'success': False, 'message': f"Model prediction error: {e}"}), 500
+
+    failed = sum(1 for result in results if 'error' in result)
+    return jsonify({
+        'success': True,
+        'count': len(records),
+        'scored': len(records) - failed,
+        'failed': failed,
+        'saved': accepted,
+        'results': [dict(result, index=i) for i, result in enumerate(results)]
+    })
+
+
+# ======================
+# Raw connection events
+# ======================
+# Events (timestamp, hosts, service, flag, bytes) get their window features from one
+# stateful extractor per process, so send a given network's events to one worker.
+app.config['TRAFFIC_WINDOW_SECONDS'] = float(os.environ.get('IDS_TRAFFIC_WINDOW_SECONDS', 2.0))
+app.config['TRAFFIC_HOST_WINDOW'] = int(os.environ.get('IDS_TRAFFIC_HOST_WINDOW', 100))
+traffic_extractor = TrafficFeatureExtractor(window_seconds=app.config['TRAFFIC_WINDOW_SECONDS'],
+                                            host_window=app.config['TRAFFIC_HOST_WINDOW'])
+
+
+@app.route('/api/ingest/events', methods=['GET', 'POST'])
+def ingest_events():
+    if not session.get('user_id'):
+        return jsonify({'success': False, 'message': 'Login required'}), 401
+    if request.method == 'GET':
+        return jsonify({'success': True, 'extractor': traffic_extractor.status()})
+
+    events = request.get_json(silent=True)
+    if isinstance(events, dict):
+        events = events.get('events')
+    if not isinstance(events, list):
+        return jsonify({'success': False, 'message': 'Expected a JSON array of connection events'}), 400
+
+    with STAGE_SECONDS.time(stage='extract'):
+        records, event_errors = traffic_extractor.process_many(events)
+    valid = [i for i, record in enumerate(records) if record is not None]
+    if event_errors:
+        ERRORS.inc(len(event_errors), type='event')
+    try:
+        scored, accepted = score_and_record([records[i] for i in valid], 'events') if valid else ([], 0)
+    except Exception as e:
+        ERRORS.inc(type='model')
+        predict_log.error("Model prediction error: %s", e)
+        return jsonify({'success': False, 'message': f"Model prediction error: {e}"}), 500
+
+    results = [{'index': i, 'error': message} for i, message in event_errors.items()]
+    for i, result in zip(valid, scored):
+        results.append(dict(result, index=i, features=records[i]))
+    results.sort(key=lambda result: result['index'])
+    failed = sum(1 for result in results if 'error' in result)
+    return jsonify({
+        'success': True,
+        'count': len(events),
+        'scored': len(events) - failed,
+        'failed': failed,
+        'saved': accepted,
+        'results': results
+    })
+
+
+@app.route('/api/scoring/workers', methods=['GET', 'POST'])
+def scoring_workers():
+    if not current_user_is_admin():
+        return jsonify({'success': False, 'message': 'Admin privileges required'}), 403
+    if scoring_pool is None:
+        return jsonify({'success': True, 'enabled': False})
+    if request.method == 'POST':
+        # Graceful restart: new workers take new batches while the old ones drain
+        scoring_pool.restart()
+    return jsonify(dict(scoring_pool.status(), success=True, enabled=True))
+
+
+@app.route('/api/models', methods=['GET', 'POST'])
+def models_status():
+    if not current_user_is_admin():
+        return jsonify({'success': False, 'message': 'Admin privileges required'}), 403
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            if data.get('model_file'):
+                model_registry.set_model(os.path.basename(data['model_file']))
+            else:
+                model_registry.reload()
+        except (OSError, ValueError) as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify(dict(model_registry.status(), success=True))
+
+
+@app.route('/api/scoring/cache', methods=['GET', 'DELETE'])
+def scoring_cache():
+    if not current_user_is_admin():
+        return jsonify({'success': False, 'message': 'Admin privileges required'}), 403
+    if prediction_cache is None:
+        return jsonify({'success': True, 'enabled': False})
+    if request.method == 'DELETE':
+        prediction_cache.clear()
+    return jsonify(dict(prediction_cache.status(), success=True, enabled=True))
+
+
+@app.route('/api/scoring/cascade', methods=['GET', 'POST'])
+def scoring_cascade():
+    if not current_user_is_admin():
+        return jsonify({'success': False, 'message': 'Admin privileges required'}), 403
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        mode = data.get('mode', app.config['INFERENCE_MODE'])
+        try:
+            threshold = float(data.get('threshold', cascade.threshold))
+        except (TypeError, ValueError):
+            threshold = None
+        if mode not in INFERENCE_MODES:
+            return jsonify({'success': False, 'message': f"mode must be one of {', '.join(INFERENCE_MODES)}"}), 400
+        if threshold is None or not 0.0 < threshold <= 1.0:
+            return jsonify({'success': False, 'message': 'threshold must be a number in (0, 1]'}), 400
+        if mode == 'cascade' and model_registry.current().prefilter is None:
+            return jsonify({'success': False, 'message': 'No pre-filter model loaded (run train_prefilter.py)'}), 400
+        if (mode, threshold) != (app.config['INFERENCE_MODE'], cascade.threshold):
+            app.config['INFERENCE_MODE'] = mode
+            cascade.threshold = threshold
+            cascade.reset()
+            # Cached results came from the previous routing
+            if prediction_cache is not None:
+                prediction_cache.clear()
+    return jsonify(dict(cascade.status(), success=True, mode=app.config['INFERENCE_MODE'],
+                        prefilter_loaded=model_registry.current().prefilter is not None))
+
+
+@app.route('/api/scoring/batcher')
+def scoring_batcher():
+    if not current_user_is_admin():
+        return jsonify({'success': False, 'message': 'Admin privileges required'}), 403
+    if micro_batcher is None:
+        return jsonify({'success': True, 'enabled': False})
+    return jsonify(dict(micro_batcher.status(), success=True, enabled=True))
+
+
+# ======================
+# Prometheus metrics endpoint
+# ======================
+# Scrape-time views of the pools, queues and caches, next to the request metrics above
+metrics.Gauge('ids_db_pool_connections', 'Pooled database connections by state',
+              lambda: {('idle',): db_pool.status()['idle'], ('in_use',): db_pool.status()['in_use']}, ['state'])
+metrics.Gauge('ids_detection_writer', 'Write-behind detection writer counters and queue depth',
+              lambda: {(name,): value for name, value in detection_writer.status().items()}, ['field'])
+metrics.Gauge('ids_prediction_cache', 'Prediction cache counters and size',
+              lambda: prediction_cache and {(name,): value for name, value in prediction_cache.status().items()
+                                            if isinstance(value, (int, float))}, ['field'])
+metrics.Gauge('ids_microbatch', 'Micro-batcher counters',
+              lambda: micro_batcher and {(name,): value for name, value in micro_batcher.status().items()
+                                         if isinstance(value, (int, float))}, ['field'])
+metrics.Gauge('ids_cascade_records', 'Records answered by each cascade stage, by label',
+              lambda: {(stage, label): count for stage in ('prefilter', 'full')
+                       for label, count in cascade.status()[stage].items()}, ['stage', 'label'])
+metrics.Gauge('ids_model_info', 'Currently loaded model version',
+              lambda: model_registry.status()['current'] and {
+                  (model_registry.status()['current']['model_file'], model_registry.status()['current']['version']): 1
+              }, ['model_file', 'version'])
+
+metrics.Gauge('ids_detection_stream', 'Live detection stream fan-out counters',
+              lambda: {(name,): value for name, value in detection_events.status().items()}, ['field'])
+
+app.config['METRICS_TOKEN'] = os.environ.get('IDS_METRICS_TOKEN')
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/stream/detections')
+def detection_stream():
+    if not session.get('user_id'):
+        return jsonify({'success': False, 'message': 'Login required'}), 401
+    # Admins watch everyone's detections, users only their own
+    user_id = None if current_user_is_admin() else session['user_id']
+    subscription = detection_events.subscribe(user_id=user_id)
+    if subscription is None:
+        return jsonify({'success': False, 'message': 'Too many live viewers, try again later'}), 503
+    return Response(sse_stream(subscription), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 @app.route('/result')
@@ -204,7 +750,8 @@ def result():
     if not session.get('user_id'):
         return redirect(url_for('login'))
     prediction = session.get('last_prediction', {})
-    return render_template('result.html', prediction=prediction)
+    with STAGE_SECONDS.time(stage='render'):
+        return render_template('result.html', prediction=prediction)
 
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -218,10 +765,17 @@ def login():
         user = cursor.fetchone()
 
         if user and check_password_hash(user['password'], password):
+            session.regenerate()
             session['user_id'] = user['id']
             session['username'] = user['username']
             session['role'] = user['role']
             session['profile_image'] = user.get('profile_image')
+            profile_cache.put(user['id'], {
+                'username': user['username'],
+                'email': user.get('email'),
+                'role': user['role'],
+                'profile_image': user.get('profile_image')
+            })
             return redirect(url_for('index'))
         else:
             flash('Invalid username or password.', 'error')
@@ -239,69 +793,37 @@ def logout():
 @app.route('/statistics')
 def statistics():
     conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
     is_admin = session.get('role') == 'admin'
     user_id = session.get('user_id')
+    # Totals come from the maintained detection_counts table, not a scan of detections
     if is_admin:
         # Admin: show all statistics
-        cursor1 = conn.cursor(dictionary=True)
-        cursor1.execute("SELECT prediction, COUNT(*) as count FROM detections GROUP BY prediction")
-        rows = cursor1.fetchall()
-        stats = {'normal': 0, 'anomaly': 0}
-        total = 0
-        for row in rows:
-            if row['prediction'] in stats:
-                stats[row['prediction']] = row['count']
-                total += row['count']
-        cursor1.close()
-
-        cursor2 = conn.cursor(dictionary=True)
-        cursor2.execute("SELECT COUNT(*) as user_count FROM users")
-        user_count = cursor2.fetchone()['user_count']
-        cursor2.close()
-
-        cursor3 = conn.cursor(dictionary=True)
-        cursor3.execute("""
-            SELECT u.username, COUNT(d.id) as count
-            FROM users u
-            LEFT JOIN detections d ON u.id = d.user_id
-            GROUP BY u.id, u.username
-        """)
-        user_rows = cursor3.fetchall()
+        stats, total = detection_stats.label_totals(cursor, all_users=True)
+
+        cursor.execute("SELECT COUNT(*) as user_count FROM users")
+        user_count = cursor.fetchone()['user_count']
+
         user_stats = []
-        for row in user_rows:
+        for row in detection_stats.user_totals(cursor):
             percentage = (row['count'] / total * 100) if total > 0 else 0
             user_stats.append({
                 'username': row['username'],
                 'count': row['count'],
                 'percentage': f"{percentage:.2f}%"
             })
-        cursor3.close()
     else:
         # Regular user: show only their statistics
-        cursor1 = conn.cursor(dictionary=True)
-        cursor1.execute("SELECT prediction, COUNT(*) as count FROM detections WHERE user_id=%s GROUP BY prediction", (user_id,))
-        rows = cursor1.fetchall()
-        stats = {'normal': 0, 'anomaly': 0}
-        total = 0
-        for row in rows:
-            if row['prediction'] in stats:
-                stats[row['prediction']] = row['count']
-                total += row['count']
-        cursor1.close()
+        stats, total = detection_stats.label_totals(cursor, user_id)
         user_count = 1
-        cursor2 = conn.cursor(dictionary=True)
-        cursor2.execute("SELECT username FROM users WHERE id=%s", (user_id,))
-        username_row = cursor2.fetchone()
-        # Always fetch all results before closing
-        while cursor2.fetchone() is not None:
-            pass
-        cursor2.close()
-        username = username_row['username'] if username_row else 'You'
+        user = profile_cache.get(user_id) if user_id else None
+        username = user['username'] if user else 'You'
         user_stats = [{
             'username': username,
             'count': total,
             'percentage': '100%' if total > 0 else '0%'
         }]
+    cursor.close()
     conn.close()
     return render_template(
         'statistics.html',
@@ -309,34 +831,167 @@ def statistics():
         total=total,
         is_admin=is_admin,
         user_stats=user_stats,
-        user_count=user_count
+        user_count=user_count,
+        archive_summary=archive.summary() if is_admin else None
     )
 
 
+_timeseries_cache = {}  # (window, bucket, user_id) -> (monotonic time, response)
+_timeseries_lock = threading.Lock()
+TIMESERIES_CACHE_MAX = 256
+
+
+@app.route('/api/stats/timeseries')
+def stats_timeseries():
+    if not session.get('user_id'):
+        return jsonify({'success': False, 'message': 'Login required'}), 401
+    try:
+        window = detection_rollups.parse_duration(request.args.get('window', '1h'))
+        bucket = detection_rollups.parse_duration(request.args.get('bucket', '1m'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    # Admins see system-wide numbers, everyone else only their own detections
+    user_id = None if current_user_is_admin() else session['user_id']
+
+    # Dashboards poll this often; identical requests within a second share one query
+    key = (window, bucket, user_id)
+    with _timeseries_lock:
+        cached = _timeseries_cache.get(key)
+    if cached and time.monotonic() - cached[0] < 1.0:
+        return jsonify(cached[1])
+
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        data = detection_rollups.timeseries(cursor, window, bucket, user_id=user_id)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    finally:
+        cursor.close()
+        conn.close()
+    data.update({'success': True, 'window': request.args.get('window', '1h'), 'bucket': request.args.get('bucket', '1m')})
+    now = time.monotonic()
+    with _timeseries_lock:
+        if len(_timeseries_cache) >= TIMESERIES_CACHE_MAX:
+            # Entries are only good for a second; drop the expired ones, or all of them
+            # if that is not enough (many distinct window/bucket/user combinations)
+            for stale in [k for k, (at, _) in _timeseries_cache.items() if now - at >= 1.0]:
+                del _timeseries_cache[stale]
+            if len(_timeseries_cache) >= TIMESERIES_CACHE_MAX:
+                _timeseries_cache.clear()
+        _timeseries_cache[key] = (now, data)
+    return jsonify(data)
+
+
+HISTORY_MAX_ROWS = 500
+
+
+def detection_record(detection_id, detected_at, user_id, prediction, confidence, features, encoder):
+    return {
+        'id': int(detection_id),
+        'detected_at': detected_at.isoformat(),
+        'user_id': user_id,
+        'prediction': prediction,
+        'confidence': float(confidence),
+        'features': encoder.decode_row(features) if features is not None else None,
+    }
+
+
+def parse_local_time(value):
+    """ISO 8601 string -> naive local datetime (how detections are stored); offsets are converted."""
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment
+
+
+@app.route('/api/stats/history')
+def stats_history():
+    """
+    Label counts and the newest detections in [start, end), combining rows still in
+    MySQL with the columnar archive. Archived rows were deleted from MySQL when they
+    were archived, so the two parts never overlap.
+    """
+    if not session.get('user_id'):
+        return jsonify({'success': False, 'message': 'Login required'}), 401
+    try:
+        end = parse_local_time(request.args['end']) if request.args.get('end') else datetime.now()
+        start = (parse_local_time(request.args['start']) if request.args.get('start')
+                 else end - timedelta(days=30))
+        limit = max(0, min(int(request.args.get('limit', 50)), HISTORY_MAX_ROWS))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    if start >= end:
+        return jsonify({'success': False, 'message': 'start must be before end'}), 400
+    label = request.args.get('label') or None
+    user_id = None if current_user_is_admin() else session['user_id']
+    encoder = model_registry.current().encoder
+
+    where = "created_at >= %s AND created_at < %s" + (" AND user_id = %s" if user_id is not None else "")
+    params = [start, end] + ([user_id] if user_id is not None else [])
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT prediction, COUNT(*) FROM detections WHERE {where} GROUP BY prediction", params)
+        live_counts = {prediction: int(count) for prediction, count in cursor.fetchall()}
+        rows = []
+        if limit:
+            # Before `flask migrate-db` there are no stored features to return
+            features = 'features' if detection_archive.has_features_column(cursor) else 'NULL'
+            cursor.execute(
+                f"SELECT id, created_at, user_id, prediction, confidence, {features} FROM detections "
+                f"WHERE {where}{' AND prediction = %s' if label else ''} "
+                f"ORDER BY created_at DESC, id DESC LIMIT %s",
+                params + ([label] if label else []) + [limit]
+            )
+            rows = cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+
+    detections = [
+        detection_record(row[0], row[1], row[2], row[3], row[4],
+                         detection_archive.unpack_features([row[5]])[0] if row[5] else None, encoder)
+        for row in rows
+    ]
+    if len(detections) < limit:
+        # The rest of the page comes from the newest matching archived rows
+        older = archive.query(start, end, label=label, user_id=user_id, newest=limit - len(detections))
+        labels = archive.index()['labels']
+        for i in range(len(older['id']) - 1, -1, -1):
+            archived_user = int(older['user_id'][i])
+            detections.append(detection_record(
+                older['id'][i], older['detected_at'][i].astype(datetime), None if archived_user < 0 else archived_user,
+                labels[older['label'][i]], older['confidence'][i], older['features'][i], encoder))
+
+    archived_counts = archive.counts(start, end, user_id=user_id)
+    totals = {name: live_counts.get(name, 0) + archived_counts.get(name, 0)
+              for name in sorted(set(live_counts) | set(archived_counts))}
+    return jsonify({
+        'success': True,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'counts': {'live': live_counts, 'archived': archived_counts, 'total': totals},
+        'detections': detections,
+    })
+
+
 @app.route('/admin/users', methods=['GET', 'POST'])
 def admin_users():
     # Check if user is logged in and is admin
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    
-    # Verify user is admin and get current user data
-    cursor.execute('SELECT id, username, email, role, profile_image FROM users WHERE id = %s', (session['user_id'],))
-    current_user = cursor.fetchone()
+    # Verify user is admin and keep session data current (served from the profile cache)
+    current_user = profile_cache.get(session['user_id'])
     if not current_user or current_user['role'] != 'admin':
         flash('Access denied. Admin privileges required.', 'error')
         return redirect(url_for('index'))
-    
-    # Ensure session data is preserved and current
-    session['username'] = current_user['username']
-    session['role'] = current_user['role']
-    if current_user.get('profile_image'):
-        session['profile_image'] = current_user['profile_image']
-    
-    # Mark session as modified to ensure it's saved
-    session.modified = True
+    sync_session_profile(current_user)
+
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
     # Handle add, delete, and role update
     if request.method == 'POST':
         method = request.form.get('_method', '').upper()
@@ -350,16 +1005,20 @@ def admin_users():
                 try:
                     # First delete all detections associated with this user
                     cursor.execute('DELETE FROM detections WHERE user_id=%s', (user_id,))
+                    detection_stats.delete_user(cursor, user_id)
+                    detection_rollups.delete_user(cursor, user_id)
                     # Then delete the user
                     cursor.execute('DELETE FROM users WHERE id=%s', (user_id,))
                     conn.commit()
-                    flash('User deleted successfully.', 'success')
-                    return jsonify({'success': True, 'message': 'User deleted successfully'})
                 except Exception as e:
                     conn.rollback()
                     print(f"Error deleting user: {e}")
                     flash('Error deleting user. Please try again.', 'error')
                     return jsonify({'success': False, 'message': 'Error deleting user'}), 500
+                profile_cache.invalidate(int(user_id))
+                forget_archived_user(int(user_id))
+                flash('User deleted successfully.', 'success')
+                return jsonify({'success': True, 'message': 'User deleted successfully'})
         elif method == 'PATCH':
             user_id = request.form.get('user_id')
             new_role = request.form.get('role')
@@ -371,6 +1030,7 @@ def admin_users():
                     
                     cursor.execute('UPDATE users SET role=%s WHERE id=%s', (new_role, user_id))
                     conn.commit()
+                    profile_cache.invalidate(int(user_id))
                     flash('User role updated successfully.', 'success')
                     return jsonify({'success': True, 'message': 'User role updated successfully'})
                 except Exception as e:
@@ -397,49 +1057,34 @@ def admin_users():
                                    (username, email, hashed_pw, full_name, role))
                     conn.commit()
                     flash('User added successfully.', 'success')
-    # Query all users and their detection counts
-    cursor.execute('''
-        SELECT u.id, u.username, u.email, u.role, u.full_name, u.profile_image, u.created_at, COUNT(d.id) as detections
-        FROM users u
-        LEFT JOIN detections d ON u.id = d.user_id
-        GROUP BY u.id, u.username, u.email, u.role, u.full_name, u.profile_image, u.created_at
-        ORDER BY u.created_at DESC
-    ''')
-    users = []
-    for row in cursor.fetchall():
-        users.append({
-            'id': row['id'],
-            'username': row['username'],
-            'email': row['email'],
-            'role': row['role'],
-            'full_name': row['full_name'],
-            'profile_image': row['profile_image'],
-            'detections': row['detections'],
-            'joined': row['created_at'].strftime('%Y-%m-%d') if row['created_at'] else '',
-        })
     cursor.close()
     conn.close()
-    
-    # Ensure session is preserved after all operations
-    if 'user_id' in session:
-        # Refresh session data from database
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('SELECT username, email, role, profile_image FROM users WHERE id = %s', (session['user_id'],))
-        user_data = cursor.fetchone()
+
+    # The user table itself is fetched page by page from /api/admin/users
+    return render_template('admin_users.html')
+
+
+@app.route('/api/admin/users')
+def admin_users_api():
+    if not current_user_is_admin():
+        return jsonify({'success': False, 'message': 'Admin privileges required'}), 403
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        users, next_cursor = user_directory.list_users(
+            cursor,
+            limit=request.args.get('limit', 50, type=int),
+            after=request.args.get('cursor') or None,
+            search=(request.args.get('q') or '').strip() or None,
+            sort=request.args.get('sort', 'created_at'),
+            order=request.args.get('order', 'desc'),
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    finally:
         cursor.close()
         conn.close()
-        
-        if user_data:
-            session['username'] = user_data['username']
-            session['role'] = user_data['role']
-            if user_data.get('profile_image'):
-                session['profile_image'] = user_data['profile_image']
-            
-            # Mark session as modified to ensure it's saved
-            session.modified = True
-    
-    return render_template('admin_users.html', users=users)
+    return jsonify({'success': True, 'users': users, 'next_cursor': next_cursor})
 
 
 @app.route('/team')
@@ -478,6 +1123,7 @@ def profile():
             hashed_pw = generate_password_hash(new_password)
             cursor.execute('UPDATE users SET password=%s WHERE id=%s', (hashed_pw, session['user_id']))
         conn.commit()
+        profile_cache.invalidate(session['user_id'])
         message = 'Profile updated successfully.'
     cursor.execute('SELECT * FROM users WHERE id = %s', (session['user_id'],))
     user = cursor.fetchone()
@@ -542,20 +1188,9 @@ def debug_session():
 @app.context_processor
 def inject_profile_image():
     if 'user_id' in session:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT username, email, role, profile_image FROM users WHERE id = %s", (session['user_id'],))
-        user = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        user = profile_cache.get(session['user_id'])
         if user:
-            # Preserve all session data
-            session['username'] = user.get('username')
-            session['role'] = user.get('role')
-            session['profile_image'] = user.get('profile_image')
-            
-            # Mark session as modified to ensure it's saved
-            session.modified = True
+            sync_session_profile(user)
     return dict()
 
 if __name__ == '__main__':
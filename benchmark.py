@@ -0,0 +1,257 @@
+"""
+Offline benchmark of the inference and persistence paths.
+
+Generates synthetic connection records from feature_columns and the encoders'
+vocabularies, then times every stage predict() chains together (encode, scale,
+predict, predict_proba, label inverse_transform, and the fused InferenceEngine
+path, plus the decision-tree pre-filter and the cascade when
+models/prefilter_tree.npz exists) for single rows and several batch sizes, for
+every model file in models/.
+Results are printed as a table and can be written as JSON; pass an earlier JSON
+file with --baseline to flag stages that got slower.
+
+    python benchmark.py -o bench.json
+    python benchmark.py --baseline bench.json --tolerance 0.25
+    python benchmark.py --db            # also time the detections insert (rolled back)
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import time
+import warnings
+from datetime import datetime
+
+import numpy as np
+from joblib import load
+
+from feature_encoder import FeatureEncoder, _normalizers, categorical_columns, feature_columns
+from inference import MODELS_DIR, PREFILTER_FILE, Cascade, InferenceEngine, TreePrefilter
+from model_registry import ENCODER_FILES, LABEL_ENCODER_FILE, SCALER_FILE
+
+DEFAULT_BATCH_SIZES = [1, 8, 64, 512, 4096]
+RATE_COLUMNS = {'serror_rate', 'rerror_rate', 'srv_rerror_rate', 'same_srv_rate', 'diff_srv_rate',
+                'dst_host_serror_rate'}
+
+
+def synthetic_records(n, encoder, seed=0):
+    """n raw record dicts shaped like the prediction form, with valid categorical values."""
+    rng = np.random.default_rng(seed)
+    vocabularies = {
+        # Only values that survive the form's case normalization can be encoded
+        field: [name for name in encoder.lookup[field] if _normalizers[field](name) == name]
+        for field in categorical_columns
+    }
+    columns = {field: rng.choice(vocabularies[field], n) for field in categorical_columns}
+    for field in feature_columns:
+        if field in columns:
+            continue
+        if field in RATE_COLUMNS:
+            columns[field] = np.round(rng.random(n), 2)
+        elif field == 'logged_in':
+            columns[field] = rng.integers(0, 2, n)
+        elif field.endswith('_bytes'):
+            columns[field] = np.floor(rng.lognormal(5, 2.5, n))
+        else:
+            columns[field] = rng.integers(0, 512, n)
+    return [{field: str(columns[field][i]) for field in feature_columns} for i in range(n)]
+
+
+def percentiles(samples):
+    """Latency summary in milliseconds for a list of durations in seconds."""
+    ms = np.asarray(samples) * 1000.0
+    return {
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p90_ms': float(np.percentile(ms, 90)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'max_ms': float(ms.max()),
+        'mean_ms': float(ms.mean()),
+    }
+
+
+def time_stage(fn, iterations, warmup=3):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def bench_pipeline(model, scaler, label_encoder, encoder, records, batch_size, iterations, prefilter=None,
+                   cascade_threshold=0.99):
+    """Per-stage timings for one model at one batch size, on the 15-feature pipeline."""
+    engine = InferenceEngine(model, scaler, label_encoder)
+    chunk = records[:batch_size]
+    if batch_size == 1:
+        encode = lambda: encoder.encode_row(chunk[0])
+        features = encoder.encode_row(chunk[0]).reshape(1, -1)
+    else:
+        encode = lambda: encoder.encode_batch(chunk)
+        features = encoder.encode_batch(chunk)[0]
+    scaled = scaler.transform(features)
+    classes = model.predict(scaled)
+
+    stages = {
+        'encode': encode,
+        'scale': lambda: scaler.transform(features),
+        'predict': lambda: model.predict(scaled),
+        'predict_proba': lambda: model.predict_proba(scaled),
+        'inverse_transform': lambda: label_encoder.inverse_transform(classes),
+        # What the app actually runs: folded scaler + one predict_proba + label lookup
+        'engine': lambda: engine.predict_batch(features),
+        'end_to_end': lambda: engine.predict_batch(
+            encoder.encode_row(chunk[0]).reshape(1, -1) if batch_size == 1 else encoder.encode_batch(chunk)[0]),
+    }
+    if prefilter is not None:
+        # Synthetic records are not real traffic, so the share the tree answers is
+        # only indicative; train_prefilter.py reports it on the dataset.
+        cascade = Cascade(threshold=cascade_threshold)
+        stages['prefilter'] = lambda: prefilter.predict(features)
+        stages['cascade'] = lambda: cascade.predict_batch(features, prefilter, engine.predict_batch)
+    return {name: time_stage(fn, iterations) for name, fn in stages.items()}
+
+
+def bench_model_only(model, n_features, batch_size, iterations, seed=0):
+    """Models with a different input width can only be timed on synthetic scaled matrices."""
+    features = np.random.default_rng(seed).standard_normal((batch_size, n_features))
+    return {
+        'predict': time_stage(lambda: model.predict(features), iterations),
+        'predict_proba': time_stage(lambda: model.predict_proba(features), iterations),
+    }
+
+
+def bench_db_insert(records, batch_size, iterations):
+    """Time the batched detections insert inside a transaction that is rolled back."""
+    import mysql.connector
+    from app import DB_CONFIG
+    from detection_archive import pack_features
+    from detection_writer import INSERT_DETECTION
+
+    rows = [('anomaly', 0.99, None, datetime.now(), pack_features(np.zeros(len(feature_columns))))] * batch_size
+    conn = mysql.connector.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    try:
+        def insert():
+            cursor.executemany(INSERT_DETECTION, rows)
+            conn.rollback()
+        return {'db_insert': time_stage(insert, iterations)}
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def summarize(samples, batch_size):
+    summary = percentiles(samples)
+    summary['rows_per_sec'] = batch_size / (summary['mean_ms'] / 1000.0) if summary['mean_ms'] else 0.0
+    return summary
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of (model, batch_size, stage, old_p50, new_p50) that slowed down past tolerance."""
+    old = {(r['model'], r['batch_size'], r['stage']): r for r in baseline.get('results', [])}
+    regressions = []
+    for r in results:
+        previous = old.get((r['model'], r['batch_size'], r['stage']))
+        if previous and r['p50_ms'] > previous['p50_ms'] * (1 + tolerance):
+            regressions.append((r['model'], r['batch_size'], r['stage'], previous['p50_ms'], r['p50_ms']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the IDS inference pipeline offline.")
+    parser.add_argument('-o', '--output', help="Write results as JSON to this file")
+    parser.add_argument('--batch-sizes', default=','.join(map(str, DEFAULT_BATCH_SIZES)),
+                        help="Comma-separated batch sizes (default %(default)s)")
+    parser.add_argument('--iterations', type=int, default=50, help="Timed runs per stage (default 50)")
+    parser.add_argument('--models', help="Comma-separated model files in models/ (default: every *model*.pkl)")
+    parser.add_argument('--db', action='store_true', help="Also time the detections insert (needs MySQL)")
+    parser.add_argument('--baseline', help="Earlier JSON results to compare p50 latencies against")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Allowed p50 slowdown vs --baseline before it counts as a regression (default 0.2)")
+    parser.add_argument('--cascade-threshold', type=float, default=0.99,
+                        help="Threshold for the 'cascade' stage (timed when models/prefilter_tree.npz exists)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    batch_sizes = [int(size) for size in args.batch_sizes.split(',')]
+    if args.models:
+        model_files = [name.strip() for name in args.models.split(',')]
+    else:
+        model_files = sorted(os.path.basename(p) for p in glob.glob(os.path.join(MODELS_DIR, '*model*.pkl')))
+
+    warnings.filterwarnings('ignore')
+    encoder = FeatureEncoder(*(load(os.path.join(MODELS_DIR, ENCODER_FILES[field])) for field in categorical_columns))
+    scaler = load(os.path.join(MODELS_DIR, SCALER_FILE))
+    label_encoder = load(os.path.join(MODELS_DIR, LABEL_ENCODER_FILE))
+    records = synthetic_records(max(batch_sizes), encoder, seed=args.seed)
+    prefilter_path = os.path.join(MODELS_DIR, PREFILTER_FILE)
+    prefilter = TreePrefilter.load(prefilter_path) if os.path.exists(prefilter_path) else None
+
+    results = []
+    for model_file in model_files:
+        model = load(os.path.join(MODELS_DIR, model_file))
+        n_features = getattr(model, 'n_features_in_', len(feature_columns))
+        full_pipeline = n_features == len(feature_columns)
+        for batch_size in batch_sizes:
+            if full_pipeline:
+                stages = bench_pipeline(model, scaler, label_encoder, encoder, records, batch_size, args.iterations,
+                                        prefilter=prefilter, cascade_threshold=args.cascade_threshold)
+            else:
+                stages = bench_model_only(model, n_features, batch_size, args.iterations, seed=args.seed)
+            for stage, samples in stages.items():
+                results.append(dict(summarize(samples, batch_size), model=model_file, n_features=n_features,
+                                    batch_size=batch_size, stage=stage))
+            print(f"{model_file} batch={batch_size} done", file=sys.stderr)
+
+    if args.db:
+        for batch_size in batch_sizes:
+            for stage, samples in bench_db_insert(records, batch_size, args.iterations).items():
+                results.append(dict(summarize(samples, batch_size), model=None, n_features=None,
+                                    batch_size=batch_size, stage=stage))
+
+    print(f"{'model':<28} {'batch':>6} {'stage':<18} {'p50 ms':>9} {'p99 ms':>9} {'rows/sec':>12}")
+    for r in results:
+        print(f"{r['model'] or '-':<28} {r['batch_size']:>6} {r['stage']:<18} "
+              f"{r['p50_ms']:>9.3f} {r['p99_ms']:>9.3f} {r['rows_per_sec']:>12.0f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'created_at': datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'iterations': args.iterations,
+                'seed': args.seed,
+                'libraries': library_versions(),
+                'results': results,
+            }, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for model_file, batch_size, stage, old_ms, new_ms in regressions:
+            print(f"REGRESSION {model_file} batch={batch_size} {stage}: p50 {old_ms:.3f} -> {new_ms:.3f} ms",
+                  file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+def library_versions():
+    versions = {'numpy': np.__version__}
+    for name in ('sklearn', 'xgboost', 'joblib'):
+        try:
+            versions[name] = __import__(name).__version__
+        except ImportError:
+            versions[name] = None
+    return versions
+
+
+if __name__ == '__main__':
+    sys.exit(main())
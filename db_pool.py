@@ -0,0 +1,151 @@
+import threading
+import time
+
+
+class PoolExhaustedError(Exception):
+    """Raised when no connection becomes available within the acquire timeout."""
+
+
+class PooledConnection:
+    """
+    Wraps a real DB-API connection borrowed from a ConnectionPool.
+
+    Everything is delegated to the underlying connection except close(), which hands
+    the connection back to the pool instead of tearing it down, so existing
+    `conn.close()` calls in the routes keep working unchanged.
+    """
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._returned = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        if not self._returned:
+            self._returned = True
+            self._pool.release(self._raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """
+    Small thread-safe connection pool.
+
+    `connect` is any zero-argument callable returning a DB-API connection, so a
+    stand-in database can be plugged in locally. At most `size` connections exist at
+    once; idle ones are health-checked before reuse when they have been idle for more
+    than `health_check_after` seconds and closed once idle for more than `max_idle`.
+    """
+
+    def __init__(self, connect, size=5, max_idle=300, health_check_after=30, acquire_timeout=10):
+        self._connect = connect
+        self.size = size
+        self.max_idle = max_idle
+        self.health_check_after = health_check_after
+        self.acquire_timeout = acquire_timeout
+        self._idle = []  # (raw connection, time it was returned), most recent last
+        self._in_use = 0
+        self._lock = threading.Condition()
+        self.stats = {'created': 0, 'reused': 0, 'evicted': 0, 'failed_checks': 0}
+
+    def acquire(self, timeout=None):
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                self._evict_idle()
+                if self._idle:
+                    raw, returned_at = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.size:
+                    raw, returned_at = None, None
+                    self._in_use += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhaustedError(f"No database connection available after {timeout}s")
+                self._lock.wait(remaining)
+
+        # Connect / health-check outside the lock so slow handshakes don't block other threads
+        failed_check = False
+        try:
+            if raw is not None and time.monotonic() - returned_at > self.health_check_after and not _is_alive(raw):
+                failed_check = True
+                _close_quietly(raw)
+                raw = None
+            created = raw is None
+            if created:
+                raw = self._connect()
+        except Exception:
+            with self._lock:
+                self.stats['failed_checks'] += failed_check
+                self._in_use -= 1
+                self._lock.notify()
+            raise
+        with self._lock:
+            self.stats['failed_checks'] += failed_check
+            self.stats['created' if created else 'reused'] += 1
+        return PooledConnection(self, raw)
+
+    def release(self, raw):
+        healthy = True
+        try:
+            # Drop any half-read results or open transaction before the next borrower sees it
+            if hasattr(raw, 'consume_results'):
+                raw.consume_results()
+            raw.rollback()
+        except Exception:
+            healthy = False
+        with self._lock:
+            self._in_use -= 1
+            if healthy:
+                self._idle.append((raw, time.monotonic()))
+            self._lock.notify()
+        if not healthy:
+            _close_quietly(raw)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for raw, _ in idle:
+            _close_quietly(raw)
+
+    def status(self):
+        with self._lock:
+            return dict(self.stats, idle=len(self._idle), in_use=self._in_use, size=self.size)
+
+    def _evict_idle(self):
+        # Caller holds the lock. Oldest connections sit at the front of the list.
+        now = time.monotonic()
+        while self._idle and now - self._idle[0][1] > self.max_idle:
+            raw, _ = self._idle.pop(0)
+            self.stats['evicted'] += 1
+            _close_quietly(raw)
+
+
+def _is_alive(raw):
+    try:
+        if hasattr(raw, 'ping'):
+            raw.ping(reconnect=False)
+            return True
+        if hasattr(raw, 'is_connected'):
+            return raw.is_connected()
+        return True
+    except Exception:
+        return False
+
+
+def _close_quietly(raw):
+    try:
+        raw.close()
+    except Exception:
+        pass
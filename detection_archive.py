@@ -0,0 +1,537 @@
+import json
+import os
+import shutil
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from feature_encoder import feature_columns
+
+try:
+    import fcntl
+except ImportError:  # Windows: index writers are only serialised within one process
+    fcntl = None
+
+# ======================
+# Columnar detection archive
+# ======================
+# Aged detections are moved out of MySQL into one directory per day of .npy column
+# files (ids, timestamps, user ids, label codes, confidences and the (n, 15) feature
+# matrix), each sorted by time. index.json keeps, per day, the row count, time span
+# and per-user label counts, so whole-day aggregates never open a column file; range
+# queries memory-map only the days they overlap and binary-search the timestamps.
+# Only one archiver may run at a time (it is meant to be run from cron). Every writer
+# of index.json (archiver, user deletes, rebuilds) holds an flock on .lock.
+#
+# Deleting a user only tombstones them in index.json (a cheap write): readers skip
+# their rows from then on, and purge_deleted() later rewrites the affected days.
+
+INDEX_FILE = 'index.json'
+LOCK_FILE = '.lock'
+LABELS_FILE = 'labels.json'  # per day: label names for the codes in label.npy
+FEATURE_DTYPE = '<f4'
+FEATURE_BYTES = len(feature_columns) * np.dtype(FEATURE_DTYPE).itemsize
+NO_USER = -1
+COLUMNS = ('id', 'detected_at', 'user_id', 'label', 'confidence', 'features')
+
+SELECT_DAY = """
+    SELECT id, created_at, user_id, prediction, confidence, features
+    FROM detections WHERE created_at >= %s AND created_at < %s
+    ORDER BY created_at, id
+"""
+
+
+def pack_features(features):
+    """Encoded (unscaled) feature vector -> the bytes kept in detections.features."""
+    if features is None:
+        return None
+    return np.asarray(features, dtype=FEATURE_DTYPE).tobytes()
+
+
+def unpack_features(blobs):
+    """List of detections.features values -> (n, 15) float32 matrix, NaN rows where missing."""
+    matrix = np.full((len(blobs), len(feature_columns)), np.nan, dtype=np.float32)
+    for i, blob in enumerate(blobs):
+        if blob is not None and len(blob) == FEATURE_BYTES:
+            matrix[i] = np.frombuffer(bytes(blob), dtype=FEATURE_DTYPE)
+    return matrix
+
+
+_has_features_column = False
+
+
+def has_features_column(cursor):
+    """Whether `flask migrate-db` has added detections.features (a yes is remembered)."""
+    global _has_features_column
+    if not _has_features_column:
+        cursor.execute("SHOW COLUMNS FROM detections LIKE 'features'")
+        _has_features_column = bool(cursor.fetchall())
+    return _has_features_column
+
+
+def ensure_schema(cursor):
+    """
+    Add detections.features and the created_at index the archiver scans, if missing.
+    Both rewrite the (large) detections table, so this only runs from `flask migrate-db`.
+    """
+    cursor.execute(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = DATABASE() AND table_name = 'detections'"
+    )
+    columns = {(row['column_name'] if isinstance(row, dict) else row[0]).lower() for row in cursor.fetchall()}
+    if 'features' not in columns:
+        cursor.execute(f"ALTER TABLE detections ADD COLUMN features VARBINARY({FEATURE_BYTES}) NULL")
+    cursor.execute(
+        "SELECT DISTINCT index_name FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = 'detections'"
+    )
+    indexes = {row['index_name'] if isinstance(row, dict) else row[0] for row in cursor.fetchall()}
+    if 'idx_detections_created' not in indexes:
+        cursor.execute("CREATE INDEX idx_detections_created ON detections (created_at, id)")
+
+
+class DetectionArchive:
+    """
+    Reader and writer for the archive directory. Readers pick up index.json changes
+    made by another process (the archiver) on their next call.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._index = None
+        self._index_mtime = None
+        self._mapped = {}  # day -> (generation, {column: memory-mapped array})
+
+    # ---- index ----
+
+    def index(self):
+        index_path = os.path.join(self.path, INDEX_FILE)
+        try:
+            mtime = os.stat(index_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        with self._lock:
+            if self._index is None or mtime != self._index_mtime:
+                if mtime is None:
+                    self._index = {'labels': [], 'feature_columns': list(feature_columns), 'days': {},
+                                   'deleted_users': []}
+                else:
+                    with open(index_path) as f:
+                        self._index = json.load(f)
+                self._index_mtime = mtime
+            return self._index
+
+    @contextmanager
+    def _exclusive(self):
+        """Hold the archive's write lock: threads here, other processes (the archiver) via flock."""
+        os.makedirs(self.path, exist_ok=True)
+        with self._write_lock, open(os.path.join(self.path, LOCK_FILE), 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _editable_index(self):
+        # Caller holds _exclusive(); a private copy until it is written
+        index = json.loads(json.dumps(self.index()))
+        index.setdefault('deleted_users', [])
+        return index
+
+    def _write_index(self, index):
+        os.makedirs(self.path, exist_ok=True)
+        tmp = os.path.join(self.path, INDEX_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        os.replace(tmp, os.path.join(self.path, INDEX_FILE))
+
+    def rebuild_index(self):
+        """Recreate index.json from the day directories (e.g. after an interrupted run)."""
+        with self._exclusive():
+            try:
+                deleted = self.index().get('deleted_users', [])
+            except ValueError:  # unreadable index.json: tombstones are lost, purge them by hand
+                deleted = []
+            return self._rebuild_index(deleted)
+
+    def _rebuild_index(self, deleted):
+        labels = []
+        days = {}
+        for day in sorted(os.listdir(self.path)) if os.path.isdir(self.path) else []:
+            if os.path.isfile(os.path.join(self.path, day, LABELS_FILE)):
+                with open(os.path.join(self.path, day, LABELS_FILE)) as f:
+                    day_labels = json.load(f)
+                # Label codes only ever get appended, so the longest list covers all others
+                labels = day_labels if len(day_labels) > len(labels) else labels
+                days[day] = None
+        for day in days:
+            days[day] = self._day_entry(day, self._read_day(day, mmap=True), len(labels), generation=1)
+        index = {'labels': labels, 'feature_columns': list(feature_columns), 'days': days, 'deleted_users': deleted}
+        self._write_index(index)
+        return index
+
+    # ---- reading ----
+
+    def day_columns(self, day):
+        """Memory-mapped column arrays for one day (read-only)."""
+        entry = self.index()['days'][day]
+        with self._lock:
+            cached = self._mapped.get(day)
+            if cached and cached[0] == entry['generation']:
+                return cached[1]
+        columns = self._read_day(day, mmap=True)
+        with self._lock:
+            self._mapped[day] = (entry['generation'], columns)
+        return columns
+
+    def _read_day(self, day, mmap=False):
+        directory = os.path.join(self.path, day)
+        return {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r' if mmap else None)
+                for name in COLUMNS}
+
+    def _days_between(self, start, end):
+        """Index days overlapping [start, end), oldest first."""
+        days = self.index()['days']
+        first = start.strftime('%Y-%m-%d') if start else None
+        last = end.strftime('%Y-%m-%d') if end else None
+        return [day for day in sorted(days) if (first is None or day >= first) and (last is None or day <= last)]
+
+    def _tombstoned(self, index, entry=None):
+        """Deleted user ids (as a list for np.isin); with `entry`, only those still in that day."""
+        deleted = index.get('deleted_users', [])
+        if entry is not None:
+            deleted = [user for user in deleted if str(user) in entry['counts']]
+        return deleted
+
+    def _slice(self, columns, start, end):
+        times = columns['detected_at']
+        lo = 0 if start is None else int(np.searchsorted(times, np.datetime64(start, 's'), side='left'))
+        hi = len(times) if end is None else int(np.searchsorted(times, np.datetime64(end, 's'), side='left'))
+        return lo, hi
+
+    def query(self, start=None, end=None, label=None, user_id=None, columns=COLUMNS, newest=None):
+        """
+        Archived detections with start <= detected_at < end (datetimes, None = open),
+        optionally only one label and/or one user, as {column: array} in time order.
+        With `newest`, only that many of the most recent matches are returned and
+        older days are not opened at all.
+        """
+        index = self.index()
+        if label is not None and label not in index['labels']:
+            return _empty(columns)
+        if user_id is not None and user_id in self._tombstoned(index):
+            return _empty(columns)
+        code = index['labels'].index(label) if label is not None else None
+        parts = defaultdict(list)
+        remaining = newest
+        for day in reversed(self._days_between(start, end)):
+            if remaining is not None and remaining <= 0:
+                break
+            if user_id is not None and str(user_id) not in index['days'][day]['counts']:
+                continue
+            day_columns = self.day_columns(day)
+            lo, hi = self._slice(day_columns, start, end)
+            if lo >= hi:
+                continue
+            mask = np.ones(hi - lo, dtype=bool)
+            if code is not None:
+                mask &= day_columns['label'][lo:hi] == code
+            if user_id is not None:
+                mask &= day_columns['user_id'][lo:hi] == user_id
+            else:
+                deleted = self._tombstoned(index, index['days'][day])
+                if deleted:
+                    mask &= ~np.isin(day_columns['user_id'][lo:hi], deleted)
+            rows = np.flatnonzero(mask) + lo
+            if remaining is not None:
+                rows = rows[max(len(rows) - remaining, 0):]
+                remaining -= len(rows)
+            for name in columns:
+                parts[name].append(day_columns[name][rows])
+        if not parts:
+            return _empty(columns)
+        return {name: np.concatenate(parts[name][::-1]) for name in columns}
+
+    def counts(self, start=None, end=None, user_id=None):
+        """{label: count} of archived detections in [start, end), optionally for one user."""
+        index = self.index()
+        labels = index['labels']
+        totals = np.zeros(len(labels), dtype=np.int64)
+        if user_id is not None and user_id in self._tombstoned(index):
+            return {label: 0 for label in labels}
+        for day in self._days_between(start, end):
+            entry = index['days'][day]
+            deleted = self._tombstoned(index, entry)
+            day_start = datetime.fromisoformat(entry['first'])
+            day_end = datetime.fromisoformat(entry['last'])
+            if (start is None or start <= day_start) and (end is None or day_end < end):
+                # Whole day inside the range: answered from the index alone
+                if user_id is None:
+                    per_user = [counts for user, counts in entry['counts'].items() if int(user) not in deleted]
+                else:
+                    per_user = [entry['counts'].get(str(user_id))]
+                for counts in per_user:
+                    if counts:
+                        totals[:len(counts)] += counts
+                continue
+            day_columns = self.day_columns(day)
+            lo, hi = self._slice(day_columns, start, end)
+            codes = day_columns['label'][lo:hi]
+            if user_id is not None:
+                codes = codes[day_columns['user_id'][lo:hi] == user_id]
+            elif deleted:
+                codes = codes[~np.isin(day_columns['user_id'][lo:hi], deleted)]
+            totals += np.bincount(codes, minlength=len(labels))[:len(labels)]
+        return {label: int(count) for label, count in zip(labels, totals)}
+
+    def summary(self):
+        days = self.index()['days']
+        if not days:
+            return {'days': 0, 'rows': 0, 'bytes': 0, 'first': None, 'last': None}
+        ordered = sorted(days)
+        return {
+            'days': len(days),
+            'rows': sum(entry['rows'] for entry in days.values()),
+            'bytes': sum(entry['bytes'] for entry in days.values()),
+            'first': days[ordered[0]]['first'],
+            'last': days[ordered[-1]]['last'],
+        }
+
+    def iter_rows(self, start=None, end=None):
+        """Yield per-day lists of (prediction, confidence, user_id, detected_at) rows, like the writer queues."""
+        index = self.index()
+        labels = index['labels']
+        deleted = set(self._tombstoned(index))
+        for day in self._days_between(start, end):
+            columns = self.day_columns(day)
+            lo, hi = self._slice(columns, start, end)
+            yield [
+                (labels[code], confidence, None if user == NO_USER else user, moment)
+                for code, confidence, user, moment in zip(
+                    columns['label'][lo:hi].tolist(), columns['confidence'][lo:hi].tolist(),
+                    columns['user_id'][lo:hi].tolist(), columns['detected_at'][lo:hi].tolist())
+                if user not in deleted
+            ]
+
+    # ---- writing ----
+
+    def append(self, rows):
+        """
+        Add (id, detected_at, user_id, prediction, confidence, features) rows. Each
+        affected day is rewritten in full and swapped in; ids already archived are
+        skipped, so re-running after an interrupted archive is safe.
+        """
+        return self.append_batches([rows])
+
+    def append_batches(self, batches):
+        """
+        append() for an iterable of row lists (e.g. one day fetched page by page).
+        Pages are converted to column arrays as they arrive and every affected day is
+        written once at the end, so archiving a day costs O(rows) I/O. The write lock
+        is only taken for that last step, not while the pages are being fetched.
+        """
+        new_labels = []  # label codes below are into this list until the index is locked
+        parts = defaultdict(list)  # day -> [column dicts]
+        for rows in batches:
+            by_day = defaultdict(list)
+            for row in rows:
+                by_day[row[1].strftime('%Y-%m-%d')].append(row)
+                if row[3] not in new_labels:
+                    new_labels.append(row[3])
+            codes = {label: code for code, label in enumerate(new_labels)}
+            for day, day_rows in by_day.items():
+                parts[day].append({
+                    'id': np.array([row[0] for row in day_rows], dtype=np.int64),
+                    'detected_at': np.array([row[1] for row in day_rows], dtype='datetime64[s]'),
+                    'user_id': np.array([NO_USER if row[2] is None else row[2] for row in day_rows], dtype=np.int32),
+                    'label': np.array([codes[row[3]] for row in day_rows], dtype=np.int8),
+                    'confidence': np.array([row[4] for row in day_rows], dtype=np.float32),
+                    'features': unpack_features([row[5] for row in day_rows]),
+                })
+        if not parts:
+            return 0
+
+        with self._exclusive():
+            index = self._editable_index()
+            labels = index['labels']
+            labels.extend(label for label in new_labels if label not in labels)
+            recode = np.array([labels.index(label) for label in new_labels], dtype=np.int8)
+            deleted = self._tombstoned(index)
+            added = 0
+            changed = False
+            for day, day_parts in sorted(parts.items()):
+                new = {name: np.concatenate([part[name] for part in day_parts]) for name in COLUMNS}
+                new['label'] = recode[new['label']]
+                keep = ~np.isin(new['user_id'], deleted)  # deleted while this batch was being read
+                entry = index['days'].get(day)
+                if entry is not None:
+                    old = self._read_day(day, mmap=True)
+                    keep &= ~np.isin(new['id'], old['id'])
+                if not keep.any():
+                    continue
+                new = {name: values[keep] for name, values in new.items()}
+                if entry is not None:
+                    new = {name: np.concatenate([old[name], new[name]]) for name in COLUMNS}
+                added += int(keep.sum())
+                order = np.lexsort((new['id'], new['detected_at']))
+                new = {name: np.ascontiguousarray(values[order]) for name, values in new.items()}
+                self._write_day(day, new, labels)
+                index['days'][day] = self._day_entry(day, new, len(labels), (entry or {}).get('generation', 0) + 1)
+                changed = True
+            if changed:
+                self._write_index(index)
+        return added
+
+    def delete_user(self, user_id):
+        """
+        Tombstone one user's archived detections: they disappear from queries (and
+        later appends) at once; purge_deleted() removes them from the day files.
+        """
+        with self._exclusive():
+            index = self._editable_index()
+            if user_id not in index['deleted_users']:
+                index['deleted_users'].append(user_id)
+                self._write_index(index)
+
+    def purge_deleted(self):
+        """Rewrite the days still holding tombstoned users' rows; returns how many rows were removed."""
+        with self._exclusive():
+            index = self._editable_index()
+            removed = 0
+            for day, entry in sorted(index['days'].items()):
+                deleted = self._tombstoned(index, entry)
+                if not deleted:
+                    continue
+                columns = self._read_day(day, mmap=True)
+                keep = ~np.isin(columns['user_id'], deleted)
+                removed += int(len(keep) - keep.sum())
+                if not keep.any():
+                    shutil.rmtree(os.path.join(self.path, day), ignore_errors=True)
+                    del index['days'][day]
+                    continue
+                self._write_day(day, columns, index['labels'], keep)
+                index['days'][day] = self._day_entry(day, self._read_day(day, mmap=True), len(index['labels']),
+                                                     entry['generation'] + 1)
+            if removed:
+                self._write_index(index)
+        return removed
+
+    def _write_day(self, day, columns, labels, keep=None):
+        """
+        Write a day's columns (and label names) to a temporary directory and swap it in.
+        With a `keep` mask, only those rows are written, one column in memory at a time.
+        """
+        final = os.path.join(self.path, day)
+        tmp = os.path.join(self.path, f".{day}.tmp")
+        old = os.path.join(self.path, f".{day}.old")
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name in COLUMNS:
+            np.save(os.path.join(tmp, name + '.npy'), columns[name] if keep is None else columns[name][keep])
+        with open(os.path.join(tmp, LABELS_FILE), 'w') as f:
+            json.dump(labels, f)
+        if os.path.exists(final):
+            shutil.rmtree(old, ignore_errors=True)
+            os.rename(final, old)
+        os.rename(tmp, final)
+        shutil.rmtree(old, ignore_errors=True)
+
+    def _day_entry(self, day, columns, n_labels, generation):
+        counts = {}
+        users, labels = columns['user_id'], columns['label']
+        for user in np.unique(users):
+            counts[str(int(user))] = np.bincount(labels[users == user], minlength=n_labels).tolist()
+        directory = os.path.join(self.path, day)
+        return {
+            'rows': int(len(columns['id'])),
+            'first': str(columns['detected_at'][0]),
+            'last': str(columns['detected_at'][-1]),
+            'min_id': int(columns['id'].min()),
+            'max_id': int(columns['id'].max()),
+            'bytes': sum(os.path.getsize(os.path.join(directory, name + '.npy')) for name in COLUMNS),
+            'counts': counts,
+            'generation': generation,
+        }
+
+
+def _empty(columns):
+    empty = {
+        'id': np.empty(0, dtype=np.int64),
+        'detected_at': np.empty(0, dtype='datetime64[s]'),
+        'user_id': np.empty(0, dtype=np.int32),
+        'label': np.empty(0, dtype=np.int8),
+        'confidence': np.empty(0, dtype=np.float32),
+        'features': np.empty((0, len(feature_columns)), dtype=np.float32),
+    }
+    return {name: empty[name] for name in columns}
+
+
+def archive_aged(conn, archive, older_than, batch_size=10000, now=None):
+    """
+    Move detections created before now - older_than (a timedelta) from MySQL into the
+    archive, one day at a time: the day is streamed in pages of `batch_size` rows,
+    written to the archive once, and only then deleted from MySQL (by id, in
+    `batch_size` chunks). Returns the number of rows moved.
+    """
+    cutoff = (now or datetime.now()) - older_than
+    moved = 0
+    after = datetime.min
+    cursor = conn.cursor()
+    try:
+        if not has_features_column(cursor):
+            raise RuntimeError("detections.features is missing; run `flask migrate-db` first")
+        while True:
+            cursor.execute("SELECT MIN(created_at) FROM detections WHERE created_at >= %s AND created_at < %s",
+                           (after, cutoff))
+            first = cursor.fetchone()[0]
+            if first is None:
+                break
+            day_start = datetime(first.year, first.month, first.day)
+            day_end = min(day_start + timedelta(days=1), cutoff)
+
+            ids = []
+            cursor.execute(SELECT_DAY, (day_start, day_end))
+
+            def pages():
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        return
+                    ids.extend(row[0] for row in rows)
+                    yield rows
+
+            archive.append_batches(pages())
+            for i in range(0, len(ids), batch_size):
+                chunk = ids[i:i + batch_size]
+                cursor.execute(f"DELETE FROM detections WHERE id IN ({', '.join(['%s'] * len(chunk))})", chunk)
+                conn.commit()
+            moved += len(ids)
+            after = day_end
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return moved
+
+
+def replay_into_stats(conn, archive, hooks):
+    """
+    Feed archived detections through the writer's hooks (detection_counts, rollups),
+    e.g. after those tables were rebuilt from the detections still in MySQL.
+    """
+    cursor = conn.cursor()
+    try:
+        for rows in archive.iter_rows():
+            rows = [row for row in rows if row[2] is not None]
+            for hook in hooks if rows else ():
+                hook(cursor, rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
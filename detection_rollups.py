@@ -0,0 +1,222 @@
+import re
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import detection_stats
+
+# ======================
+# Pre-bucketed detection rollups
+# ======================
+# detection_rollups keeps per-minute and per-hour counts for each (user, label), with
+# the summed confidence and a 10-bin confidence histogram. It is maintained by
+# apply_batch() in the same transaction as each detection insert, so time-windowed
+# queries read at most one row per bucket/user/label instead of scanning detections.
+
+RESOLUTIONS = {'m': 60, 'h': 3600}
+CONFIDENCE_BINS = 10
+MINUTE_RETENTION = timedelta(days=7)
+MAX_BUCKETS = 1440
+
+_hist_columns = [f"hist{i}" for i in range(CONFIDENCE_BINS)]
+
+CREATE_DETECTION_ROLLUPS = """
+    CREATE TABLE IF NOT EXISTS detection_rollups (
+        resolution CHAR(1) NOT NULL,
+        bucket_start DATETIME NOT NULL,
+        user_id INT NOT NULL,
+        prediction VARCHAR(32) NOT NULL,
+        count BIGINT NOT NULL DEFAULT 0,
+        confidence_sum DOUBLE NOT NULL DEFAULT 0,
+        {hist},
+        PRIMARY KEY (resolution, bucket_start, user_id, prediction),
+        KEY idx_rollups_user (resolution, user_id, bucket_start)
+    )
+""".format(hist=",\n        ".join(f"{c} INT NOT NULL DEFAULT 0" for c in _hist_columns))
+
+UPSERT_ROLLUP = """
+    INSERT INTO detection_rollups
+        (resolution, bucket_start, user_id, prediction, count, confidence_sum, {cols})
+    VALUES (%s, %s, %s, %s, %s, %s, {params})
+    ON DUPLICATE KEY UPDATE count = count + VALUES(count),
+        confidence_sum = confidence_sum + VALUES(confidence_sum),
+        {updates}
+""".format(
+    cols=", ".join(_hist_columns),
+    params=", ".join(["%s"] * CONFIDENCE_BINS),
+    updates=",\n        ".join(f"{c} = {c} + VALUES({c})" for c in _hist_columns),
+)
+
+_last_prune = 0.0
+
+
+def ensure_tables(cursor):
+    cursor.execute(CREATE_DETECTION_ROLLUPS)
+
+
+def confidence_bin(confidence):
+    return min(max(int(confidence * CONFIDENCE_BINS), 0), CONFIDENCE_BINS - 1)
+
+
+_WALL_CLOCK_EPOCH = datetime(1970, 1, 1)
+
+
+def bucket_start(moment, seconds):
+    """
+    Start of the `seconds`-long bucket holding a naive local `moment`. Buckets are
+    counted on wall-clock time, like rebuild()'s DATE_FORMAT, so hours start at :00
+    and days at local midnight in every timezone.
+    """
+    step = timedelta(seconds=seconds)
+    return _WALL_CLOCK_EPOCH + (moment.replace(tzinfo=None) - _WALL_CLOCK_EPOCH) // step * step
+
+
+def apply_batch(cursor, rows):
+    """Fold a batch of (prediction, confidence, user_id, detected_at) rows into the rollups."""
+    global _last_prune
+    buckets = defaultdict(lambda: [0, 0.0] + [0] * CONFIDENCE_BINS)
+    minute_cutoff = datetime.now() - MINUTE_RETENTION
+    for row in rows:
+        prediction, confidence, user_id, detected_at = row[0], row[1], row[2], row[3]
+        for resolution, seconds in RESOLUTIONS.items():
+            if resolution == 'm' and detected_at < minute_cutoff:
+                continue  # replayed history (e.g. from the archive) only needs hour rows
+            entry = buckets[(resolution, bucket_start(detected_at, seconds), user_id, prediction)]
+            entry[0] += 1
+            entry[1] += confidence
+            entry[2 + confidence_bin(confidence)] += 1
+    cursor.executemany(UPSERT_ROLLUP, [key + tuple(values) for key, values in buckets.items()])
+
+    # Minute rows are only needed for short windows; trim them about once an hour
+    if time.monotonic() - _last_prune > 3600:
+        _last_prune = time.monotonic()
+        prune(cursor)
+
+
+def prune(cursor, now=None):
+    cutoff = (now or datetime.now()) - MINUTE_RETENTION
+    cursor.execute("DELETE FROM detection_rollups WHERE resolution='m' AND bucket_start < %s", (cutoff,))
+
+
+def delete_user(cursor, user_id):
+    cursor.execute("DELETE FROM detection_rollups WHERE user_id=%s", (user_id,))
+
+
+def rebuild(conn):
+    """Recompute detection_rollups from detections.created_at in one transaction."""
+    hist = ", ".join(
+        f"SUM(LEAST(FLOOR(confidence * {CONFIDENCE_BINS}), {CONFIDENCE_BINS - 1}) = {i})"
+        for i in range(CONFIDENCE_BINS)
+    )
+    select = """
+        INSERT INTO detection_rollups
+            (resolution, bucket_start, user_id, prediction, count, confidence_sum, {cols})
+        SELECT %s, b, user_id, prediction, COUNT(*), SUM(confidence), {hist}
+        FROM (SELECT DATE_FORMAT(created_at, %s) AS b, user_id, prediction, confidence
+              FROM detections WHERE user_id IS NOT NULL AND created_at >= %s) d
+        GROUP BY b, user_id, prediction
+    """.format(cols=", ".join(_hist_columns), hist=hist)
+    cursor = conn.cursor()
+    try:
+        ensure_tables(cursor)
+        cursor.execute("DELETE FROM detection_rollups")
+        cursor.execute(select, ('h', '%Y-%m-%d %H:00:00', datetime(1000, 1, 1)))
+        cursor.execute(select, ('m', '%Y-%m-%d %H:%i:00', datetime.now() - MINUTE_RETENTION))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def parse_duration(text):
+    """'90s', '5m', '1h', '7d' -> seconds. Raises ValueError on anything else."""
+    match = re.fullmatch(r'\s*(\d+)\s*([smhd])\s*', str(text or ''))
+    if not match:
+        raise ValueError(f"Invalid duration: {text}")
+    return int(match.group(1)) * {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+
+
+def timeseries(cursor, window, bucket, user_id=None, now=None):
+    """
+    Bucketed counts for the last `window` seconds, in `bucket`-second steps.
+
+    Reads hour rollups when the bucket is a whole number of hours and minute rollups
+    otherwise. Every bucket in the window is present (zero-filled), oldest first.
+    """
+    if bucket < 60 or bucket % 60:
+        raise ValueError("bucket must be a whole number of minutes")
+    if window < bucket:
+        raise ValueError("window must be at least one bucket")
+    if window // bucket > MAX_BUCKETS:
+        raise ValueError(f"window/bucket must not exceed {MAX_BUCKETS} buckets")
+    resolution = 'h' if bucket % 3600 == 0 else 'm'
+    if resolution == 'm' and window > MINUTE_RETENTION.total_seconds():
+        raise ValueError("minute buckets are only kept for 7 days; use an hour bucket for longer windows")
+
+    now = now or datetime.now()
+    end = bucket_start(now, bucket) + timedelta(seconds=bucket)
+    start = end - timedelta(seconds=window // bucket * bucket)
+
+    sql = """
+        SELECT bucket_start, prediction, SUM(count) AS count, SUM(confidence_sum) AS confidence_sum, {hist}
+        FROM detection_rollups
+        WHERE resolution = %s AND bucket_start >= %s AND bucket_start < %s {user_filter}
+        GROUP BY bucket_start, prediction
+    """.format(
+        hist=", ".join(f"SUM({c}) AS {c}" for c in _hist_columns),
+        user_filter="AND user_id = %s" if user_id is not None else "",
+    )
+    params = (resolution, start, end) + ((user_id,) if user_id is not None else ())
+    try:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    except Exception as e:
+        # Fresh database: nothing has been rolled up yet, so every bucket is empty
+        if not detection_stats.is_missing_table(e):
+            raise
+        rows = []
+
+    series = {}
+    cursor_time = start
+    while cursor_time < end:
+        series[cursor_time] = {'normal': 0, 'anomaly': 0, 'confidence_sum': 0.0}
+        cursor_time += timedelta(seconds=bucket)
+    histogram = {'normal': [0] * CONFIDENCE_BINS, 'anomaly': [0] * CONFIDENCE_BINS}
+
+    for row in rows:
+        slot = series.get(bucket_start(row['bucket_start'], bucket))
+        if slot is None or row['prediction'] not in histogram:
+            continue
+        slot[row['prediction']] += int(row['count'])
+        slot['confidence_sum'] += float(row['confidence_sum'])
+        for i, column in enumerate(_hist_columns):
+            histogram[row['prediction']][i] += int(row[column])
+
+    buckets = []
+    for moment, slot in series.items():
+        total = slot['normal'] + slot['anomaly']
+        buckets.append({
+            'start': moment.isoformat(),
+            'normal': slot['normal'],
+            'anomaly': slot['anomaly'],
+            'total': total,
+            'anomaly_rate': slot['anomaly'] / total if total else 0.0,
+            'avg_confidence': slot['confidence_sum'] / total if total else None,
+        })
+    totals = {
+        'normal': sum(b['normal'] for b in buckets),
+        'anomaly': sum(b['anomaly'] for b in buckets),
+    }
+    totals['total'] = totals['normal'] + totals['anomaly']
+    totals['anomaly_rate'] = totals['anomaly'] / totals['total'] if totals['total'] else 0.0
+    return {
+        'resolution': 'hour' if resolution == 'h' else 'minute',
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'buckets': buckets,
+        'totals': totals,
+        'confidence_bins': [round(i / CONFIDENCE_BINS, 2) for i in range(CONFIDENCE_BINS + 1)],
+        'confidence_histogram': histogram,
+    }
@@ -0,0 +1,121 @@
+from collections import Counter
+
+# ======================
+# Maintained detection counters
+# ======================
+# detection_counts holds one row per (user, label) with the number of detections, so
+# the statistics and admin pages read O(users) rows instead of scanning detections.
+# It is kept current by apply_batch(), which runs in the same transaction as every
+# detection insert, and can be recomputed from scratch with rebuild().
+
+CREATE_DETECTION_COUNTS = """
+    CREATE TABLE IF NOT EXISTS detection_counts (
+        user_id INT NOT NULL,
+        prediction VARCHAR(32) NOT NULL,
+        count BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, prediction)
+    )
+"""
+
+ER_NO_SUCH_TABLE = 1146
+
+
+def is_missing_table(error):
+    """True for the MySQL error raised when a table has not been created yet."""
+    return getattr(error, 'errno', None) == ER_NO_SUCH_TABLE
+
+
+UPSERT_DETECTION_COUNT = """
+    INSERT INTO detection_counts (user_id, prediction, count) VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE count = count + VALUES(count)
+"""
+
+
+def ensure_tables(cursor):
+    cursor.execute(CREATE_DETECTION_COUNTS)
+
+
+def apply_batch(cursor, rows):
+    """Add a batch of (prediction, confidence, user_id, ...) detection rows to the counters."""
+    deltas = Counter((row[2], row[0]) for row in rows)
+    cursor.executemany(
+        UPSERT_DETECTION_COUNT,
+        [(user_id, prediction, count) for (user_id, prediction), count in deltas.items()]
+    )
+
+
+def delete_user(cursor, user_id):
+    cursor.execute("DELETE FROM detection_counts WHERE user_id=%s", (user_id,))
+
+
+def rebuild(conn):
+    """Recompute detection_counts from the detections table in one transaction."""
+    cursor = conn.cursor()
+    try:
+        ensure_tables(cursor)
+        cursor.execute("DELETE FROM detection_counts")
+        cursor.execute("""
+            INSERT INTO detection_counts (user_id, prediction, count)
+            SELECT user_id, prediction, COUNT(*) FROM detections
+            WHERE user_id IS NOT NULL
+            GROUP BY user_id, prediction
+        """)
+        conn.commit()
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(count), 0) FROM detection_counts")
+        return cursor.fetchone()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def label_totals(cursor, user_id=None, all_users=False):
+    """
+    Returns ({'normal': n, 'anomaly': n}, total) for one user, or for everyone with
+    all_users=True. Without either (e.g. nobody logged in) the totals are zero.
+    """
+    stats = {'normal': 0, 'anomaly': 0}
+    total = 0
+    if not all_users and user_id is None:
+        return stats, total
+    try:
+        if all_users:
+            cursor.execute("SELECT prediction, SUM(count) AS count FROM detection_counts GROUP BY prediction")
+        else:
+            cursor.execute("SELECT prediction, count FROM detection_counts WHERE user_id=%s", (user_id,))
+    except Exception as e:
+        # Fresh database: the writer creates the table on its first flush, count directly until then
+        if not is_missing_table(e):
+            raise
+        if all_users:
+            cursor.execute("SELECT prediction, COUNT(*) AS count FROM detections GROUP BY prediction")
+        else:
+            cursor.execute("SELECT prediction, COUNT(*) AS count FROM detections WHERE user_id=%s "
+                           "GROUP BY prediction", (user_id,))
+    for row in cursor.fetchall():
+        if row['prediction'] in stats:
+            stats[row['prediction']] = int(row['count'])
+            total += int(row['count'])
+    return stats, total
+
+
+def user_totals(cursor):
+    """Returns [{'id', 'username', 'count'}] for every user, read from the counters."""
+    try:
+        cursor.execute("""
+            SELECT u.id, u.username, COALESCE(SUM(c.count), 0) AS count
+            FROM users u
+            LEFT JOIN detection_counts c ON u.id = c.user_id
+            GROUP BY u.id, u.username
+        """)
+    except Exception as e:
+        if not is_missing_table(e):
+            raise
+        cursor.execute("""
+            SELECT u.id, u.username, COUNT(d.id) AS count
+            FROM users u
+            LEFT JOIN detections d ON u.id = d.user_id
+            GROUP BY u.id, u.username
+        """)
+    return [{'id': row['id'], 'username': row['username'], 'count': int(row['count'])} for row in cursor.fetchall()]
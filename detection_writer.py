@@ -0,0 +1,198 @@
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime
+
+from detection_archive import pack_features
+
+# created_at is the time the row was queued (the same moment the rollups bucket it
+# by), not the time of the flush, which can be much later after an outage
+INSERT_DETECTION = ("INSERT INTO detections (prediction, confidence, user_id, created_at, features) "
+                    "VALUES (%s, %s, %s, %s, %s)")
+# Before `flask migrate-db` has added detections.features
+INSERT_DETECTION_NO_FEATURES = ("INSERT INTO detections (prediction, confidence, user_id, created_at) "
+                                "VALUES (%s, %s, %s, %s)")
+
+
+class DetectionWriter:
+    """
+    Write-behind buffer for detection rows.
+
+    record() only puts the row on a bounded in-memory queue; a background thread
+    drains it and writes multi-row executemany inserts with one commit per batch,
+    whenever `batch_size` rows are waiting or `flush_interval` seconds have passed.
+    When the queue is full, record() blocks for up to `put_timeout` seconds
+    (back-pressure) and then drops the row. Rows from a failed flush are kept and
+    retried on the next cycle; a batch that fails `max_retries` times is retried one
+    row at a time and rows that still fail are counted as `failed` and discarded, so
+    one bad row cannot block the queue. Failing to get a connection at all does not
+    count as a retry. Pending rows are flushed on stop() and at exit.
+
+    Queued rows are (prediction, confidence, user_id, detected_at, features), where
+    features is the packed encoded input vector (or None). `hooks` are
+    callables (cursor, rows) run after the insert and before the commit, so derived
+    tables stay in the same transaction as the detections themselves.
+    `setup` is a callable (cursor) run once before the first write; it must be cheap,
+    since rows queue up behind it. Set `store_features` to False while the detections
+    table has no features column.
+    """
+
+    def __init__(self, get_connection, max_queue=10000, batch_size=500, flush_interval=1.0, put_timeout=0.5,
+                 hooks=None, setup=None, max_retries=3):
+        self._get_connection = get_connection
+        self.hooks = list(hooks or [])
+        self._setup = setup
+        self.store_features = True
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = []  # rows taken off the queue but not yet committed
+        self._attempts = 0  # failed writes of the current _pending batch
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {'enqueued': 0, 'flushed': 0, 'dropped': 0, 'failed': 0, 'batches': 0, 'failed_flushes': 0}
+
+    def record(self, prediction, confidence, user_id, features=None):
+        """Queue one detection; returns False if it had to be dropped."""
+        return self.record_many([(prediction, confidence, user_id, features)]) == 1
+
+    def record_many(self, rows):
+        """
+        Queue (prediction, confidence, user_id[, features]) rows, where features is the
+        encoded 15-value input vector; returns how many were accepted. The whole call
+        waits at most `put_timeout` for queue space.
+        """
+        self._ensure_started()
+        detected_at = datetime.now()
+        deadline = time.monotonic() + self.put_timeout
+        accepted = dropped = 0
+        for row in rows:
+            prediction, confidence, user_id = row[:3]
+            features = pack_features(row[3]) if len(row) > 3 else None
+            try:
+                self._queue.put((prediction, float(confidence), user_id, detected_at, features),
+                                timeout=max(deadline - time.monotonic(), 0))
+                accepted += 1
+            except queue.Full:
+                dropped += 1
+        with self._stats_lock:
+            self.stats['enqueued'] += accepted
+            self.stats['dropped'] += dropped
+        return accepted
+
+    def flush(self):
+        """Write everything currently queued; returns False if the database write failed."""
+        with self._flush_lock:
+            while True:
+                self._drain(self.batch_size - len(self._pending))
+                if not self._pending:
+                    return True
+                try:
+                    written = self._write(self._pending)
+                except Exception as e:
+                    # No connection: the rows are not at fault, so this is not a retry
+                    print(f"Database error in detection writer: {str(e)}")
+                    with self._stats_lock:
+                        self.stats['failed_flushes'] += 1
+                    return False
+                if not written:
+                    self._attempts += 1
+                    if self._attempts < self.max_retries:
+                        return False
+                    # The batch keeps failing: write it row by row and give up on the rows that fail
+                    self._pending = self._write_singly(self._pending)
+                    if self._pending:
+                        return False
+                self._pending = []
+                self._attempts = 0
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def status(self):
+        return dict(self.stats, queued=self._queue.qsize(), pending=len(self._pending))
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='detection-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stop.is_set():
+            deadline = time.monotonic() + self.flush_interval
+            # Wait for a full batch or the flush interval, whichever comes first
+            while self._queue.qsize() < self.batch_size and not self._stop.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._stop.wait(min(remaining, 0.05))
+            if not self.flush():
+                # Database is unhappy; back off instead of retrying in a tight loop
+                self._stop.wait(self.flush_interval)
+
+    def _drain(self, limit):
+        # Caller holds _flush_lock
+        while limit > 0:
+            try:
+                self._pending.append(self._queue.get_nowait())
+            except queue.Empty:
+                return
+            limit -= 1
+
+    def _write_singly(self, rows):
+        """One transaction per row; returns the rows left unwritten if the connection went away."""
+        for i, row in enumerate(rows):
+            try:
+                written = self._write([row])
+            except Exception as e:
+                print(f"Database error in detection writer: {str(e)}")
+                self._attempts = 0
+                return rows[i:]
+            if not written:
+                print(f"Detection writer gave up on a row for user {row[2]} after {self.max_retries} failed batches")
+                with self._stats_lock:
+                    self.stats['failed'] += 1
+        return []
+
+    def _write(self, rows):
+        """Insert rows in one transaction; returns False if it failed. Raises if no connection could be had."""
+        conn = self._get_connection()
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            if self._setup is not None:
+                self._setup(cursor)
+                self._setup = None
+            if self.store_features:
+                cursor.executemany(INSERT_DETECTION, rows)
+            else:
+                cursor.executemany(INSERT_DETECTION_NO_FEATURES, [row[:4] for row in rows])
+            for hook in self.hooks:
+                hook(cursor, rows)
+            conn.commit()
+        except Exception as e:
+            print(f"Database error in detection writer: {str(e)}")
+            with self._stats_lock:
+                self.stats['failed_flushes'] += 1
+            return False
+        finally:
+            if cursor:
+                cursor.close()
+            conn.close()
+        with self._stats_lock:
+            self.stats['flushed'] += len(rows)
+            self.stats['batches'] += 1
+        return True
@@ -0,0 +1,115 @@
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+
+class Subscription:
+    """One connected client: a bounded buffer of events and a flag set when it was dropped."""
+
+    def __init__(self, broker, user_id=None, max_buffer=100):
+        self.broker = broker
+        self.user_id = user_id  # None receives every event
+        self.max_buffer = max_buffer
+        self.events = deque()
+        self.dropped = False
+        self.closed = False
+        self._ready = threading.Condition(broker._lock)
+
+    def get(self, timeout=None):
+        """Next event, or None on timeout / after being dropped or closed."""
+        with self._ready:
+            if not self.events and not self.dropped and not self.closed:
+                self._ready.wait(timeout)
+            return self.events.popleft() if self.events else None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class EventBroker:
+    """
+    In-process pub/sub fan-out of detection events to live dashboards.
+
+    publish() appends to every matching subscriber's bounded buffer and never blocks
+    on a client. A subscriber whose buffer is full is considered too slow: it is
+    dropped (its stream ends and the browser reconnects) instead of holding memory or
+    slowing down the prediction path.
+    """
+
+    def __init__(self, max_subscribers=100, max_buffer=100):
+        self.max_subscribers = max_subscribers
+        self.max_buffer = max_buffer
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._ids = itertools.count(1)
+        self.stats = {'published': 0, 'delivered': 0, 'dropped_subscribers': 0, 'rejected_subscribers': 0}
+
+    def subscribe(self, user_id=None):
+        """Returns a Subscription, or None when max_subscribers are already connected."""
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                self.stats['rejected_subscribers'] += 1
+                return None
+            subscription = Subscription(self, user_id=user_id, max_buffer=self.max_buffer)
+            self._subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscription.closed = True
+            self._subscribers.discard(subscription)
+            subscription._ready.notify_all()
+
+    def publish_many(self, events):
+        """Fan out a list of event dicts (each with a 'user_id') to matching subscribers."""
+        if not self._subscribers:
+            return
+        with self._lock:
+            stamped = []
+            for event in events:
+                stamped.append(dict(event, id=next(self._ids)))
+            self.stats['published'] += len(stamped)
+            for subscription in list(self._subscribers):
+                matching = [e for e in stamped if subscription.user_id is None or e['user_id'] == subscription.user_id]
+                if not matching:
+                    continue
+                if len(subscription.events) + len(matching) > subscription.max_buffer:
+                    subscription.dropped = True
+                    self._subscribers.discard(subscription)
+                    self.stats['dropped_subscribers'] += 1
+                else:
+                    subscription.events.extend(matching)
+                    self.stats['delivered'] += len(matching)
+                subscription._ready.notify_all()
+
+    def publish(self, event):
+        self.publish_many([event])
+
+    def status(self):
+        with self._lock:
+            return dict(self.stats, subscribers=len(self._subscribers), max_subscribers=self.max_subscribers,
+                        max_buffer=self.max_buffer)
+
+
+def sse_stream(subscription, heartbeat=15.0):
+    """Generator of Server-Sent Events text for one subscription; closes it when the client goes away."""
+    try:
+        yield "retry: 3000\n\n"
+        last_sent = time.monotonic()
+        while True:
+            event = subscription.get(timeout=heartbeat)
+            if event is not None:
+                yield f"id: {event['id']}\nevent: detection\ndata: {json.dumps(event)}\n\n"
+                last_sent = time.monotonic()
+            elif subscription.dropped:
+                yield "event: dropped\ndata: {\"reason\": \"slow consumer\"}\n\n"
+                return
+            elif subscription.closed:
+                return
+            elif time.monotonic() - last_sent >= heartbeat:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+    finally:
+        subscription.close()
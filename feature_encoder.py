@@ -0,0 +1,183 @@
+import numpy as np
+
+# ======================
+# Model input layout (15 features, in training order)
+# ======================
+feature_columns = [
+    'protocol_type', 'service', 'flag', 'src_bytes', 'dst_bytes', 'logged_in', 'count',
+    'srv_count', 'serror_rate', 'rerror_rate', 'srv_rerror_rate', 'same_srv_rate', 'diff_srv_rate',
+    'dst_host_srv_count', 'dst_host_serror_rate'
+]
+feature_mapping = {name: idx for idx, name in enumerate(feature_columns)}
+categorical_columns = ['protocol_type', 'service', 'flag']
+numeric_columns = [c for c in feature_columns if c not in categorical_columns + ['logged_in']]
+
+# Same case rules the prediction form has always used
+_normalizers = {
+    'protocol_type': str.lower,
+    'service': str.lower,
+    'flag': str.upper,
+}
+_char_normalizers = {
+    'protocol_type': np.char.lower,
+    'service': np.char.lower,
+    'flag': np.char.upper,
+}
+_false_values = {'no', '0', 'false'}
+
+
+def _logged_in(value):
+    """logged_in as 0/1: absent (None) and 'no'/'0'/'false' are 0, anything else is 1."""
+    return 0 if value is None or str(value).lower() in _false_values else 1
+
+
+class EncodingError(ValueError):
+    """Raised when a record cannot be turned into a feature vector."""
+
+    def __init__(self, field, message):
+        super().__init__(message)
+        self.field = field
+
+
+class FeatureEncoder:
+    """
+    Turns raw connection records into model feature vectors.
+
+    The LabelEncoders are only read once, here: their classes_ are compiled into plain
+    dict lookups (single rows) and sorted arrays (batches), so encoding never calls
+    LabelEncoder.transform on the request path.
+    """
+
+    def __init__(self, protocol_type_encoder, service_encoder, flag_encoder):
+        encoders = {
+            'protocol_type': protocol_type_encoder,
+            'service': service_encoder,
+            'flag': flag_encoder,
+        }
+        self.lookup = {}
+        self.vocabulary = {}
+        self.classes = {}
+        for field, encoder in encoders.items():
+            classes = np.asarray(encoder.classes_).astype(str)
+            order = np.argsort(classes)
+            self.lookup[field] = {name: code for code, name in enumerate(classes)}
+            self.classes[field] = classes.tolist()
+            # (sorted names, their LabelEncoder codes) for searchsorted
+            self.vocabulary[field] = (classes[order], order)
+
+    def encode_row(self, record):
+        """Encode one record dict; raises EncodingError with the form's error messages."""
+        features = np.zeros(len(feature_columns))
+
+        for field in categorical_columns:
+            raw = record.get(field)
+            code = None
+            if raw is not None:
+                code = self.lookup[field].get(_normalizers[field](str(raw).strip()))
+            if code is None:
+                raise EncodingError(field, f"Invalid {field}: {raw}")
+            features[feature_mapping[field]] = code
+
+        features[feature_mapping['logged_in']] = _logged_in(record.get('logged_in'))
+
+        for field in numeric_columns:
+            try:
+                value = float(record.get(field, '0'))
+            except (TypeError, ValueError):
+                value = float('nan')
+            # Same rule as the batch path: NaN and infinities are not valid inputs
+            if not np.isfinite(value):
+                raise EncodingError(field, f"Invalid value for {field}. Please enter a valid number.")
+            features[feature_mapping[field]] = value
+
+        return features
+
+    def decode_row(self, features):
+        """Encoded vector -> {column: value} with category names restored (None for NaN)."""
+        record = {}
+        for field, value in zip(feature_columns, features):
+            value = float(value)
+            if value != value:
+                record[field] = None
+            elif field in self.classes:
+                code = int(value)
+                record[field] = self.classes[field][code] if 0 <= code < len(self.classes[field]) else None
+            else:
+                record[field] = value
+        return record
+
+    def encode_batch(self, records):
+        """
+        Build the (n, 15) feature matrix for a list of record dicts, one vectorized pass
+        per column. Returns (features, errors) where errors maps row index -> message for
+        rows that could not be encoded; those rows are left as zeros and must not be scored.
+        """
+        n = len(records)
+        features = np.zeros((n, len(feature_columns)))
+        errors = {}
+
+        for field in categorical_columns:
+            values = [record.get(field) for record in records]
+            codes, valid = self._encode_categorical(field, values)
+            features[:, feature_mapping[field]] = codes
+            for i in np.flatnonzero(~valid):
+                errors.setdefault(int(i), f"Invalid {field}: {values[i]}")
+
+        features[:, feature_mapping['logged_in']] = [_logged_in(record.get('logged_in')) for record in records]
+
+        for field in numeric_columns:
+            values = [record.get(field, '0') for record in records]
+            column, valid = _encode_numeric(values)
+            features[:, feature_mapping[field]] = column
+            for i in np.flatnonzero(~valid):
+                errors.setdefault(int(i), f"Invalid value for {field}. Please enter a valid number.")
+
+        return features, errors
+
+    def _encode_categorical(self, field, values):
+        """Returns (codes, valid_mask) for a whole column using searchsorted on the vocabulary."""
+        names, codes = self.vocabulary[field]
+        normalized = _char_normalizers[field](np.char.strip(np.asarray(
+            ['' if v is None else str(v) for v in values], dtype=str)))
+        positions = np.minimum(np.searchsorted(names, normalized), len(names) - 1)
+        valid = names[positions] == normalized
+        return np.where(valid, codes[positions], 0).astype(float), valid
+
+
+def _encode_numeric(values):
+    """Convert a column to floats, falling back to per-value parsing only if needed."""
+    try:
+        column = np.asarray(values, dtype=float)
+        return column, np.isfinite(column)
+    except (TypeError, ValueError):
+        column = np.zeros(len(values))
+        valid = np.ones(len(values), dtype=bool)
+        for i, value in enumerate(values):
+            try:
+                column[i] = float(value)
+            except (TypeError, ValueError):
+                valid[i] = False
+                continue
+            valid[i] = np.isfinite(column[i])
+        return column, valid
+
+
+def record_signature(record):
+    """
+    Hashable key for a raw record after the same normalization encoding applies
+    (case and whitespace of categoricals, '26' == '26.0', absent logged_in == 0), so
+    records that encode to the same feature vector share one key.
+    """
+    key = []
+    for field in feature_columns:
+        value = record.get(field)
+        if field in _normalizers:
+            key.append(None if value is None else _normalizers[field](str(value).strip()))
+        elif field == 'logged_in':
+            key.append(_logged_in(value))
+        else:
+            try:
+                key.append(float('0' if value is None and field not in record else value))
+            except (TypeError, ValueError):
+                key.append(str(value))
+    return tuple(key)
@@ -0,0 +1,225 @@
+import os
+import threading
+
+import numpy as np
+from joblib import load
+from sklearn.preprocessing import StandardScaler
+
+from feature_encoder import FeatureEncoder
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+
+
+class InferenceEngine:
+    """
+    One pass from raw feature vectors to (label, confidence).
+
+    predict_proba is called once per batch and the class is its argmax, instead of
+    running the tree ensemble twice (predict + predict_proba). The label for each
+    model class index is looked up once at construction, and a StandardScaler is
+    folded into a plain (x - mean) * inv_scale so it costs one vector operation.
+    """
+
+    def __init__(self, model, scaler, label_encoder):
+        self.model = model
+        self.scaler = scaler
+        classes = np.asarray(model.classes_)
+        if hasattr(label_encoder, 'inverse_transform'):
+            self.labels = np.asarray(label_encoder.inverse_transform(classes)).astype(str)
+        else:
+            self.labels = np.where(classes == 0, 'normal', 'anomaly')
+        self.offset, self.factor = _fold_scaler(scaler)
+
+    def scale(self, features):
+        features = np.asarray(features, dtype=float)
+        if self.factor is None:
+            return self.scaler.transform(features)
+        return (features - self.offset) * self.factor
+
+    def predict_proba(self, features):
+        """Class probabilities for an (n, 15) matrix of raw (unscaled) features."""
+        return self.model.predict_proba(self.scale(features))
+
+    def predict_batch(self, features):
+        """Returns (labels, confidences) arrays for an (n, 15) matrix of raw features."""
+        return self.predict_scaled(self.scale(features))
+
+    def predict_scaled(self, scaled):
+        """predict_batch() for features that have already been through scale()."""
+        probabilities = self.model.predict_proba(scaled)
+        class_index = probabilities.argmax(axis=1)
+        confidences = probabilities[np.arange(len(class_index)), class_index]
+        return self.labels[class_index], confidences.astype(float)
+
+
+# ======================
+# Cascade: cheap pre-filter in front of the full model
+# ======================
+PREFILTER_FILE = 'prefilter_tree.npz'
+
+
+class TreePrefilter:
+    """
+    A shallow decision tree compiled into flat NumPy arrays (no sklearn at inference).
+
+    Works on raw encoded features, so it needs no scaling. predict() walks every row
+    down the tree at once, one vectorized step per level. A leaf's confidence is the
+    (Laplace-smoothed) share of rows there that the full model labels the same way,
+    as measured by calibrate(); from_sklearn() starts from the training-label purity.
+    """
+
+    def __init__(self, feature, threshold, left, right, leaf_class, leaf_confidence, labels):
+        self.feature = np.asarray(feature, dtype=np.int64)
+        self.threshold = np.asarray(threshold, dtype=float)
+        self.left = np.asarray(left, dtype=np.int64)
+        self.right = np.asarray(right, dtype=np.int64)
+        self.leaf_class = np.asarray(leaf_class, dtype=np.int64)
+        self.leaf_confidence = np.asarray(leaf_confidence, dtype=float)
+        self.labels = np.asarray(labels).astype(str)
+        self.is_leaf = self.left < 0
+        self.depth = _tree_depth(self.left, self.right)
+
+    @classmethod
+    def from_sklearn(cls, tree, labels):
+        """Compile a fitted DecisionTreeClassifier; `labels` are the names of tree.classes_."""
+        t = tree.tree_
+        counts = t.value[:, 0, :] * np.maximum(t.weighted_n_node_samples, 1)[:, None] \
+            if t.value[:, 0, :].max() <= 1.0 else t.value[:, 0, :]
+        leaf_class = counts.argmax(axis=1)
+        confidence = (counts.max(axis=1) + 1) / (counts.sum(axis=1) + counts.shape[1])
+        return cls(np.maximum(t.feature, 0), t.threshold, t.children_left, t.children_right,
+                   leaf_class, confidence, labels)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['feature'], data['threshold'], data['left'], data['right'],
+                       data['leaf_class'], data['leaf_confidence'], data['labels'])
+
+    def calibrate(self, features, reference_labels):
+        """
+        Set each leaf's confidence to how often its label agrees with `reference_labels`
+        (the full model's predictions for `features`, held-out rows): (agree + 1) / (n + 2).
+        A leaf no calibration row reaches gets 0.5, so the cascade never trusts it.
+        """
+        leaves = self.leaves(features)
+        agrees = self.labels[self.leaf_class[leaves]] == np.asarray(reference_labels).astype(str)
+        rows = np.bincount(leaves, minlength=len(self.left))
+        agreed = np.bincount(leaves, weights=agrees, minlength=len(self.left))
+        self.leaf_confidence = (agreed + 1) / (rows + 2)
+
+    def save(self, path):
+        np.savez(path, feature=self.feature, threshold=self.threshold, left=self.left, right=self.right,
+                 leaf_class=self.leaf_class, leaf_confidence=self.leaf_confidence, labels=self.labels)
+
+    def predict(self, features):
+        """Returns (labels, confidences) for an (n, 15) matrix of raw features."""
+        classes, confidences = self.predict_classes(features)
+        return self.labels[classes], confidences
+
+    def predict_classes(self, features):
+        """predict() with class indices into self.labels instead of label strings."""
+        node = self.leaves(features)
+        return self.leaf_class[node], self.leaf_confidence[node]
+
+    def leaves(self, features):
+        """Leaf node index of every row."""
+        features = np.asarray(features, dtype=float)
+        rows = np.arange(len(features))
+        node = np.zeros(len(features), dtype=np.int64)
+        for _ in range(self.depth):
+            go_left = features[rows, self.feature[node]] <= self.threshold[node]
+            node = np.where(self.is_leaf[node], node, np.where(go_left, self.left[node], self.right[node]))
+        return node
+
+
+class Cascade:
+    """
+    Routes a batch through a TreePrefilter first; rows it labels with at least
+    `threshold` confidence are answered by it, and only the rest go to the full model
+    (`full_score`, an (n, 15) matrix -> (labels, confidences) callable). Keeps
+    per-stage routing counts. The threshold can be changed while serving.
+    """
+
+    def __init__(self, threshold=0.99):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self.stats = {'batches': 0, 'records': 0, 'prefilter': {}, 'full': {}}
+
+    def predict_batch(self, features, prefilter, full_score):
+        """Returns (labels, confidences) like InferenceEngine.predict_batch."""
+        features = np.asarray(features, dtype=float)
+        classes, confidences = prefilter.predict_classes(features)
+        labels = prefilter.labels[classes]
+        uncertain = np.flatnonzero(confidences < self.threshold)
+        # Routing counts work on class indices; only the uncertain rows touch strings
+        decided = np.bincount(np.delete(classes, uncertain), minlength=len(prefilter.labels))
+        full_names, full_counts = [], []
+        if len(uncertain):
+            full_labels, full_confidences = full_score(features[uncertain])
+            full_labels = np.asarray(full_labels)
+            labels = labels.astype(np.result_type(labels, full_labels))
+            labels[uncertain] = full_labels
+            confidences[uncertain] = full_confidences
+            full_names, full_counts = np.unique(full_labels, return_counts=True)
+        with self._lock:
+            self.stats['batches'] += 1
+            self.stats['records'] += len(labels)
+            for stage, names, counts in (('prefilter', prefilter.labels, decided), ('full', full_names, full_counts)):
+                for name, count in zip(np.asarray(names).tolist(), np.asarray(counts).tolist()):
+                    if count:
+                        self.stats[stage][name] = self.stats[stage].get(name, 0) + count
+        return labels, confidences
+
+    def status(self):
+        with self._lock:
+            prefilter = sum(self.stats['prefilter'].values())
+            return {
+                'threshold': self.threshold,
+                'batches': self.stats['batches'],
+                'records': self.stats['records'],
+                'prefilter': dict(self.stats['prefilter']),
+                'full': dict(self.stats['full']),
+                'prefilter_rate': prefilter / self.stats['records'] if self.stats['records'] else 0.0,
+            }
+
+    def reset(self):
+        with self._lock:
+            self.stats = {'batches': 0, 'records': 0, 'prefilter': {}, 'full': {}}
+
+
+def _tree_depth(left, right):
+    depth = np.zeros(len(left), dtype=np.int64)
+    for node in range(len(left)):  # sklearn numbers children after their parent
+        if left[node] >= 0:
+            depth[left[node]] = depth[right[node]] = depth[node] + 1
+    return int(depth.max()) if len(depth) else 0
+
+
+def _fold_scaler(scaler):
+    """
+    Turn a fitted StandardScaler into (offset, factor) so scaling is (x - offset) * factor.
+    Returns (None, None) for any other scaler, in which case scaler.transform is used.
+    """
+    if scaler is None:
+        return 0.0, 1.0
+    if not isinstance(scaler, StandardScaler):
+        return None, None
+    offset = np.asarray(scaler.mean_, dtype=float) if scaler.with_mean else 0.0
+    factor = 1.0 / np.asarray(scaler.scale_, dtype=float) if scaler.with_std else 1.0
+    return offset, factor
+
+
+def load_scoring_pipeline(model_file='xgboost_best_model.pkl', models_dir=MODELS_DIR):
+    """Load the model artifacts from models/ and return (FeatureEncoder, InferenceEngine)."""
+    encoder = FeatureEncoder(
+        load(os.path.join(models_dir, 'protocol_type_encoder.pkl')),
+        load(os.path.join(models_dir, 'service_encoder.pkl')),
+        load(os.path.join(models_dir, 'flag_encoder.pkl'))
+    )
+    engine = InferenceEngine(
+        load(os.path.join(models_dir, model_file)),
+        load(os.path.join(models_dir, 'scaler.pkl')),
+        load(os.path.join(models_dir, 'label_encoder.pkl'))
+    )
+    return encoder, engine
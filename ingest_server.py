@@ -0,0 +1,352 @@
+"""
+Asyncio ingestion server for sensors: newline-delimited JSON in, newline-delimited
+JSON out, over TCP or a Unix socket.
+
+Each input line is one record in the static/sample_data.json schema (or, with
+--events, one raw connection event whose window features are computed per
+connection by TrafficFeatureExtractor). Every line gets exactly one result line
+back, in input order:
+
+    {"seq": 0, "prediction": "normal", "confidence": 0.998}
+    {"seq": 1, "error": "Invalid service: foo"}
+
+Whatever has arrived on a connection is split into lines and scored as one batch
+(at most --batch-size lines), so batches grow with the load. JSON parsing, encoding,
+the prediction cache and the model all run on a thread pool (the model optionally in
+--processes worker processes), so the event loop only moves bytes. With --events, the
+window features are computed on a single thread per connection, which keeps each
+connection's events in arrival order without blocking the loop. Back-pressure:
+a connection has at most --max-inflight batches outstanding and the server at most
+--max-pending in total; at the limit the server stops reading that socket and TCP
+flow control slows the sender down. Results are written with drain(), so a client
+that does not read its results is throttled the same way.
+
+Uses the same ModelRegistry, encoders and prediction cache as the web app. With
+--cascade the decision-tree pre-filter answers the records it is sure about and
+only the rest go to the full model.
+
+    python ingest_server.py --port 9300
+    python ingest_server.py --unix /tmp/ids.sock --processes 4
+    python ingest_server.py --port 9300 --events --to-db --user-id 1
+    python ingest_server.py --port 9300 --cascade 0.99
+    python load_generator.py --port 9300 --connections 8 --duration 30
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from inference import Cascade
+from model_registry import ModelRegistry
+from prediction_cache import PredictionCache, score_records
+from traffic_features import EventError, TrafficFeatureExtractor
+
+
+def parse_lines(lines):
+    """Decode JSON lines; returns (records, errors) with None records for broken lines."""
+    records = []
+    errors = {}
+    for i, line in enumerate(lines):
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            records.append(None)
+            errors[i] = f"Invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            records.append(None)
+            errors[i] = "Expected a JSON object"
+        else:
+            records.append(record)
+    return records, errors
+
+
+class IngestServer:
+    def __init__(self, registry, executor, scoring_pool=None, cache=None, batch_size=1024, max_inflight=4,
+                 max_pending=64, max_line=65536, events=False, detection_writer=None, user_id=None, cascade=None):
+        self.registry = registry
+        self.executor = executor
+        self.scoring_pool = scoring_pool
+        self.cache = cache
+        self.batch_size = batch_size
+        self.max_inflight = max_inflight
+        self.max_pending = max_pending
+        self.max_line = max_line
+        self.events = events
+        self.detection_writer = detection_writer
+        self.user_id = user_id
+        self.cascade = cascade  # Cascade, or None to score everything with the full model
+        self._pending = None  # created inside the running loop
+        self._stats_lock = threading.Lock()
+        self.stats = {'connections': 0, 'open_connections': 0, 'records': 0, 'errors': 0, 'batches': 0}
+
+    async def handle(self, reader, writer):
+        if self._pending is None:
+            self._pending = asyncio.Semaphore(self.max_pending)
+        self.stats['connections'] += 1
+        self.stats['open_connections'] += 1
+        extractor = TrafficFeatureExtractor() if self.events else None
+        # One thread per connection: batches are extracted in the order they arrived
+        extract_executor = ThreadPoolExecutor(1, thread_name_prefix='ingest-extract') if self.events else None
+        # Scored batches waiting to be written, in order; full queue = stop reading
+        outgoing = asyncio.Queue(maxsize=self.max_inflight)
+        sender = asyncio.create_task(self._send(outgoing, writer))
+        seq = 0
+        try:
+            async for lines, oversized in self._read_batches(reader):
+                await self._pending.acquire()
+                if extractor is None:
+                    future = asyncio.get_running_loop().run_in_executor(
+                        self.executor, self._score_batch, lines, oversized, seq, None)
+                else:
+                    extracted = asyncio.get_running_loop().run_in_executor(
+                        extract_executor, self._extract, lines, extractor)
+                    future = asyncio.ensure_future(self._score_extracted(lines, oversized, seq, extracted))
+                future.add_done_callback(lambda _: self._pending.release())
+                await outgoing.put(future)
+                seq += len(lines)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            await outgoing.put(None)
+            await sender
+            if extract_executor is not None:
+                extract_executor.shutdown(wait=False)
+            self.stats['open_connections'] -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_batches(self, reader):
+        """Yield (lines, oversized) with every complete line that has arrived, up to batch_size lines."""
+        buffer = b''
+        skipping = False  # inside a line longer than max_line
+        oversized = set()
+        lines = []
+        while True:
+            chunk = await reader.read(1 << 16)
+            if not chunk:
+                if buffer.strip() and not skipping:
+                    lines.append(buffer)
+                if lines:
+                    yield lines, oversized
+                return
+            buffer += chunk
+            start = 0
+            while True:
+                end = buffer.find(b'\n', start)
+                if end < 0:
+                    break
+                if skipping:
+                    skipping = False
+                elif end - start > self.max_line:
+                    oversized.add(len(lines))
+                    lines.append(b'')
+                else:
+                    line = buffer[start:end]
+                    if line.strip():
+                        lines.append(line)
+                start = end + 1
+                if len(lines) >= self.batch_size:
+                    yield lines, oversized
+                    lines, oversized = [], set()
+            buffer = buffer[start:]
+            if len(buffer) > self.max_line and not skipping:
+                # Answer the line with an error now and drop the rest of it
+                oversized.add(len(lines))
+                lines.append(b'')
+                buffer = b''
+                skipping = True
+            elif skipping:
+                buffer = b''
+            if lines:
+                yield lines, oversized
+                lines, oversized = [], set()
+
+    async def _score_extracted(self, lines, oversized, first_seq, extracted):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self._score_batch, lines, oversized, first_seq, await extracted)
+
+    def _extract(self, lines, extractor):
+        """Events mode, on the connection's extract thread: parse and compute window features in order."""
+        events, errors = parse_lines(lines)
+        records = []
+        for i, event in enumerate(events):
+            if event is None:
+                records.append(None)
+                continue
+            try:
+                records.append(extractor.process(event))
+            except EventError as e:
+                records.append(None)
+                errors[i] = str(e)
+        return records, errors
+
+    def _score_batch(self, lines, oversized, first_seq, extracted):
+        """Runs on the executor: parse, encode, score and serialize one batch."""
+        records, errors = extracted if extracted is not None else parse_lines(lines)
+        for i in oversized:
+            records[i] = None
+            errors[i] = f"Line longer than {self.max_line} bytes"
+        valid = [i for i, record in enumerate(records) if record is not None]
+        results = [None] * len(lines)
+        if valid:
+            version = self.registry.current()
+            score_fn = self.scoring_pool.score if self.scoring_pool is not None else version.engine.predict_batch
+            if self.cascade is not None and version.prefilter is not None:
+                full_score = score_fn
+                score_fn = lambda features: self.cascade.predict_batch(features, version.prefilter, full_score)
+            batch = [records[i] for i in valid]
+            encoded = version.encoder.encode_batch(batch) if self.detection_writer is not None else None
+            try:
+                scored = score_records(batch, version.encoder, score_fn, self.cache, version.version, encoded=encoded)
+            except Exception as e:
+                scored = [(None, None, f"Model prediction error: {e}")] * len(batch)
+            detections = []
+            for j, (i, (label, confidence, error)) in enumerate(zip(valid, scored)):
+                if error is not None:
+                    errors[i] = error
+                else:
+                    results[i] = {'seq': first_seq + i, 'prediction': label, 'confidence': confidence}
+                    if encoded is not None:
+                        detections.append((label, confidence, self.user_id, encoded[0][j]))
+            if detections:
+                self.detection_writer.record_many(detections)
+        for i, message in errors.items():
+            results[i] = {'seq': first_seq + i, 'error': message}
+        with self._stats_lock:
+            self.stats['records'] += len(lines)
+            self.stats['errors'] += len(errors)
+            self.stats['batches'] += 1
+        return ''.join(json.dumps(result) + '\n' for result in results).encode()
+
+    async def _send(self, outgoing, writer):
+        broken = False
+        while True:
+            future = await outgoing.get()
+            if future is None:
+                return
+            payload = await future
+            if broken:
+                continue  # client went away; keep draining so the reader is not blocked
+            try:
+                writer.write(payload)
+                await writer.drain()
+            except ConnectionError:
+                broken = True
+
+
+async def report(server, cache, interval):
+    last_records = 0
+    last_time = time.monotonic()
+    while True:
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        records = server.stats['records']
+        line = (f"{(records - last_records) / (now - last_time):.0f} records/sec, "
+                f"{server.stats['open_connections']} connections, {records} records total")
+        if cache is not None:
+            line += f", cache hit rate {cache.status()['hit_rate']:.1%}"
+        if server.cascade is not None:
+            line += f", pre-filter answered {server.cascade.status()['prefilter_rate']:.1%}"
+        print(line, file=sys.stderr)
+        last_records, last_time = records, now
+
+
+async def serve(args):
+    registry = ModelRegistry(args.model)
+    version = registry.current()  # load before accepting connections
+    if args.cascade is not None and version.prefilter is None:
+        raise SystemExit("--cascade needs models/prefilter_tree.npz (run train_prefilter.py)")
+    scoring_pool = None
+    if args.processes:
+        from scoring_pool import ScoringPool
+        scoring_pool = ScoringPool(args.processes, model_file=args.model)
+        scoring_pool.start()
+        registry.subscribe(lambda version: scoring_pool.restart(version.model_file))
+    detection_writer = None
+    if args.to_db:
+        # The app's pooled, batched detection writer, with its counter/rollup hooks
+        from app import detection_writer
+    cache = PredictionCache(capacity=args.cache_size, ttl=300) if args.cache_size > 0 else None
+    executor = ThreadPoolExecutor(max_workers=args.threads, thread_name_prefix='ingest-score')
+
+    server = IngestServer(registry, executor, scoring_pool=scoring_pool, cache=cache, batch_size=args.batch_size,
+                          max_inflight=args.max_inflight, max_pending=args.max_pending, events=args.events,
+                          detection_writer=detection_writer, user_id=args.user_id,
+                          cascade=Cascade(threshold=args.cascade) if args.cascade is not None else None)
+    if args.unix:
+        listener = await asyncio.start_unix_server(server.handle, path=args.unix)
+        where = args.unix
+    else:
+        listener = await asyncio.start_server(server.handle, host=args.host, port=args.port)
+        where = f"{args.host}:{args.port}"
+    print(f"Ingesting NDJSON on {where} with model {args.model}", file=sys.stderr)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # e.g. Windows: Ctrl+C raises KeyboardInterrupt instead
+    reporter = asyncio.create_task(report(server, cache, args.report_interval)) if args.report_interval > 0 else None
+    try:
+        async with listener:
+            await stop.wait()
+    finally:
+        if reporter is not None:
+            reporter.cancel()
+        executor.shutdown(wait=True)
+        if scoring_pool is not None:
+            scoring_pool.close()
+        if detection_writer is not None:
+            detection_writer.stop()
+        if args.unix and os.path.exists(args.unix):
+            os.remove(args.unix)
+    print(f"Stopped after {server.stats['records']} records ({server.stats['errors']} errors) "
+          f"from {server.stats['connections']} connections", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Asyncio NDJSON ingestion server for the IDS model.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9300)
+    parser.add_argument('--unix', help="Listen on this Unix socket path instead of TCP")
+    parser.add_argument('--model', default='xgboost_best_model.pkl', help="Model file inside models/")
+    parser.add_argument('--events', action='store_true',
+                        help="Lines are raw connection events; window features are computed per connection")
+    parser.add_argument('--threads', type=int, default=min(8, os.cpu_count() or 1),
+                        help="Threads that parse, encode and score batches")
+    parser.add_argument('--processes', type=int, default=0,
+                        help="Run the model in this many worker processes (default 0: in the scoring threads)")
+    parser.add_argument('--batch-size', type=int, default=1024, help="Most lines scored in one batch")
+    parser.add_argument('--max-inflight', type=int, default=4, help="Batches outstanding per connection")
+    parser.add_argument('--max-pending', type=int, default=64, help="Batches outstanding across all connections")
+    parser.add_argument('--cascade', type=float, metavar='THRESHOLD',
+                        help="Let the decision-tree pre-filter answer records it is this confident about")
+    parser.add_argument('--cache-size', type=int, default=100000, help="Prediction cache entries (0 disables)")
+    parser.add_argument('--to-db', action='store_true', help="Also store detections in the detections table")
+    parser.add_argument('--user-id', type=int, help="User the detections are recorded for (required with --to-db)")
+    parser.add_argument('--report-interval', type=float, default=10, help="Seconds between throughput lines (0: off)")
+    args = parser.parse_args(argv)
+    if args.to_db and args.user_id is None:
+        parser.error("--to-db requires --user-id")
+    if args.cascade is not None and not 0.0 < args.cascade <= 1.0:
+        parser.error("--cascade must be in (0, 1]")
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
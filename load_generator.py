@@ -0,0 +1,169 @@
+"""
+Local load generator for ingest_server.py.
+
+Opens --connections NDJSON connections and streams records from
+static/sample_data.json (byte counts jittered with --unique, so the prediction
+cache can hardly answer them) for --duration seconds, keeping at most --window lines
+unanswered per connection. Reports sustained throughput and per-line latency
+(send to result) percentiles; -o writes the numbers as JSON.
+
+    python ingest_server.py --port 9300 &
+    python load_generator.py --port 9300 --connections 8 --duration 30 --unique
+    python load_generator.py --unix /tmp/ids.sock --rate 5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+SAMPLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'sample_data.json')
+JITTER_FIELDS = ('src_bytes', 'dst_bytes')
+
+
+def make_lines(count, unique, seed=0):
+    """`count` encoded NDJSON lines cycled from the sample records."""
+    with open(SAMPLE_FILE) as f:
+        samples = json.load(f)
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        record = dict(samples[i % len(samples)])
+        if unique:
+            for field in JITTER_FIELDS:
+                record[field] = int(record[field]) + rng.randrange(1000000)
+        lines.append((json.dumps(record) + '\n').encode())
+    return lines
+
+
+class Connection:
+    def __init__(self, lines, window, batch, rate):
+        self.lines = lines
+        self.window = window
+        self.batch = batch
+        self.rate = rate  # lines/sec for this connection, 0 = as fast as the window allows
+        self.sent = 0
+        self.received = 0
+        self.errors = 0
+        self.send_times = []
+        self.latencies = []
+        self._room = asyncio.Event()
+        self._room.set()
+
+    async def run(self, reader, writer, deadline):
+        receiver = asyncio.create_task(self._receive(reader))
+        started = time.monotonic()
+        try:
+            while time.monotonic() < deadline:
+                if self.sent - self.received >= self.window:
+                    self._room.clear()
+                    await self._room.wait()
+                    continue
+                count = min(self.batch, self.window - (self.sent - self.received))
+                if self.rate:
+                    # Hold the schedule: never run ahead of rate * elapsed
+                    ahead = (self.sent + count) / self.rate - (time.monotonic() - started)
+                    if ahead > 0:
+                        await asyncio.sleep(ahead)
+                now = time.monotonic()
+                writer.write(b''.join(self.lines[(self.sent + i) % len(self.lines)] for i in range(count)))
+                self.send_times.extend([now] * count)
+                self.sent += count
+                await writer.drain()
+            # Wait for the answers still in flight, then close
+            while self.received < self.sent and not receiver.done():
+                self._room.clear()
+                try:
+                    await asyncio.wait_for(self._room.wait(), timeout=30)
+                except asyncio.TimeoutError:
+                    break
+        finally:
+            writer.close()
+            receiver.cancel()
+
+    async def _receive(self, reader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            now = time.monotonic()
+            result = json.loads(line)
+            if 'error' in result:
+                self.errors += 1
+            self.latencies.append(now - self.send_times[result['seq']])
+            self.received += 1
+            self._room.set()
+
+
+async def run_load(args):
+    lines = make_lines(args.distinct, args.unique, seed=args.seed)
+    connections = [Connection(lines, args.window, args.batch, args.rate) for _ in range(args.connections)]
+    streams = []
+    for _ in connections:
+        if args.unix:
+            streams.append(await asyncio.open_unix_connection(args.unix, limit=1 << 20))
+        else:
+            streams.append(await asyncio.open_connection(args.host, args.port, limit=1 << 20))
+
+    started = time.monotonic()
+    deadline = started + args.duration
+    await asyncio.gather(*(c.run(reader, writer, deadline) for c, (reader, writer) in zip(connections, streams)))
+    elapsed = time.monotonic() - started
+
+    latencies = np.asarray([latency for c in connections for latency in c.latencies]) * 1000.0
+    received = sum(c.received for c in connections)
+    summary = {
+        'connections': args.connections,
+        'duration_sec': elapsed,
+        'sent': sum(c.sent for c in connections),
+        'received': received,
+        'errors': sum(c.errors for c in connections),
+        'records_per_sec': received / elapsed if elapsed else 0.0,
+        'unique': args.unique,
+    }
+    if len(latencies):
+        summary.update({
+            'latency_p50_ms': float(np.percentile(latencies, 50)),
+            'latency_p99_ms': float(np.percentile(latencies, 99)),
+            'latency_max_ms': float(latencies.max()),
+        })
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate NDJSON scoring load against ingest_server.py.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9300)
+    parser.add_argument('--unix', help="Connect to this Unix socket instead of TCP")
+    parser.add_argument('--connections', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10, help="Seconds to send for (default 10)")
+    parser.add_argument('--rate', type=float, default=0, help="Lines/sec per connection (default 0: unthrottled)")
+    parser.add_argument('--window', type=int, default=4096, help="Unanswered lines allowed per connection")
+    parser.add_argument('--batch', type=int, default=256, help="Lines per socket write")
+    parser.add_argument('--distinct', type=int,
+                        help="Distinct lines to cycle through (default 10000, or 200000 with --unique)")
+    parser.add_argument('--unique', action='store_true', help="Jitter byte counts so repeats miss the cache")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help="Write the summary as JSON to this file")
+    args = parser.parse_args(argv)
+    if args.distinct is None:
+        args.distinct = 200000 if args.unique else 10000
+
+    summary = asyncio.run(run_load(args))
+    print(f"{summary['received']} results in {summary['duration_sec']:.1f}s over {args.connections} connections: "
+          f"{summary['records_per_sec']:.0f} records/sec, {summary['errors']} errors", file=sys.stderr)
+    if 'latency_p50_ms' in summary:
+        print(f"latency p50 {summary['latency_p50_ms']:.1f} ms, p99 {summary['latency_p99_ms']:.1f} ms, "
+              f"max {summary['latency_max_ms']:.1f} ms", file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
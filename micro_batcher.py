@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-row predictions into one batched model call.
+
+    The first request to arrive opens a batch; the batch is closed when it holds
+    `max_batch_size` rows or `max_wait` seconds have passed, then `score_fn` runs once on
+    the stacked (n, 15) raw feature matrix and every caller gets its own row back.
+    `score_fn` takes that matrix and returns (labels, confidences).
+    Up to `max_in_flight` batches are scored at once (set it to the number of scoring
+    worker processes so they all stay busy); while every slot is taken, new rows keep
+    collecting into the next batch. Realized batch sizes are kept in a power-of-two
+    histogram.
+    """
+
+    def __init__(self, score_fn, max_batch_size=64, max_wait=0.002, max_in_flight=1):
+        self.score_fn = score_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_in_flight = max_in_flight
+        self._slots = threading.Semaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_in_flight, thread_name_prefix='micro-batch') if max_in_flight > 1 else None
+        self._pending = deque()  # (features, Future)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stop = False
+        self.histogram_bounds = [2 ** i for i in range(max(max_batch_size - 1, 1).bit_length() + 1)]
+        self.histogram = [0] * len(self.histogram_bounds)
+        self.stats = {'batches': 0, 'rows': 0, 'errors': 0}
+
+    def submit(self, features):
+        """Queue one raw feature vector; returns a Future of (label, confidence)."""
+        future = Future()
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+                self._thread.start()
+            self._pending.append((np.asarray(features, dtype=float), future))
+            self._cond.notify()
+        return future
+
+    def predict(self, features, timeout=30):
+        return self.submit(features).result(timeout)
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+
+    def status(self):
+        with self._cond:
+            batches = self.stats['batches']
+            return dict(
+                self.stats,
+                max_batch_size=self.max_batch_size,
+                max_wait_ms=self.max_wait * 1000,
+                max_in_flight=self.max_in_flight,
+                avg_batch_size=self.stats['rows'] / batches if batches else 0.0,
+                batch_size_histogram={f"le_{bound}": count for bound, count in zip(self.histogram_bounds, self.histogram)},
+            )
+
+    def _run(self):
+        while True:
+            # Only open a batch once it can be scored right away
+            self._slots.acquire()
+            with self._cond:
+                while not self._pending and not self._stop:
+                    self._cond.wait()
+                if self._stop and not self._pending:
+                    self._slots.release()
+                    return
+                # A batch is open: wait for it to fill up or for max_wait to pass
+                deadline = time.monotonic() + self.max_wait
+                while len(self._pending) < self.max_batch_size and not self._stop:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = [self._pending.popleft() for _ in range(min(len(self._pending), self.max_batch_size))]
+            if self._executor is None:
+                self._score(batch)
+            else:
+                self._executor.submit(self._score, batch)
+
+    def _score(self, batch):
+        futures = [future for _, future in batch]
+        try:
+            labels, confidences = self.score_fn(np.vstack([features for features, _ in batch]))
+        except Exception as e:
+            with self._cond:
+                self.stats['errors'] += 1
+            for future in futures:
+                future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+        with self._cond:
+            self.stats['batches'] += 1
+            self.stats['rows'] += len(batch)
+            for i, bound in enumerate(self.histogram_bounds):
+                if len(batch) <= bound:
+                    self.histogram[i] += 1
+                    break
+        for future, label, confidence in zip(futures, labels, confidences):
+            future.set_result((str(label), float(confidence)))
@@ -0,0 +1,206 @@
+import hashlib
+import os
+import threading
+import time
+
+from joblib import load
+
+from feature_encoder import FeatureEncoder, feature_columns
+from inference import MODELS_DIR, PREFILTER_FILE, InferenceEngine, TreePrefilter
+
+ENCODER_FILES = {
+    'protocol_type': 'protocol_type_encoder.pkl',
+    'service': 'service_encoder.pkl',
+    'flag': 'flag_encoder.pkl',
+}
+SCALER_FILE = 'scaler.pkl'
+LABEL_ENCODER_FILE = 'label_encoder.pkl'
+
+# Artifacts at least this big are loaded with mmap_mode='r', so their numpy arrays are
+# paged in from the file (and shared between processes) instead of copied onto the heap
+MMAP_THRESHOLD = 16 * 1024 * 1024
+
+
+class ModelVersion:
+    """One loaded, immutable set of artifacts. Requests hold on to the version they started with."""
+
+    def __init__(self, model_file, encoder, engine, hashes, prefilter=None):
+        self.model_file = model_file
+        self.encoder = encoder
+        self.engine = engine
+        self.prefilter = prefilter  # cascade first stage, None when models/ has no prefilter_tree.npz
+        self.hashes = hashes
+        self.version = hashlib.sha256(''.join(hashes[name] for name in sorted(hashes)).encode()).hexdigest()[:12]
+        self.loaded_at = time.time()
+
+    def describe(self):
+        return {
+            'model_file': self.model_file,
+            'version': self.version,
+            'loaded_at': self.loaded_at,
+            'artifacts': {name: digest[:12] for name, digest in self.hashes.items()},
+        }
+
+
+class ModelRegistry:
+    """
+    Loads the model, scaler and encoders from models/ on first use and swaps in a new
+    version when any of those files change on disk.
+
+    Paths resolve relative to this package, not the working directory. Loaded objects
+    are cached by the SHA-256 of their file, so a reload only unpickles the files whose
+    content actually changed. A new version is built next to the old one and published
+    with a single reference assignment; current() never blocks on a reload once a
+    version exists, and requests already holding the old version finish with it.
+    """
+
+    def __init__(self, model_file='xgboost_best_model.pkl', models_dir=MODELS_DIR, check_interval=2.0):
+        self.model_file = model_file
+        self.models_dir = models_dir
+        self.check_interval = check_interval
+        self._current = None
+        self._signature = None  # (mtime, size) of every artifact behind _current
+        self._failed_signature = None  # files that last failed to load; not retried until they change
+        self._artifacts = {}  # sha256 -> loaded object
+        self._load_lock = threading.Lock()
+        self._last_check = 0.0
+        self._listeners = []
+        self.stats = {'loads': 0, 'swaps': 0, 'failed_reloads': 0, 'artifact_cache_hits': 0}
+        self.last_error = None
+
+    def current(self):
+        """The active ModelVersion, loading it on the first call and reloading if files changed."""
+        version = self._current
+        if version is None:
+            with self._load_lock:
+                if self._current is None:
+                    self._swap(self._build(self.model_file))
+                return self._current
+        if self.check_interval is not None and time.monotonic() - self._last_check >= self.check_interval:
+            self._maybe_reload()
+        return self._current
+
+    def subscribe(self, listener):
+        """listener(new_version) is called after every hot swap."""
+        self._listeners.append(listener)
+
+    def set_model(self, model_file):
+        """Switch to another model file in models/; raises ValueError if it cannot serve requests."""
+        with self._load_lock:
+            self._swap(self._build(model_file))
+            self.model_file = model_file
+        return self._current
+
+    def reload(self):
+        """Reload now if anything changed; returns True if a new version was published."""
+        with self._load_lock:
+            return self._reload_locked()
+
+    def status(self):
+        version = self._current
+        return dict(
+            self.stats,
+            loaded=version is not None,
+            current=version.describe() if version else None,
+            cached_artifacts=len(self._artifacts),
+            last_error=self.last_error,
+        )
+
+    def _maybe_reload(self):
+        # Only one thread checks; the others keep serving the current version
+        if not self._load_lock.acquire(blocking=False):
+            return
+        try:
+            self._reload_locked()
+        finally:
+            self._load_lock.release()
+
+    def _reload_locked(self):
+        self._last_check = time.monotonic()
+        signature = self._file_signature(self.model_file)
+        if self._current is not None and signature in (self._signature, self._failed_signature):
+            return False
+        try:
+            version = self._build(self.model_file)
+        except Exception as e:
+            # Half-written or broken files: keep serving the old version until they change again
+            self._failed_signature = signature
+            self.stats['failed_reloads'] += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            print(f"Model reload failed, keeping version {self._current.version if self._current else None}: {e}")
+            return False
+        if self._current is not None and version.version == self._current.version:
+            self._signature = signature
+            return False
+        self._swap(version)
+        return True
+
+    def _swap(self, version):
+        previous = self._current
+        self._signature = self._file_signature(version.model_file)
+        self._current = version
+        self._failed_signature = None
+        self._last_check = time.monotonic()
+        self.last_error = None
+        # Keep only the artifacts the live version uses
+        self._artifacts = {digest: self._artifacts[digest] for digest in version.hashes.values()}
+        if previous is not None:
+            self.stats['swaps'] += 1
+            print(f"Model hot-swapped: {previous.version} -> {version.version} ({version.model_file})")
+            for listener in self._listeners:
+                try:
+                    listener(version)
+                except Exception as e:
+                    print(f"Model swap listener failed: {e}")
+
+    def _build(self, model_file):
+        files = self._files(model_file)
+        loaded = {}
+        hashes = {}
+        for name, path in files.items():
+            loaded[name], hashes[name] = self._load_artifact(path)
+        model = loaded['model']
+        expected = len(feature_columns)
+        n_features = getattr(model, 'n_features_in_', expected)
+        if n_features != expected:
+            raise ValueError(f"{model_file} expects {n_features} features; the app encodes {expected}")
+        encoder = FeatureEncoder(loaded['protocol_type'], loaded['service'], loaded['flag'])
+        engine = InferenceEngine(model, loaded['scaler'], loaded['label_encoder'])
+        self.stats['loads'] += 1
+        return ModelVersion(model_file, encoder, engine, hashes, prefilter=loaded.get('prefilter'))
+
+    def _files(self, model_file):
+        files = {name: os.path.join(self.models_dir, filename) for name, filename in ENCODER_FILES.items()}
+        files['scaler'] = os.path.join(self.models_dir, SCALER_FILE)
+        files['label_encoder'] = os.path.join(self.models_dir, LABEL_ENCODER_FILE)
+        files['model'] = os.path.join(self.models_dir, model_file)
+        # Optional; created by train_prefilter.py
+        prefilter = os.path.join(self.models_dir, PREFILTER_FILE)
+        if os.path.exists(prefilter):
+            files['prefilter'] = prefilter
+        return files
+
+    def _file_signature(self, model_file):
+        signature = []
+        for path in self._files(model_file).values():
+            try:
+                stat = os.stat(path)
+                signature.append((path, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append((path, None, None))
+        return tuple(signature)
+
+    def _load_artifact(self, path):
+        with open(path, 'rb') as f:
+            digest = hashlib.file_digest(f, 'sha256').hexdigest() if hasattr(hashlib, 'file_digest') \
+                else hashlib.sha256(f.read()).hexdigest()
+        if digest in self._artifacts:
+            self.stats['artifact_cache_hits'] += 1
+            return self._artifacts[digest], digest
+        if path.endswith('.npz'):
+            artifact = TreePrefilter.load(path)
+        else:
+            mmap_mode = 'r' if os.path.getsize(path) >= MMAP_THRESHOLD else None
+            artifact = load(path, mmap_mode=mmap_mode)
+        self._artifacts[digest] = artifact
+        return artifact, digest
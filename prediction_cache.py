@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from feature_encoder import record_signature
+
+
+class PredictionCache:
+    """
+    LRU cache of (label, confidence) keyed on a record's normalized raw features.
+
+    Scans and floods repeat the same connection signature over and over, so a hit
+    skips encoding, scaling and the model entirely. Every lookup passes the model
+    version it would score with; when that changes the whole cache is dropped, so a
+    result is never served from a model other than the one that produced it.
+    """
+
+    def __init__(self, capacity=100000, ttl=300):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._entries = OrderedDict()  # signature -> ((label, confidence), expires_at)
+        self._version = None
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    def get_many(self, keys, version):
+        """Returns one (label, confidence) or None per key."""
+        now = time.monotonic()
+        found = []
+        with self._lock:
+            self._check_version(version)
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] <= now:
+                    del self._entries[key]
+                    self.stats['expirations'] += 1
+                    entry = None
+                if entry is None:
+                    self.stats['misses'] += 1
+                    found.append(None)
+                else:
+                    self._entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    found.append(entry[0])
+        return found
+
+    def get(self, key, version):
+        return self.get_many([key], version)[0]
+
+    def put_many(self, items, version):
+        """Store (key, (label, confidence)) pairs scored with `version`."""
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            if version != self._version:
+                # Scored with a model that has since been swapped out (or in); don't keep it
+                return
+            for key, value in items:
+                self._entries[key] = (value, expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def put(self, key, value, version):
+        self.put_many([(key, value)], version)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.stats['invalidations'] += 1
+
+    def status(self):
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return dict(self.stats, size=len(self._entries), capacity=self.capacity, ttl=self.ttl,
+                        version=self._version, hit_rate=self.stats['hits'] / lookups if lookups else 0.0)
+
+    def _check_version(self, version):
+        # Caller holds the lock. A lookup with a different model version empties the cache
+        if version == self._version:
+            return
+        if self._entries:
+            self._entries.clear()
+            self.stats['invalidations'] += 1
+        self._version = version
+
+
+def score_records(records, encoder, score_fn, cache=None, version=None, encoded=None):
+    """
+    Score a list of raw record dicts, answering repeated signatures from `cache`.
+
+    Only the cache misses are encoded and passed to score_fn (an (n, 15) matrix ->
+    (labels, confidences)), and a signature repeated within the batch is scored once.
+    `encoded` is encoder.encode_batch(records) when the caller already has it.
+    Returns one (prediction, confidence, error) tuple per record.
+    """
+    results = [None] * len(records)
+    if cache is None:
+        misses = list(range(len(records)))
+        duplicates = {}
+    else:
+        keys = [record_signature(record) for record in records]
+        first = {}  # signature -> index of the first miss with it
+        duplicates = {}  # index of a later miss -> index of the first one
+        for i, hit in enumerate(cache.get_many(keys, version)):
+            if hit is not None:
+                results[i] = (hit[0], hit[1], None)
+            elif keys[i] in first:
+                duplicates[i] = first[keys[i]]
+            else:
+                first[keys[i]] = i
+        misses = list(first.values())
+
+    if misses:
+        if encoded is None:
+            features, errors = encoder.encode_batch([records[i] for i in misses])
+        else:
+            features = encoded[0][misses]
+            errors = {j: encoded[1][i] for j, i in enumerate(misses) if i in encoded[1]}
+        valid = [j for j in range(len(misses)) if j not in errors]
+        for j, message in errors.items():
+            results[misses[j]] = (None, None, message)
+        if valid:
+            labels, confidences = score_fn(features[np.array(valid, dtype=int)])
+            for j, label, confidence in zip(valid, labels, confidences):
+                results[misses[j]] = (str(label), float(confidence), None)
+            if cache is not None:
+                cache.put_many([(keys[misses[j]], results[misses[j]][:2]) for j in valid], version)
+    for i, source in duplicates.items():
+        results[i] = results[source]
+    return results
@@ -0,0 +1,51 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ProfileCache:
+    """
+    Per-user cache of the small profile row (username, email, role, profile_image)
+    that every page render needs.
+
+    Entries are filled through `loader(user_id)` on a miss and must be invalidated
+    explicitly whenever a user's row changes. The TTL is only a backstop for changes
+    made by other processes; within one process invalidate() keeps it exact.
+    """
+
+    def __init__(self, loader, ttl=60, max_entries=10000):
+        self._loader = loader
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # user_id -> (profile or None, expires_at)
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(user_id)
+                self.stats['hits'] += 1
+                return entry[0]
+            self.stats['misses'] += 1
+        profile = self._loader(user_id)
+        self.put(user_id, profile)
+        return profile
+
+    def put(self, user_id, profile):
+        with self._lock:
+            self._entries[user_id] = (profile, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self.stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
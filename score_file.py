@@ -0,0 +1,210 @@
+"""
+Score a large connection-log file offline, in fixed-size chunks.
+
+Reads CSV (with a header, or --no-header for files laid out exactly like
+feature_columns) or JSON lines, runs each chunk through the same encoders, scaler
+and model as the web app, and writes one result per input row as it goes, so memory
+use does not depend on the size of the file. Rows that cannot be encoded (unknown
+service, bad number, broken JSON line) get an error instead of stopping the run.
+
+With --events the input is raw connection events (timestamp, src_host, dst_host,
+protocol_type, service, flag, src_bytes, dst_bytes, logged_in) in time order, and
+the window features are computed on the fly by TrafficFeatureExtractor.
+
+    python score_file.py traffic.csv -o predictions.csv
+    python score_file.py traffic.jsonl --to-db --user-id 1
+    python score_file.py conn_log.csv --events -o predictions.csv
+    python score_file.py traffic.csv --cascade 0.99 -o predictions.csv
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+
+from feature_encoder import feature_columns
+from inference import MODELS_DIR, PREFILTER_FILE, Cascade, TreePrefilter, load_scoring_pipeline
+from prediction_cache import PredictionCache, score_records
+from traffic_features import EVENT_FIELDS, EventError, TrafficFeatureExtractor
+
+
+def read_records(stream, fmt, header=True, fieldnames=feature_columns):
+    """Yield one dict per input row; broken JSON lines are yielded as {'_error': ...}."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream) if header else csv.DictReader(stream, fieldnames=fieldnames)
+        yield from reader
+        return
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield {'_error': f"Invalid JSON: {e}"}
+            continue
+        yield record if isinstance(record, dict) else {'_error': 'Expected a JSON object'}
+
+
+def extract_features(events, extractor):
+    """Yield the feature record for each raw connection event; bad events become {'_error': ...}."""
+    for event in events:
+        if '_error' in event:
+            yield event
+            continue
+        try:
+            yield extractor.process(event)
+        except EventError as e:
+            yield {'_error': str(e)}
+
+
+def score_chunk(records, encoder, score_fn, cache=None, keep_features=False):
+    """
+    Returns a list of (prediction, confidence, error) tuples, one per record. With
+    keep_features, returns (results, features) instead, where features holds each
+    record's encoded vector (None where it was not scored) for the detections table.
+    """
+    broken = {i: record['_error'] for i, record in enumerate(records) if '_error' in record}
+    if not broken and not keep_features:
+        return score_records(records, encoder, score_fn, cache)
+    rows = [i for i in range(len(records)) if i not in broken]
+    batch = [records[i] for i in rows]
+    encoded = encoder.encode_batch(batch) if keep_features else None
+    scored = score_records(batch, encoder, score_fn, cache, encoded=encoded)
+    results = [(None, None, broken.get(i)) for i in range(len(records))]
+    features = [None] * len(records)
+    for j, (i, result) in enumerate(zip(rows, scored)):
+        results[i] = result
+        if encoded is not None and result[2] is None:
+            features[i] = encoded[0][j]
+    return (results, features) if keep_features else results
+
+
+class ResultWriter:
+    """Writes results incrementally as CSV or JSON lines, chosen by file extension."""
+
+    def __init__(self, stream, fmt):
+        self.stream = stream
+        self.fmt = fmt
+        if fmt == 'csv':
+            self.csv = csv.writer(stream)
+            self.csv.writerow(['row', 'prediction', 'confidence', 'error'])
+
+    def write(self, first_row, results):
+        for offset, (prediction, confidence, error) in enumerate(results):
+            row = first_row + offset
+            if self.fmt == 'csv':
+                self.csv.writerow([row, prediction or '', '' if confidence is None else f"{confidence:.6f}", error or ''])
+            else:
+                self.stream.write(json.dumps({'row': row, 'prediction': prediction,
+                                              'confidence': confidence, 'error': error}) + '\n')
+
+
+def detect_format(path, fmt):
+    if fmt != 'auto':
+        return fmt
+    return 'jsonl' if path.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a connection-log file with the IDS model.")
+    parser.add_argument('input', help="CSV or JSON-lines file with the 15 model feature columns")
+    parser.add_argument('-o', '--output', help="Write predictions here (.csv or .jsonl); default stdout")
+    parser.add_argument('--format', choices=['auto', 'csv', 'jsonl'], default='auto', help="Input format")
+    parser.add_argument('--no-header', action='store_true',
+                        help="CSV has no header row; columns follow feature_columns (or the event fields with --events)")
+    parser.add_argument('--events', action='store_true',
+                        help="Input is raw connection events; compute the window features from them")
+    parser.add_argument('--window-seconds', type=float, default=2.0, help="Time window for --events (default 2)")
+    parser.add_argument('--host-window', type=int, default=100,
+                        help="Connection window for the dst_host_* features with --events (default 100)")
+    parser.add_argument('--chunk-size', type=int, default=10000, help="Rows scored per batch (default 10000)")
+    parser.add_argument('--cache-size', type=int, default=100000,
+                        help="Remember this many distinct records so repeats skip the model (0 disables)")
+    parser.add_argument('--model', default='xgboost_best_model.pkl', help="Model file inside models/")
+    parser.add_argument('--cascade', type=float, metavar='THRESHOLD',
+                        help="Let the decision-tree pre-filter answer rows it is this confident about")
+    parser.add_argument('--to-db', action='store_true', help="Also store predictions in the detections table")
+    parser.add_argument('--user-id', type=int, help="User the detections are recorded for (required with --to-db)")
+    args = parser.parse_args(argv)
+
+    if args.to_db and args.user_id is None:
+        parser.error("--to-db requires --user-id")
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be positive")
+    if args.cascade is not None and not 0.0 < args.cascade <= 1.0:
+        parser.error("--cascade must be in (0, 1]")
+
+    encoder, engine = load_scoring_pipeline(args.model)
+    cache = PredictionCache(capacity=args.cache_size, ttl=float('inf')) if args.cache_size > 0 else None
+    score_fn = engine.predict_batch
+    cascade = None
+    if args.cascade is not None:
+        prefilter = TreePrefilter.load(os.path.join(MODELS_DIR, PREFILTER_FILE))
+        cascade = Cascade(threshold=args.cascade)
+        score_fn = lambda features: cascade.predict_batch(features, prefilter, engine.predict_batch)
+
+    detection_writer = None
+    if args.to_db:
+        # Reuse the app's pooled, batched detection writer (and its counter/rollup hooks).
+        # Offline scoring would rather wait for the database than drop rows.
+        from app import detection_writer
+        detection_writer.put_timeout = 60
+
+    in_fmt = detect_format(args.input, args.format)
+    out_fmt = 'jsonl' if args.output and args.output.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+    output = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+
+    total = scored = failed = 0
+    started = last_report = time.monotonic()
+    try:
+        with open(args.input, newline='', encoding='utf-8-sig') as stream:
+            writer = ResultWriter(output, out_fmt)
+            records = read_records(stream, in_fmt, header=not args.no_header,
+                                   fieldnames=EVENT_FIELDS if args.events else feature_columns)
+            if args.events:
+                extractor = TrafficFeatureExtractor(window_seconds=args.window_seconds, host_window=args.host_window)
+                records = extract_features(records, extractor)
+            while True:
+                chunk = list(itertools.islice(records, args.chunk_size))
+                if not chunk:
+                    break
+                if detection_writer is None:
+                    results = score_chunk(chunk, encoder, score_fn, cache)
+                else:
+                    results, features = score_chunk(chunk, encoder, score_fn, cache, keep_features=True)
+                    detection_writer.record_many(
+                        (prediction, confidence, args.user_id, vector)
+                        for (prediction, confidence, error), vector in zip(results, features) if error is None
+                    )
+                writer.write(total + 1, results)
+                total += len(chunk)
+                chunk_failed = sum(1 for result in results if result[2] is not None)
+                failed += chunk_failed
+                scored += len(chunk) - chunk_failed
+
+                now = time.monotonic()
+                if now - last_report >= 5:
+                    last_report = now
+                    print(f"{total} rows, {total / (now - started):.0f} rows/sec", file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if detection_writer is not None:
+            detection_writer.stop()
+
+    elapsed = max(time.monotonic() - started, 1e-9)
+    print(f"Scored {scored} rows ({failed} failed) in {elapsed:.2f}s, {total / elapsed:.0f} rows/sec", file=sys.stderr)
+    if cascade is not None:
+        status = cascade.status()
+        print(f"Cascade: pre-filter answered {status['prefilter_rate']:.1%} of {status['records']} scored rows "
+              f"at threshold {status['threshold']}", file=sys.stderr)
+    if cache is not None:
+        print(f"Prediction cache hit rate {cache.status()['hit_rate']:.1%}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
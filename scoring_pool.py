@@ -0,0 +1,237 @@
+import atexit
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+def _worker_main(worker_id, model_file, tasks, results):
+    """Worker process: load the pipeline once, then score micro-batches until told to stop."""
+    from inference import load_scoring_pipeline
+    _, engine = load_scoring_pipeline(model_file)
+    results.put(('ready', worker_id))
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, features = task
+        started = time.perf_counter()
+        try:
+            labels, confidences = engine.predict_batch(features)
+            results.put(('done', task_id, worker_id, (labels, confidences), time.perf_counter() - started, len(features)))
+        except Exception as e:
+            results.put(('error', task_id, worker_id, f"{type(e).__name__}: {e}", time.perf_counter() - started, len(features)))
+
+
+class _Worker:
+    def __init__(self, worker_id, process, tasks):
+        self.id = worker_id
+        self.process = process
+        self.tasks = tasks
+        self.outstanding = set()  # task ids sent to this worker and not answered yet
+
+
+class ScoringPool:
+    """
+    N worker processes that each hold their own copy of the model, scaler and encoders,
+    so scoring is not limited to one core by the GIL.
+
+    submit() takes an (n, 15) matrix of raw features and returns a Future resolving to
+    (labels, confidences); each batch goes to the worker with the fewest outstanding
+    batches. restart() starts a fresh set of workers (e.g. after a model change) and
+    lets the old ones finish what they already hold before they exit. Workers that die
+    are replaced and the batches they held are failed rather than left hanging.
+    """
+
+    def __init__(self, workers=None, model_file='xgboost_best_model.pkl'):
+        self.workers = workers or os.cpu_count() or 1
+        self.model_file = model_file
+        self._ctx = multiprocessing.get_context('spawn')
+        self._results = self._ctx.Queue()
+        self._active = {}  # worker_id -> _Worker taking new batches
+        self._retiring = {}  # worker_id -> _Worker draining before exit
+        self._futures = {}  # task_id -> Future
+        self._task_ids = itertools.count()
+        self._worker_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._collector = None
+        self._started = False
+        self._closed = False
+        self._broken = None  # set when workers keep dying before they finish loading
+        self._startup_failures = 0
+        self.worker_stats = {}  # live workers only; replaced ones are folded into retired_totals
+        self.retired_totals = {'workers': 0, 'batches': 0, 'rows': 0, 'errors': 0, 'busy_seconds': 0.0}
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for _ in range(self.workers):
+                self._spawn()
+            self._collector = threading.Thread(target=self._collect, name='scoring-pool-collector', daemon=True)
+            self._collector.start()
+        atexit.register(self.close)
+
+    def submit(self, features):
+        if not self._started:
+            self.start()
+        future = Future()
+        task_id = next(self._task_ids)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Scoring pool is closed")
+            if self._broken:
+                raise RuntimeError(self._broken)
+            worker = min(self._active.values(), key=lambda w: len(w.outstanding))
+            worker.outstanding.add(task_id)
+            self._futures[task_id] = future
+            worker.tasks.put((task_id, features))
+        return future
+
+    def score(self, features, timeout=30):
+        """Blocking submit(); returns (labels, confidences)."""
+        return self.submit(features).result(timeout)
+
+    def restart(self, model_file=None):
+        """Graceful restart: new workers take new batches, old ones drain and exit."""
+        with self._lock:
+            if model_file:
+                self.model_file = model_file
+            started = self._started
+            if started:
+                old = self._active
+                self._active = {}
+                self._broken = None
+                self._startup_failures = 0
+                for _ in range(self.workers):
+                    self._spawn()
+                for worker in old.values():
+                    self._retiring[worker.id] = worker
+                    self.worker_stats[worker.id]['state'] = 'retiring'
+                    worker.tasks.put(None)
+        if not started:
+            self.start()
+
+    def close(self, timeout=10):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            workers = list(self._active.values()) + list(self._retiring.values())
+            for worker in self._active.values():
+                worker.tasks.put(None)
+        for worker in workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+    def status(self):
+        with self._lock:
+            workers = []
+            for worker_id, stats in sorted(self.worker_stats.items()):
+                busy = stats['busy_seconds']
+                workers.append(dict(stats, id=worker_id, rows_per_sec=stats['rows'] / busy if busy else 0.0))
+            return {
+                'workers': self.workers,
+                'model_file': self.model_file,
+                'pending': len(self._futures),
+                'broken': self._broken,
+                'per_worker': workers,
+                'retired': dict(self.retired_totals),
+            }
+
+    def _spawn(self):
+        # Caller holds the lock. Each worker gets its own task queue: a worker killed
+        # while blocked in get() would otherwise leave a shared queue's lock held.
+        worker_id = next(self._worker_ids)
+        tasks = self._ctx.Queue()
+        process = self._ctx.Process(target=_worker_main, args=(worker_id, self.model_file, tasks, self._results),
+                                    name=f'scoring-worker-{worker_id}', daemon=True)
+        process.start()
+        self._active[worker_id] = _Worker(worker_id, process, tasks)
+        self.worker_stats[worker_id] = {
+            'pid': process.pid, 'state': 'starting', 'model_file': self.model_file,
+            'batches': 0, 'rows': 0, 'errors': 0, 'busy_seconds': 0.0,
+        }
+
+    def _collect(self):
+        while True:
+            try:
+                message = self._results.get(timeout=1.0)
+            except queue.Empty:
+                self._check_workers()
+                if self._closed and not self._active and not self._retiring:
+                    break
+                continue
+            if message[0] == 'ready':
+                with self._lock:
+                    stats = self.worker_stats.get(message[1])
+                    if stats and stats['state'] == 'starting':
+                        stats['state'] = 'running'
+                    self._startup_failures = 0
+                continue
+            kind, task_id, worker_id, payload, seconds, rows = message
+            with self._lock:
+                # A worker's last results can arrive after it was retired
+                stats = self.worker_stats.get(worker_id, self.retired_totals)
+                stats['batches'] += 1
+                stats['rows'] += rows
+                stats['busy_seconds'] += seconds
+                if kind == 'error':
+                    stats['errors'] += 1
+                worker = self._active.get(worker_id) or self._retiring.get(worker_id)
+                if worker is not None:
+                    worker.outstanding.discard(task_id)
+                future = self._futures.pop(task_id, None)
+            if future is None:
+                continue
+            if kind == 'done':
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(f"Scoring worker {worker_id} failed: {payload}"))
+
+    def _forget(self, worker_id):
+        # Caller holds the lock. Keeps worker_stats from growing with every restart.
+        stats = self.worker_stats.pop(worker_id)
+        self.retired_totals['workers'] += 1
+        for key in ('batches', 'rows', 'errors', 'busy_seconds'):
+            self.retired_totals[key] += stats[key]
+
+    def _check_workers(self):
+        failed = []
+        with self._lock:
+            for worker in list(self._retiring.values()):
+                if not worker.process.is_alive():
+                    worker.process.join()
+                    del self._retiring[worker.id]
+                    self._forget(worker.id)
+                    failed.extend((task_id, f"Scoring worker {worker.id} exited while scoring")
+                                  for task_id in worker.outstanding)
+            for worker in list(self._active.values()):
+                if worker.process.is_alive():
+                    continue
+                worker.process.join()
+                del self._active[worker.id]
+                if self.worker_stats[worker.id]['state'] == 'starting':
+                    self._startup_failures += 1
+                failed.extend((task_id, f"Scoring worker {worker.id} exited while scoring")
+                              for task_id in worker.outstanding)
+                if self._closed:
+                    self.worker_stats[worker.id]['state'] = 'stopped'
+                    continue
+                self._forget(worker.id)
+                if self._startup_failures >= 2 * self.workers:
+                    # Workers can't even load the model; stop respawning and fail fast
+                    self._broken = f"Scoring workers fail to start (model {self.model_file})"
+                else:
+                    self._spawn()
+            if self._broken and not self._active:
+                failed.extend((task_id, self._broken) for task_id in list(self._futures))
+            futures = [(self._futures.pop(task_id, None), message) for task_id, message in failed]
+        for future, message in futures:
+            if future is not None:
+                future.set_exception(RuntimeError(message))
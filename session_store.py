@@ -0,0 +1,260 @@
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+# ======================
+# Server-side sessions
+# ======================
+# The cookie only carries a random session ID; the session data lives in a store
+# shared by every worker process. A session is written back only when it changed
+# (or is halfway to expiring), and the cookie is only sent when the ID is new.
+
+SESSION_ID_BYTES = 32
+
+
+def new_session_id():
+    return secrets.token_urlsafe(SESSION_ID_BYTES)
+
+
+def _valid_session_id(sid):
+    return 20 <= len(sid) <= 64 and all(c.isalnum() or c in '-_' for c in sid)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False, expires_at=None):
+        def on_update(session):
+            session.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires_at = expires_at
+        self.modified = False
+        self.rotated_from = None
+
+    def regenerate(self):
+        """Move the data to a fresh session ID (call on login, against session fixation)."""
+        if not self.new and self.rotated_from is None:
+            self.rotated_from = self.sid
+        self.sid = new_session_id()
+        self.modified = True
+
+
+class MemoryStore:
+    """In-process LRU of sid -> (data, expires_at, version). Only for single-process servers."""
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._versions = 0
+
+    def get(self, sid, known_version=None):
+        with self._lock:
+            record = self._entries.get(sid)
+            if record is None:
+                return None
+            if record[1] <= time.time():
+                del self._entries[sid]
+                return None
+            self._entries.move_to_end(sid)
+            if known_version is not None and record[2] == known_version:
+                return None, record[1], record[2]
+            return record
+
+    def set(self, sid, data, expires_at):
+        with self._lock:
+            self._versions += 1
+            version = self._versions
+        self.put_record(sid, (data, expires_at, version))
+
+    def put_record(self, sid, record):
+        """Store a (data, expires_at, version) record as-is."""
+        with self._lock:
+            self._entries[sid] = record
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def touch(self, sid, expires_at):
+        with self._lock:
+            record = self._entries.get(sid)
+            if record is not None:
+                self._entries[sid] = (record[0], expires_at, record[2])
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+
+class SqliteStore:
+    """
+    Sessions in a local SQLite file, so every worker process on the host shares them
+    and they survive restarts. Each row carries a version that changes on every write,
+    which lets TieredStore skip re-reading data it already holds.
+    """
+
+    PRUNE_INTERVAL = 3600
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._local = threading.local()
+        self._last_prune = 0.0
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                sid TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                version INTEGER NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, sid, known_version=None):
+        conn = self._connection()
+        if known_version is not None:
+            row = conn.execute("SELECT expires_at, version FROM sessions WHERE sid=?", (sid,)).fetchone()
+            if row is None or row[0] <= time.time():
+                return None
+            if row[1] == known_version:
+                return None, row[0], row[1]
+        row = conn.execute("SELECT data, expires_at, version FROM sessions WHERE sid=?", (sid,)).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return row
+
+    def set(self, sid, data, expires_at):
+        self._connection().execute(
+            "INSERT INTO sessions (sid, data, expires_at, version) VALUES (?, ?, ?, 1) "
+            "ON CONFLICT(sid) DO UPDATE SET data=excluded.data, expires_at=excluded.expires_at, "
+            "version=sessions.version + 1",
+            (sid, data, expires_at)
+        )
+        self._maybe_prune()
+
+    def touch(self, sid, expires_at):
+        self._connection().execute("UPDATE sessions SET expires_at=? WHERE sid=?", (expires_at, sid))
+
+    def delete(self, sid):
+        self._connection().execute("DELETE FROM sessions WHERE sid=?", (sid,))
+
+    def _maybe_prune(self):
+        if time.monotonic() - self._last_prune > self.PRUNE_INTERVAL:
+            self._last_prune = time.monotonic()
+            self._connection().execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+
+
+class TieredStore:
+    """
+    In-process LRU in front of a shared store. The shared store stays the source of
+    truth (another worker may have changed the session), but when the version there
+    matches the cached one only a small (expires_at, version) row is read.
+    """
+
+    def __init__(self, shared, max_entries=10000):
+        self.shared = shared
+        self.local = MemoryStore(max_entries)
+
+    def get(self, sid, known_version=None):
+        cached = self.local.get(sid)
+        record = self.shared.get(sid, known_version=cached[2] if cached else None)
+        if record is None:
+            self.local.delete(sid)
+            return None
+        data, expires_at, version = record
+        if data is None:
+            data = cached[0]
+        self.local.put_record(sid, (data, expires_at, version))
+        return data, expires_at, version
+
+    def set(self, sid, data, expires_at):
+        self.shared.set(sid, data, expires_at)
+        self.local.delete(sid)  # re-read once to learn the new version
+
+    def touch(self, sid, expires_at):
+        self.shared.touch(sid, expires_at)
+        self.local.touch(sid, expires_at)
+
+    def delete(self, sid):
+        self.shared.delete(sid)
+        self.local.delete(sid)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask session interface backed by one of the stores above."""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, ttl=7 * 86400):
+        self.store = store
+        self.ttl = ttl
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and _valid_session_id(sid):
+            record = self.store.get(sid)
+            if record is not None:
+                data, expires_at, _ = record
+                try:
+                    return ServerSession(self.serializer.loads(data), sid=sid, expires_at=expires_at)
+                except Exception:
+                    self.store.delete(sid)
+        return ServerSession(sid=new_session_id(), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            # Logged out (or never had anything): drop the stored copy and the cookie
+            if not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            if session.rotated_from:
+                self.store.delete(session.rotated_from)
+            return
+
+        now = time.time()
+        send_cookie = session.new or session.rotated_from is not None
+        if session.modified or session.new:
+            self.store.set(session.sid, self.serializer.dumps(dict(session)), now + self.ttl)
+            if session.rotated_from:
+                self.store.delete(session.rotated_from)
+        elif session.expires_at is not None and session.expires_at - now < self.ttl / 2:
+            # Sliding expiry, written at most about twice per TTL
+            self.store.touch(session.sid, now + self.ttl)
+            send_cookie = send_cookie or session.permanent
+        if send_cookie:
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
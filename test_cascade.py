@@ -0,0 +1,45 @@
+"""
+Regression test: the shipped pre-filter must not change any answer of the full model
+on static/sample_data.json when the cascade runs at its default threshold.
+
+    python -m pytest test_cascade.py
+"""
+import json
+import os
+import unittest
+import warnings
+
+import numpy as np
+
+from inference import MODELS_DIR, PREFILTER_FILE, Cascade, TreePrefilter, load_scoring_pipeline
+
+SAMPLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'sample_data.json')
+
+
+class CascadeAgreementTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            cls.encoder, cls.engine = load_scoring_pipeline('xgboost_best_model.pkl')
+        cls.prefilter = TreePrefilter.load(os.path.join(MODELS_DIR, PREFILTER_FILE))
+        with open(SAMPLE_FILE) as f:
+            cls.features, errors = cls.encoder.encode_batch(json.load(f))
+        assert not errors
+
+    def test_cascade_labels_match_full_model(self):
+        expected, _ = self.engine.predict_batch(self.features)
+        for threshold in (Cascade().threshold, 0.995, 0.999):
+            labels, _ = Cascade(threshold).predict_batch(self.features, self.prefilter, self.engine.predict_batch)
+            self.assertEqual(int(np.sum(labels != expected)), 0, f"threshold {threshold}")
+
+    def test_prefilter_answers_part_of_the_sample(self):
+        cascade = Cascade()
+        cascade.predict_batch(self.features, self.prefilter, self.engine.predict_batch)
+        answered = sum(cascade.stats['prefilter'].values())
+        self.assertGreater(answered, 0)
+        self.assertLess(answered, len(self.features))
+
+
+if __name__ == '__main__':
+    unittest.main()
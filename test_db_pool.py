@@ -0,0 +1,147 @@
+"""
+Tests for db_pool.ConnectionPool against a stand-in database (no MySQL needed).
+
+    python -m pytest test_db_pool.py
+    python -m unittest test_db_pool
+"""
+import threading
+import time
+import unittest
+
+from db_pool import ConnectionPool, PoolExhaustedError
+
+
+class FakeConnection:
+    """Just enough of a DB-API connection for the pool: rollback, ping and close."""
+
+    def __init__(self, number):
+        self.number = number
+        self.alive = True
+        self.closed = False
+        self.rollbacks = 0
+
+    def rollback(self):
+        if not self.alive:
+            raise RuntimeError("connection lost")
+        self.rollbacks += 1
+
+    def ping(self, reconnect=False):
+        if not self.alive:
+            raise RuntimeError("connection lost")
+
+    def close(self):
+        self.closed = True
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.connections = []
+
+    def connect(self):
+        connection = FakeConnection(len(self.connections))
+        self.connections.append(connection)
+        return connection
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.db = FakeDatabase()
+
+    def make_pool(self, **kwargs):
+        return ConnectionPool(self.db.connect, **kwargs)
+
+    def test_released_connection_is_reused(self):
+        pool = self.make_pool(size=2)
+        first = pool.acquire()
+        raw = first._raw
+        first.close()
+        second = pool.acquire()
+        self.assertIs(second._raw, raw)
+        self.assertEqual(len(self.db.connections), 1)
+        self.assertEqual(raw.rollbacks, 1)  # reset on the way back into the pool
+        self.assertEqual(pool.status()['reused'], 1)
+        second.close()
+
+    def test_size_limit_and_acquire_timeout(self):
+        pool = self.make_pool(size=2)
+        held = [pool.acquire(), pool.acquire()]
+        started = time.monotonic()
+        with self.assertRaises(PoolExhaustedError):
+            pool.acquire(timeout=0.1)
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+        self.assertEqual(len(self.db.connections), 2)
+        self.assertEqual(pool.status()['in_use'], 2)
+        for conn in held:
+            conn.close()
+
+    def test_waiting_acquire_gets_released_connection(self):
+        pool = self.make_pool(size=1)
+        held = pool.acquire()
+        threading.Timer(0.05, held.close).start()
+        conn = pool.acquire(timeout=2)
+        self.assertIs(conn._raw, self.db.connections[0])
+        conn.close()
+
+    def test_failed_health_check_replaces_connection(self):
+        pool = self.make_pool(size=1, health_check_after=0)
+        conn = pool.acquire()
+        stale = conn._raw
+        conn.close()
+        stale.alive = False
+        time.sleep(0.01)
+        conn = pool.acquire()
+        self.assertIsNot(conn._raw, stale)
+        self.assertTrue(stale.closed)
+        self.assertEqual(pool.status()['failed_checks'], 1)
+        conn.close()
+
+    def test_idle_connections_are_evicted(self):
+        pool = self.make_pool(size=2, max_idle=0.05)
+        conn = pool.acquire()
+        old = conn._raw
+        conn.close()
+        time.sleep(0.1)
+        conn = pool.acquire()
+        self.assertIsNot(conn._raw, old)
+        self.assertTrue(old.closed)
+        self.assertEqual(pool.status()['evicted'], 1)
+        conn.close()
+
+    def test_double_close_returns_connection_once(self):
+        pool = self.make_pool(size=2)
+        conn = pool.acquire()
+        conn.close()
+        conn.close()
+        status = pool.status()
+        self.assertEqual(status['idle'], 1)
+        self.assertEqual(status['in_use'], 0)
+
+    def test_counters_under_concurrent_checkouts(self):
+        pool = self.make_pool(size=4)
+        per_thread = 500
+
+        def borrow():
+            for _ in range(per_thread):
+                pool.acquire(timeout=5).close()
+
+        threads = [threading.Thread(target=borrow) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        status = pool.status()
+        self.assertEqual(status['created'] + status['reused'], 8 * per_thread)
+        self.assertEqual(status['created'], len(self.db.connections))
+        self.assertEqual(status['in_use'], 0)
+
+    def test_broken_connection_is_not_returned_to_pool(self):
+        pool = self.make_pool(size=1)
+        conn = pool.acquire()
+        conn._raw.alive = False  # rollback on release fails
+        conn.close()
+        self.assertEqual(pool.status()['idle'], 0)
+        self.assertTrue(self.db.connections[0].closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
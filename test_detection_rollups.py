@@ -0,0 +1,58 @@
+"""
+Tests for detection_rollups bucketing (no MySQL needed).
+
+    python -m pytest test_detection_rollups.py
+"""
+import os
+import time
+import unittest
+from datetime import datetime
+
+import detection_rollups
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.rows = []
+
+    def executemany(self, sql, rows):
+        self.rows.extend(rows)
+
+    def execute(self, sql, params=()):
+        pass
+
+
+class WallClockBucketTest(unittest.TestCase):
+    """Incremental rollups must land in the buckets rebuild()'s DATE_FORMAT produces."""
+
+    def setUp(self):
+        self._tz = os.environ.get('TZ')
+        os.environ['TZ'] = 'Asia/Kolkata'  # UTC+05:30: not a whole number of hours
+        time.tzset()
+
+    def tearDown(self):
+        if self._tz is None:
+            os.environ.pop('TZ', None)
+        else:
+            os.environ['TZ'] = self._tz
+        time.tzset()
+
+    def test_buckets_follow_local_wall_clock(self):
+        moment = datetime(2026, 3, 14, 10, 15, 42)
+        self.assertEqual(detection_rollups.bucket_start(moment, 60), datetime(2026, 3, 14, 10, 15))
+        self.assertEqual(detection_rollups.bucket_start(moment, 3600), datetime(2026, 3, 14, 10, 0))
+        self.assertEqual(detection_rollups.bucket_start(moment, 6 * 3600), datetime(2026, 3, 14, 6, 0))
+        self.assertEqual(detection_rollups.bucket_start(moment, 86400), datetime(2026, 3, 14))
+
+    def test_apply_batch_matches_rebuild_format(self):
+        moment = datetime.now().replace(minute=15, second=42)
+        cursor = RecordingCursor()
+        detection_rollups.apply_batch(cursor, [('anomaly', 0.97, 7, moment)])
+        starts = {row[0]: row[1] for row in cursor.rows}
+        # rebuild() groups by DATE_FORMAT(created_at, '%Y-%m-%d %H:00:00') / '%H:%i:00'
+        self.assertEqual(starts['h'].strftime('%Y-%m-%d %H:%M:%S'), moment.strftime('%Y-%m-%d %H:00:00'))
+        self.assertEqual(starts['m'].strftime('%Y-%m-%d %H:%M:%S'), moment.strftime('%Y-%m-%d %H:%M:00'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+"""
+Tests for the timestamp checks in traffic_features.TrafficFeatureExtractor.
+
+    python -m pytest test_traffic_features.py
+"""
+import time
+import unittest
+from unittest import mock
+
+from traffic_features import EventError, TrafficFeatureExtractor
+
+REPLAY_START = 1_600_000_000.0  # September 2020
+
+
+def event(timestamp, dst_host='10.0.0.1'):
+    return {'timestamp': timestamp, 'dst_host': dst_host, 'protocol_type': 'tcp', 'service': 'http',
+            'flag': 'SF', 'src_bytes': 100, 'dst_bytes': 200}
+
+
+class TimestampSkewTest(unittest.TestCase):
+    def setUp(self):
+        self.extractor = TrafficFeatureExtractor(max_skew=300.0)
+
+    def test_milliseconds_are_rejected(self):
+        with self.assertRaises(EventError):
+            self.extractor.process(event(time.time() * 1000))
+        self.extractor.process(event(REPLAY_START))
+        with self.assertRaises(EventError):
+            self.extractor.process(event(REPLAY_START * 1000))
+
+    def test_near_now_event_in_old_replay_is_rejected(self):
+        clean = TrafficFeatureExtractor(max_skew=300.0)
+        for i in range(10):
+            self.extractor.process(event(REPLAY_START + i))
+            clean.process(event(REPLAY_START + i))
+        with self.assertRaises(EventError):
+            self.extractor.process(event(time.time()))
+        # The replay carries on at its own time, with its windows intact
+        record = self.extractor.process(event(REPLAY_START + 10))
+        self.assertEqual(record, clean.process(event(REPLAY_START + 10)))
+        self.assertEqual(self.extractor._latest, REPLAY_START + 10)
+
+    def test_confirmed_gap_is_accepted(self):
+        self.extractor.process(event(REPLAY_START))
+        with self.assertRaises(EventError):
+            self.extractor.process(event(REPLAY_START + 3600))
+        self.extractor.process(event(REPLAY_START + 3601))
+        self.assertEqual(self.extractor._latest, REPLAY_START + 3601)
+
+    def test_live_stream_resumes_after_idle_period(self):
+        started = time.monotonic()
+        with mock.patch('traffic_features.time.monotonic', return_value=started):
+            self.extractor.process(event(time.time() - 3600))
+        # An hour of real time passes with no events
+        with mock.patch('traffic_features.time.monotonic', return_value=started + 3600):
+            self.extractor.process(event(time.time()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,233 @@
+import math
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from feature_encoder import feature_columns
+
+# ======================
+# Window features from raw connection events
+# ======================
+# The model's traffic features are statistics over recent connections:
+#   2-second window, same destination host:  count, serror_rate, rerror_rate,
+#                                            same_srv_rate, diff_srv_rate
+#   2-second window, same service:           srv_count, srv_rerror_rate
+#   last 100 connections, same dest. host:   dst_host_srv_count, dst_host_serror_rate
+# Both windows are ring buffers of recent connections with per-host / per-service
+# counters next to them: every event adds itself and evicts what fell out of the
+# window, so each update is O(1) (amortized) and memory is bounded by the window sizes.
+
+SERROR_FLAGS = {'S0', 'S1', 'S2', 'S3'}  # SYN errors
+REJ_FLAGS = {'REJ'}  # rejected connections
+COUNT_CAP = 511  # count/srv_count and dst_host_* saturate like in the training data
+DST_HOST_CAP = 255
+
+EVENT_FIELDS = ['timestamp', 'src_host', 'dst_host', 'protocol_type', 'service', 'flag',
+                'src_bytes', 'dst_bytes', 'logged_in']
+
+
+class EventError(ValueError):
+    """Raised for a connection event that is missing a field or has a bad value."""
+
+
+def parse_timestamp(value):
+    """Unix seconds (number or numeric string) or an ISO-8601 string -> float seconds."""
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        try:
+            seconds = datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+        except ValueError:
+            raise EventError(f"Invalid timestamp: {value}")
+    if not math.isfinite(seconds):
+        raise EventError(f"Invalid timestamp: {value}")
+    return seconds
+
+
+def _inc(counter, key, amount=1):
+    counter[key] = counter.get(key, 0) + amount
+
+
+def _dec(counter, key, amount=1):
+    remaining = counter[key] - amount
+    if remaining:
+        counter[key] = remaining
+    else:
+        del counter[key]  # keeps the counters bounded by the window contents
+
+
+def _rate(part, whole):
+    return round(part / whole, 2) if whole else 0.0
+
+
+class TrafficFeatureExtractor:
+    """
+    Turns a stream of connection events into the 15-feature records the encoder
+    takes (same keys as the prediction form).
+
+    Events are dicts with timestamp, dst_host, protocol_type, service, flag,
+    src_bytes, dst_bytes and optionally src_host and logged_in. They must arrive in
+    time order; an event older than the newest one seen is treated as happening at
+    that newest time. Events more than `max_skew` seconds past the clock (e.g. a
+    timestamp in milliseconds) are rejected, and so is a lone event that jumps ahead
+    of the stream (e.g. a near-now time in a replay of old logs), since accepting it
+    would drag every later event forward to its time. Stream time may run ahead of
+    the newest event by `max_skew` plus the real time elapsed since that event
+    arrived, so a live stream resumes after an idle period; a larger jump is only
+    taken once a second event confirms it (a real gap in a replayed log costs one
+    event). Thread-safe; one extractor should see the whole stream, since the
+    windows are per process.
+    """
+
+    def __init__(self, window_seconds=2.0, host_window=100, max_time_window=100000, max_skew=300.0):
+        self.window_seconds = window_seconds
+        self.host_window = host_window
+        self.max_time_window = max_time_window  # hard bound on the time window under floods
+        self.max_skew = max_skew
+        self._lock = threading.Lock()
+        self._latest = None
+        self._latest_arrived = None  # time.monotonic() when _latest was seen
+        self._jump = None  # timestamp of a rejected jump ahead, pending confirmation
+        self.processed = 0
+
+        # Time window: (timestamp, dst_host, service, serror, rerror), oldest first
+        self._recent = deque()
+        self._host_count = {}
+        self._host_serror = {}
+        self._host_rerror = {}
+        self._host_service = {}  # (dst_host, service) -> count
+        self._service_count = {}
+        self._service_rerror = {}
+
+        # Connection window: fixed ring of the last host_window (dst_host, service, serror)
+        self._ring = [None] * host_window
+        self._ring_pos = 0
+        self._ring_host = {}
+        self._ring_host_service = {}
+        self._ring_host_serror = {}
+
+    def process(self, event):
+        """Add one event to the windows and return its feature record; raises EventError."""
+        timestamp, dst_host, service, flag = self._validate(event)
+        serror = flag in SERROR_FLAGS
+        rerror = flag in REJ_FLAGS
+        with self._lock:
+            if timestamp > time.time() + self.max_skew:
+                raise EventError(f"Timestamp too far in the future: {event['timestamp']}")
+            now = time.monotonic()
+            if self._latest is not None and timestamp > self._latest + self.max_skew + (now - self._latest_arrived):
+                confirmed = self._jump is not None and abs(timestamp - self._jump) <= self.max_skew
+                self._jump = None if confirmed else timestamp
+                if not confirmed:
+                    raise EventError(f"Timestamp too far ahead of the stream: {event['timestamp']}")
+            else:
+                self._jump = None
+            if self._latest is not None and timestamp <= self._latest:
+                timestamp = self._latest
+            else:
+                self._latest = timestamp
+                self._latest_arrived = now
+            self._add_recent(timestamp, dst_host, service, serror, rerror)
+            self._add_ring(dst_host, service, serror)
+            self.processed += 1
+
+            host_count = self._host_count[dst_host]
+            service_count = self._service_count[service]
+            same_service = self._host_service[(dst_host, service)]
+            ring_host = self._ring_host[dst_host]
+            features = {
+                'count': min(host_count, COUNT_CAP),
+                'srv_count': min(service_count, COUNT_CAP),
+                'serror_rate': _rate(self._host_serror.get(dst_host, 0), host_count),
+                'rerror_rate': _rate(self._host_rerror.get(dst_host, 0), host_count),
+                'srv_rerror_rate': _rate(self._service_rerror.get(service, 0), service_count),
+                'same_srv_rate': _rate(same_service, host_count),
+                'diff_srv_rate': _rate(host_count - same_service, host_count),
+                'dst_host_srv_count': min(self._ring_host_service[(dst_host, service)], DST_HOST_CAP),
+                'dst_host_serror_rate': _rate(self._ring_host_serror.get(dst_host, 0), ring_host),
+            }
+
+        record = {
+            'protocol_type': event['protocol_type'],
+            'service': service,
+            'flag': flag,
+            'src_bytes': event.get('src_bytes', 0),
+            'dst_bytes': event.get('dst_bytes', 0),
+            'logged_in': event.get('logged_in', 0),
+        }
+        record.update(features)
+        return {field: record[field] for field in feature_columns}
+
+    def process_many(self, events):
+        """Returns (records, errors): one record per event (None if invalid) and {index: message}."""
+        records = []
+        errors = {}
+        for i, event in enumerate(events):
+            try:
+                records.append(self.process(event))
+            except EventError as e:
+                records.append(None)
+                errors[i] = str(e)
+        return records, errors
+
+    def status(self):
+        with self._lock:
+            return {
+                'processed': self.processed,
+                'time_window_connections': len(self._recent),
+                'time_window_hosts': len(self._host_count),
+                'time_window_services': len(self._service_count),
+                'host_window_hosts': len(self._ring_host),
+                'window_seconds': self.window_seconds,
+                'host_window': self.host_window,
+            }
+
+    def _validate(self, event):
+        if not isinstance(event, dict):
+            raise EventError("Expected a JSON object")
+        for field in ('timestamp', 'dst_host', 'protocol_type', 'service', 'flag'):
+            if event.get(field) in (None, ''):
+                raise EventError(f"Missing {field}")
+        # Same case rules the encoder applies, so window keys match what gets scored
+        return (parse_timestamp(event['timestamp']), str(event['dst_host']),
+                str(event['service']).strip().lower(), str(event['flag']).strip().upper())
+
+    def _add_recent(self, timestamp, dst_host, service, serror, rerror):
+        recent = self._recent
+        horizon = timestamp - self.window_seconds
+        while recent and (recent[0][0] <= horizon or len(recent) >= self.max_time_window):
+            _, old_host, old_service, old_serror, old_rerror = recent.popleft()
+            _dec(self._host_count, old_host)
+            _dec(self._host_service, (old_host, old_service))
+            _dec(self._service_count, old_service)
+            if old_serror:
+                _dec(self._host_serror, old_host)
+            if old_rerror:
+                _dec(self._host_rerror, old_host)
+                _dec(self._service_rerror, old_service)
+
+        recent.append((timestamp, dst_host, service, serror, rerror))
+        _inc(self._host_count, dst_host)
+        _inc(self._host_service, (dst_host, service))
+        _inc(self._service_count, service)
+        if serror:
+            _inc(self._host_serror, dst_host)
+        if rerror:
+            _inc(self._host_rerror, dst_host)
+            _inc(self._service_rerror, service)
+
+    def _add_ring(self, dst_host, service, serror):
+        old = self._ring[self._ring_pos]
+        if old is not None:
+            old_host, old_service, old_serror = old
+            _dec(self._ring_host, old_host)
+            _dec(self._ring_host_service, (old_host, old_service))
+            if old_serror:
+                _dec(self._ring_host_serror, old_host)
+        self._ring[self._ring_pos] = (dst_host, service, serror)
+        self._ring_pos = (self._ring_pos + 1) % self.host_window
+        _inc(self._ring_host, dst_host)
+        _inc(self._ring_host_service, (dst_host, service))
+        if serror:
+            _inc(self._ring_host_serror, dst_host)
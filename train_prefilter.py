@@ -0,0 +1,101 @@
+"""
+Train the cascade pre-filter: a shallow decision tree on the 15 encoded features,
+compiled into NumPy arrays in models/prefilter_tree.npz.
+
+The tree is fitted on dataset/Train_data_Dataset.csv with the app's own encoders,
+on a stratified split, to reproduce the full XGBoost model's labels (the cascade's
+job is to answer like the model, cheaper). Half of the held-out part calibrates the
+leaf confidences: how often each leaf agrees with XGBoost there. On the other half
+it reports, for a range of confidence thresholds, how many rows the tree would
+answer by itself, how accurate those answers are, and how often they agree with
+XGBoost. Pick IDS_CASCADE_THRESHOLD from that table.
+
+Before saving, the cascade at --threshold is run over static/sample_data.json;
+if it labels any record differently from XGBoost, nothing is written.
+
+    python train_prefilter.py
+    python train_prefilter.py --max-depth 8 --min-samples-leaf 50 --threshold 0.995
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import warnings
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+from sklearn.tree import DecisionTreeClassifier
+
+from inference import MODELS_DIR, PREFILTER_FILE, Cascade, TreePrefilter, load_scoring_pipeline
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATASET = os.path.join(BASE_DIR, 'dataset', 'Train_data_Dataset.csv')
+SAMPLE_FILE = os.path.join(BASE_DIR, 'static', 'sample_data.json')
+LABEL_COLUMN = 'attack_label'
+THRESHOLDS = [0.9, 0.95, 0.98, 0.99, 0.995, 0.999]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the decision-tree pre-filter for cascade inference.")
+    parser.add_argument('--dataset', default=DATASET)
+    parser.add_argument('--max-depth', type=int, default=10)
+    parser.add_argument('--min-samples-leaf', type=int, default=20)
+    parser.add_argument('--test-size', type=float, default=0.25)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--model', default='xgboost_best_model.pkl', help="Full model to compare against")
+    parser.add_argument('--threshold', type=float, default=Cascade().threshold,
+                        help="Threshold the cascade will run at (IDS_CASCADE_THRESHOLD), checked on --sample")
+    parser.add_argument('--sample', default=SAMPLE_FILE, help="Records the cascade must label like the model")
+    parser.add_argument('-o', '--output', default=os.path.join(MODELS_DIR, PREFILTER_FILE))
+    args = parser.parse_args(argv)
+
+    warnings.filterwarnings('ignore')
+    encoder, engine = load_scoring_pipeline(args.model)
+    with open(args.dataset, newline='', encoding='utf-8-sig') as f:
+        rows = list(csv.DictReader(f))
+    features, errors = encoder.encode_batch(rows)
+    keep = np.array([i not in errors for i in range(len(rows))])
+    features = features[keep]
+    labels = np.array([row[LABEL_COLUMN] for row in rows])[keep]
+    print(f"{len(features)} rows ({len(errors)} skipped: categories the encoders do not know)", file=sys.stderr)
+
+    x_train, x_rest, y_train, y_rest = train_test_split(
+        features, labels, test_size=args.test_size, stratify=labels, random_state=args.seed)
+    x_cal, x_test, _, y_test = train_test_split(x_rest, y_rest, test_size=0.5, stratify=y_rest, random_state=args.seed)
+    tree = DecisionTreeClassifier(max_depth=args.max_depth, min_samples_leaf=args.min_samples_leaf,
+                                  random_state=args.seed).fit(x_train, engine.predict_batch(x_train)[0])
+    prefilter = TreePrefilter.from_sklearn(tree, tree.classes_)
+    prefilter.calibrate(x_cal, engine.predict_batch(x_cal)[0])
+
+    predicted, confidence = prefilter.predict(x_test)
+    full_predicted, _ = engine.predict_batch(x_test)
+    print(f"Tree depth {prefilter.depth}, {int(prefilter.is_leaf.sum())} leaves; "
+          f"held-out accuracy {np.mean(predicted == y_test):.4f} (XGBoost {np.mean(full_predicted == y_test):.4f})")
+    print(f"{'threshold':>9} {'answered':>9} {'accuracy':>9} {'agrees w/ XGB':>14} {'cascade acc.':>13}")
+    for threshold in THRESHOLDS:
+        decided = confidence >= threshold
+        cascade = np.where(decided, predicted, full_predicted)
+        print(f"{threshold:>9} {decided.mean():>9.1%} "
+              f"{np.mean(predicted[decided] == y_test[decided]) if decided.any() else float('nan'):>9.4f} "
+              f"{np.mean(predicted[decided] == full_predicted[decided]) if decided.any() else float('nan'):>14.4f} "
+              f"{np.mean(cascade == y_test):>13.4f}")
+
+    with open(args.sample) as f:
+        sample, _ = encoder.encode_batch(json.load(f))
+    expected, _ = engine.predict_batch(sample)
+    answered, _ = Cascade(args.threshold).predict_batch(sample, prefilter, engine.predict_batch)
+    disagree = int(np.sum(answered != expected))
+    if disagree:
+        print(f"Not saved: at threshold {args.threshold} the cascade labels {disagree} of {len(sample)} "
+              f"records in {args.sample} differently from XGBoost", file=sys.stderr)
+        return 1
+    print(f"Cascade at threshold {args.threshold} matches XGBoost on all {len(sample)} records in {args.sample}")
+
+    prefilter.save(args.output)
+    print(f"Saved {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+import base64
+import json
+from datetime import datetime
+
+import detection_stats
+
+# ======================
+# Keyset-paginated user listing
+# ======================
+# Pages are read with "WHERE (sort_column, id) after the last row seen ... LIMIT n" on
+# an index, so every page costs the same no matter how many users exist or how deep
+# the admin has scrolled. Detection counts come from detection_counts for the page's
+# users only. Search is a prefix match so it can use the username/email indexes too.
+
+SORT_COLUMNS = {
+    'created_at': 'u.created_at',
+    'username': 'u.username',
+    'email': 'u.email',
+}
+MAX_PAGE_SIZE = 200
+
+USER_INDEXES = {
+    'idx_users_created_id': '(created_at, id)',
+    'idx_users_username_id': '(username, id)',
+    'idx_users_email_id': '(email, id)',
+}
+
+
+def ensure_indexes(cursor):
+    """Create the indexes the listing pages on, if they are missing (run by `flask migrate-db`)."""
+    cursor.execute(
+        "SELECT DISTINCT index_name FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = 'users'"
+    )
+    existing = {row['index_name'] if isinstance(row, dict) else row[0] for row in cursor.fetchall()}
+    for name, columns in USER_INDEXES.items():
+        if name not in existing:
+            cursor.execute(f"CREATE INDEX {name} ON users {columns}")
+
+
+def encode_cursor(sort, value, user_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, user_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, sort):
+    """Returns (value, id) from a cursor issued for the same sort; raises ValueError otherwise."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        cursor_sort, value, user_id = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort:
+        raise ValueError("Cursor does not match the sort order")
+    if sort == 'created_at' and value is not None:
+        value = datetime.fromisoformat(value)
+    return value, int(user_id)
+
+
+def list_users(cursor, limit=50, after=None, search=None, sort='created_at', order='desc'):
+    """
+    One page of users as (users, next_cursor). `after` is the next_cursor of the
+    previous page; next_cursor is None on the last page. Raises ValueError on bad input.
+    """
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"sort must be one of {', '.join(SORT_COLUMNS)}")
+    if order not in ('asc', 'desc'):
+        raise ValueError("order must be asc or desc")
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+    column = SORT_COLUMNS[sort]
+    op = '<' if order == 'desc' else '>'
+    where = []
+    params = []
+    if search:
+        pattern = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        where.append("(u.username LIKE %s OR u.email LIKE %s)")
+        params += [pattern, pattern]
+    if after:
+        value, user_id = decode_cursor(after, sort)
+        where.append(f"({column} {op} %s OR ({column} = %s AND u.id {op} %s))")
+        params += [value, value, user_id]
+
+    cursor.execute(f"""
+        SELECT u.id, u.username, u.email, u.role, u.full_name, u.profile_image, u.created_at
+        FROM users u
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY {column} {order.upper()}, u.id {order.upper()}
+        LIMIT %s
+    """, params + [limit + 1])
+    rows = cursor.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    counts = {}
+    if rows:
+        ids = [row['id'] for row in rows]
+        try:
+            cursor.execute(
+                "SELECT user_id, SUM(count) AS detections FROM detection_counts "
+                f"WHERE user_id IN ({', '.join(['%s'] * len(ids))}) GROUP BY user_id",
+                ids
+            )
+            counts = {row['user_id']: int(row['detections']) for row in cursor.fetchall()}
+        except Exception as e:
+            # Fresh database: the counters do not exist until the detection writer's first flush
+            if not detection_stats.is_missing_table(e):
+                raise
+
+    users = [{
+        'id': row['id'],
+        'username': row['username'],
+        'email': row['email'],
+        'role': row['role'],
+        'full_name': row['full_name'],
+        'profile_image': row['profile_image'],
+        'detections': counts.get(row['id'], 0),
+        'joined': row['created_at'].strftime('%Y-%m-%d') if row['created_at'] else '',
+    } for row in rows]
+
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = encode_cursor(sort, last[sort], last['id'])
+    return users, next_cursor